@@ -5,11 +5,14 @@
 desiutil.dust
 =============
 
-Get :math:`E(B-V)` values from the `Schlegel, Finkbeiner & Davis (1998; SFD98)`_ dust map.
+Get :math:`E(B-V)` values from the `Schlegel, Finkbeiner & Davis (1998; SFD98)`_ dust map,
+values from other all-sky maps, and extinction curves.
 
 .. _`Schlegel, Finkbeiner & Davis (1998; SFD98)`: http://adsabs.harvard.edu/abs/1998ApJ...500..525S.
 """
 import os
+import hashlib
+from collections import OrderedDict
 import numpy as np
 from astropy.io.fits import getdata
 from astropy.coordinates import SkyCoord
@@ -18,37 +21,183 @@ from .log import get_logger
 log = get_logger()
 
 
-def ext_odonnell(wave, Rv=3.1):
-    """Return extinction curve from Odonnell (1994), defined in the wavelength
-    range [3030,9091] Angstroms.  Outside this range, use CCM (1989).
+#
+# Polynomial coefficients of the extinction laws, ordered from the highest
+# power down so that they can be evaluated directly with Horner's scheme.
+#
+_ODONNELL_A = (-0.505, 1.647, -0.827, -1.718, 1.137, 0.701, -0.609, 0.104, 1.0)
+_ODONNELL_B = (3.347, -10.805, 5.491, 11.102, -7.985, -3.989, 2.908, 1.952, 0.0)
+_CCM_OPT_A = (0.32999, -0.77530, 0.01979, 0.72085, -0.02427, -0.50447, 0.17699, 1.0)
+_CCM_OPT_B = (-2.09002, 5.30260, -0.62251, -5.38434, 1.07233, 2.28305, 1.41338, 0.0)
+_CCM_FUV_A = (-0.009779, -0.04473, 0.0, 0.0)
+_CCM_FUV_B = (0.1207, 0.2130, 0.0, 0.0)
+
+#
+# Cache of the R_V-independent terms a(x), b(x) of A(lambda)/A(V) = a + b/R_V,
+# keyed by extinction law and wavelength grid.
+#
+_ext_cache = OrderedDict()
+_ext_cache_size = 32
+
+
+def _horner(x, coeffs):
+    """Evaluate a polynomial with Horner's scheme.
+
+    Parameters
+    ----------
+    x : :class:`~numpy.ndarray`
+        Points at which to evaluate the polynomial.
+    coeffs : sequence
+        Polynomial coefficients, highest power first.
+
+    Returns
+    -------
+    :class:`~numpy.ndarray`
+        The polynomial evaluated at `x`.
+    """
+    y = np.full_like(x, coeffs[0])
+    for c in coeffs[1:]:
+        y *= x
+        y += c
+    return y
+
+
+def _ccm_ab(xx):
+    """Compute the CCM (1989) terms a(x), b(x) on a grid of inverse microns.
+    """
+    a = np.zeros_like(xx)
+    b = np.zeros_like(xx)
+
+    # For lambda < 1250 Ang, arbitrarily return Alam=5
+    a[xx > 8.0] = 5.0
+
+    # UV + FUV
+    qUV = (xx > 3.3) & (xx <= 8.0)
+    if qUV.any():
+        xt = xx[qUV]
+        afac = 1.752 - 0.316*xt - 0.104 / ((xt - 4.67)**2 + 0.341)
+        bfac = -3.090 + 1.825*xt + 1.206 / ((xt - 4.62)**2 + 0.263)
+        qq = xt >= 5.9
+        if qq.any():
+            yy = xt[qq] - 5.9
+            afac[qq] += _horner(yy, _CCM_FUV_A)
+            bfac[qq] += _horner(yy, _CCM_FUV_B)
+        a[qUV] = afac
+        b[qUV] = bfac
+
+    # Optical/NIR
+    qOPT = (xx > 1.1) & (xx <= 3.3)
+    if qOPT.any():
+        yy = xx[qOPT] - 1.82
+        a[qOPT] = _horner(yy, _CCM_OPT_A)
+        b[qOPT] = _horner(yy, _CCM_OPT_B)
+
+    # IR; for lambda > 33,333 Ang, arbitrarily extrapolate the IR curve
+    qIR = xx <= 1.1
+    if qIR.any():
+        yy = xx[qIR]**1.61
+        a[qIR] = 0.574*yy
+        b[qIR] = -0.527*yy
+
+    return a, b
+
+
+def _odonnell_ab(xx):
+    """Compute the O'Donnell (1994) terms a(x), b(x) on a grid of inverse microns.
+    """
+    a, b = _ccm_ab(xx)
+    qOPT = (xx >= 1.1) & (xx <= 3.3)
+    if qOPT.any():
+        yy = xx[qOPT] - 1.82
+        a[qOPT] = _horner(yy, _ODONNELL_A)
+        b[qOPT] = _horner(yy, _ODONNELL_B)
+    return a, b
+
+
+_ext_laws = {'odonnell': _odonnell_ab, 'ccm': _ccm_ab}
+
+
+def _ext_ab(wave, law, cache=True):
+    """Return the cached terms a(x), b(x) of an extinction law.
+
+    Parameters
+    ----------
+    wave : :class:`~numpy.ndarray`
+        Vacuum wavelength [Angstroms].
+    law : :class:`str`
+        Name of the extinction law, ``'odonnell'`` or ``'ccm'``.
+    cache : :class:`bool`, optional
+        If ``False``, neither look up nor store the result in the cache.
+
+    Returns
+    -------
+    :func:`tuple`
+        A tuple of two read-only arrays with the same shape as `wave`.
+    """
+    try:
+        func = _ext_laws[law]
+    except KeyError:
+        raise ValueError("Unknown extinction law '{0}'!".format(law))
+    wave = np.ascontiguousarray(wave, dtype=np.float64)
+    key = None
+    if cache:
+        key = (law, wave.shape, hashlib.sha1(wave.tobytes()).hexdigest())
+        try:
+            ab = _ext_cache[key]
+        except KeyError:
+            pass
+        else:
+            _ext_cache.move_to_end(key)
+            return ab
+    a, b = func(10000. / wave)
+    a.flags.writeable = False
+    b.flags.writeable = False
+    if key is not None:
+        _ext_cache[key] = (a, b)
+        while len(_ext_cache) > _ext_cache_size:
+            _ext_cache.popitem(last=False)
+    return a, b
+
+
+def ext_curve(wave, Rv=3.1, law='odonnell', cache=True):
+    """Return extinction curves A(lambda)/A(V) for one or more values of R_V.
+
+    Both extinction laws have the form a(x) + b(x)/R_V.  The terms a(x) and
+    b(x) are evaluated once per wavelength grid and cached, so repeated calls
+    on the same grid, for any R_V, only cost one broadcast operation.
 
     Args:
         wave : 1D array of vacuum wavelength [Angstroms]
-        Rv   : Value of R_V (scalar); default is 3.1
+        Rv   : Value of R_V, scalar or array; default is 3.1
+        law  : Extinction law, either ``'odonnell'`` (default) or ``'ccm'``
+        cache : If ``False``, do not use the cache of evaluated curves
 
     Returns:
-        1D array of A(lambda)/A(V)
+        Array of A(lambda)/A(V). If `Rv` is a scalar, this has the shape of
+        `wave`, otherwise the shape is ``Rv.shape + wave.shape``, *e.g.*
+        (nRv, nwave).
     """
+    a, b = _ext_ab(wave, law, cache)
+    Rv = np.asarray(Rv, dtype=np.float64)
+    if Rv.ndim > 0:
+        Rv = Rv.reshape(Rv.shape + (1,)*a.ndim)
+    return a + b / Rv
 
-    # direct python translation of idlutils/pro/dust/ext_odonnell.pro
 
-    A = np.zeros(wave.shape)
-    xx = 10000. / wave
+def ext_odonnell(wave, Rv=3.1):
+    """Return extinction curve from Odonnell (1994), defined in the wavelength
+    range [3030,9091] Angstroms.  Outside this range, use CCM (1989).
 
-    optical_waves = (xx >= 1.1) & (xx <= 3.3)
-    other_waves = (xx < 1.1) | (xx > 3.3)
+    Args:
+        wave : 1D array of vacuum wavelength [Angstroms]
+        Rv   : Value of R_V, scalar or array; default is 3.1
 
-    if np.sum(optical_waves) > 0:
-        yy = xx[optical_waves] - 1.82
-        afac = (1.0 + 0.104*yy - 0.609*yy**2 + 0.701*yy**3 + 1.137*yy**4 -
-                1.718*yy**5 - 0.827*yy**6 + 1.647*yy**7 - 0.505*yy**8)
-        bfac = (1.952*yy + 2.908*yy**2 - 3.989*yy**3 - 7.985*yy**4 +
-                11.102*yy**5 + 5.491*yy**6 - 10.805*yy**7 + 3.347*yy**8)
-        A[optical_waves] = afac + bfac / Rv
-    if np.sum(other_waves) > 0:
-        A[other_waves] = ext_ccm(wave[other_waves], Rv=Rv)
+    Returns:
+        1D array of A(lambda)/A(V), or 2D array (nRv, nwave) if `Rv` is an array.
+    """
 
-    return A
+    # python translation of idlutils/pro/dust/ext_odonnell.pro
+    return ext_curve(wave, Rv=Rv, law='odonnell')
 
 
 def ext_ccm(wave, Rv=3.1):
@@ -57,65 +206,191 @@ def ext_ccm(wave, Rv=3.1):
 
     Args:
         wave : 1D array of vacuum wavelength [Angstroms]
-        Rv   : Value of R_V (scalar); default is 3.1
+        Rv   : Value of R_V, scalar or array; default is 3.1
 
     Returns:
-        1D array of A(lambda)/A(V)
+        1D array of A(lambda)/A(V), or 2D array (nRv, nwave) if `Rv` is an array.
     """
 
-    # direct python translation of idlutils/pro/dust/ext_ccm.pro
+    # python translation of idlutils/pro/dust/ext_ccm.pro
     # numeric values checked with other implementation
+    return ext_curve(wave, Rv=Rv, law='ccm')
 
-    A = np.zeros(wave.shape)
-    xx = 10000. / wave
 
-    # Limits for CCM fitting function
-    qLO = (xx > 8.0)                   # No data, lambda < 1250 Ang
-    qUV = (xx > 3.3) & (xx <= 8.0)     # UV + FUV
-    qOPT = (xx > 1.1) & (xx <= 3.3)    # Optical/NIR
-    qIR = (xx > 0.3) & (xx <= 1.1)     # IR
-    qHI = (xx <= 0.3)                  # No data, lambda > 33,333 Ang
+def transmission(wave, ebv=None, ra=None, dec=None, Rv=3.1, law='odonnell',
+                 dtype=np.float64, flux=None, chunksize=256,
+                 mapdir=None, scaling=1.):
+    """Return the dust transmission of many spectra on a shared wavelength grid.
 
-    # For lambda < 1250 Ang, arbitrarily return Alam=5
-    if np.sum(qLO) > 0:
-        A[qLO] = 5.0
+    The transmission is :math:`10^{-0.4 A(\\lambda)/A(V) R_V E(B-V)}`.  A single
+    cached extinction curve is combined with the E(B-V) values in an outer
+    product written directly into the output array.
 
-    if np.sum(qUV) > 0:
-        xt = xx[qUV]
-        afac = 1.752 - 0.316*xt - 0.104 / ((xt - 4.67)**2 + 0.341)
-        bfac = -3.090 + 1.825*xt + 1.206 / ((xt - 4.62)**2 + 0.263)
+    Args:
+        wave : 1D array of vacuum wavelength [Angstroms]
+        ebv  : E(B-V) values, scalar or 1D array of length nspec
+        ra, dec : If `ebv` is not set, look up E(B-V) at these coordinates
+            [degrees] in the SFD98 map
+        Rv   : Value of R_V, scalar or array of length nspec; default is 3.1
+        law  : Extinction law, either ``'odonnell'`` (default) or ``'ccm'``
+        dtype : Data type of the result, *e.g.* ``np.float32``; default is ``np.float64``
+        flux : If set, an array of shape (nspec, nwave) that will be
+            *dereddened* in place, *i.e.* divided by the transmission
+        chunksize : Number of spectra processed at a time when dereddening `flux`
+        mapdir, scaling : Passed to :class:`SFDMap` if `ra`, `dec` are used
+
+    Returns:
+        Array (nspec, nwave) of transmission, or (nwave,) if `ebv` is a scalar.
+        If `flux` is set, `flux` itself is returned.
+    """
+    if ebv is None:
+        if ra is None or dec is None:
+            raise ValueError('Pass ebv or ra, dec!')
+        ebv = SFDMap(mapdir=mapdir, scaling=scaling).ebv(ra, dec)
+    ebv = np.asarray(ebv, dtype=np.float64)
+    scalar = ebv.ndim == 0
+    ebv = np.atleast_1d(ebv)
+    Rv = np.asarray(Rv, dtype=np.float64)
+    if Rv.ndim > 0 and Rv.shape != ebv.shape:
+        raise ValueError('Rv must be a scalar or match the shape of ebv!')
+    a, b = _ext_ab(wave, law)
+    if a.ndim != 1:
+        raise ValueError('wave must be a 1D array!')
+    c = -0.4*np.log(10.)
+    if Rv.ndim == 0:
+        # A(lambda)/E(B-V) = R_V*a + b
+        k = (c*(Rv*a + b)).astype(dtype)
+        xa, xb = ebv.astype(dtype), None
+    else:
+        k = None
+        xa, xb = (c*Rv*ebv).astype(dtype), (c*ebv).astype(dtype)
+        a, b = a.astype(dtype), b.astype(dtype)
+
+    def _fill(out, rows):
+        if k is not None:
+            np.multiply(xa[rows, np.newaxis], k, out=out)
+        else:
+            np.multiply(xa[rows, np.newaxis], a, out=out)
+            out += xb[rows, np.newaxis] * b
+        return out
+
+    if flux is not None:
+        if flux.shape != (ebv.size, a.size):
+            raise ValueError('flux must have shape (nspec, nwave)!')
+        buf = np.empty((min(chunksize, ebv.size), a.size), dtype=dtype)
+        for i in range(0, ebv.size, chunksize):
+            rows = slice(i, min(i + chunksize, ebv.size))
+            out = _fill(buf[:rows.stop - rows.start], rows)
+            np.negative(out, out=out)
+            np.exp(out, out=out)
+            flux[rows] *= out
+        return flux
+    out = _fill(np.empty((ebv.size, a.size), dtype=dtype), slice(None))
+    np.exp(out, out=out)
+    if scalar:
+        return out[0]
+    return out
 
-        qq = (xt >= 5.9) & (xt <= 8.0)
-        if np.sum(qq) > 0:
-            Fa = -0.04473*(xt[qq]-5.9)**2 - 0.009779*(xt[qq]-5.9)**3
-            Fb = 0.2130*(xt[qq]-5.9)**2 + 0.1207*(xt[qq]-5.9)**3
-            afac[qq] += Fa
-            bfac[qq] += Fb
 
-        A[qUV] = afac + bfac / Rv
+#
+# In-process cache of band-integrated extinction coefficients, keyed by
+# a content hash of the throughput curves and parameters.
+#
+_band_cache = dict()
 
-    if np.sum(qOPT) > 0:
-        yy = xx[qOPT] - 1.82
-        afac = (1.0 + 0.17699*yy - 0.50447*yy**2 - 0.02427*yy**3 +
-                0.72085*yy**4 + 0.01979*yy**5 - 0.77530*yy**6 + 0.32999*yy**7)
-        bfac = (1.41338*yy + 2.28305*yy**2 + 1.07233*yy**3 -
-                5.38434*yy**4 - 0.62251*yy**5 + 5.30260*yy**6 - 2.09002*yy**7)
-        A[qOPT] = afac + bfac / Rv
 
-    if np.sum(qIR) > 0:
-        yy = xx[qIR]**1.61
-        afac = 0.574*yy
-        bfac = -0.527*yy
-        A[qIR] = afac + bfac / Rv
+def _band_key(filters, Rv, law, dwave):
+    """Return a content hash identifying a band coefficient computation.
+    """
+    h = hashlib.sha1()
+    h.update('{0}:{1!r}:{2}'.format(law, dwave, Rv.shape).encode('ascii'))
+    h.update(Rv.tobytes())
+    for w, t in filters:
+        h.update('{0}:{1}'.format(w.size, t.size).encode('ascii'))
+        h.update(w.tobytes())
+        h.update(t.tobytes())
+    return h.hexdigest()
+
+
+def band_coefficients(filters, Rv=3.1, law='odonnell', dwave=1.0,
+                      cache=True, cachedir=None):
+    """Return band-integrated extinction coefficients A(band)/E(B-V).
+
+    Each coefficient is :math:`R_V A(\\lambda)/A(V)` averaged over the band,
+    weighted by the filter throughput.  All filters are resampled onto one
+    fine wavelength grid, so that the integrals for every filter and every
+    value of R_V reduce to a single matrix product.
 
-    # For lambda > 33,333 Ang, arbitrarily extrapolate the IR curve
-    if np.sum(qHI) > 0:
-        yy = xx[qHI]**1.61
-        afac = 0.574*yy
-        bfac = -0.527*yy
-        A[qHI] = afac + bfac / Rv
+    Results are memoized in-process and, if `cachedir` is set, on disk, keyed
+    by a hash of the content of the throughput curves and the other
+    parameters.
 
-    return A
+    Args:
+        filters : Sequence of (wave, throughput) pairs, one per filter,
+            with wave in vacuum [Angstroms]
+        Rv   : Value of R_V, scalar or array; default is 3.1
+        law  : Extinction law, either ``'odonnell'`` (default) or ``'ccm'``
+        dwave : Step of the integration grid [Angstroms]; default is 1
+        cache : If ``False``, do not use the in-process cache
+        cachedir : If set, directory in which to read and write cached
+            coefficients as ``.npy`` files
+
+    Returns:
+        Array of shape (nfilter,) if `Rv` is a scalar, otherwise
+        ``Rv.shape + (nfilter,)``.
+    """
+    curves = list()
+    for w, t in filters:
+        w = np.ascontiguousarray(w, dtype=np.float64)
+        t = np.ascontiguousarray(t, dtype=np.float64)
+        if w.shape != t.shape or w.ndim != 1:
+            raise ValueError('Filter wavelength and throughput must be 1D arrays of the same size!')
+        curves.append((w, t))
+    if len(curves) == 0:
+        raise ValueError('No filters specified!')
+    Rv = np.array(Rv, dtype=np.float64)
+    key = _band_key(curves, Rv, law, float(dwave))
+    if cache and key in _band_cache:
+        return _band_cache[key].copy()
+    if cachedir is not None:
+        fname = os.path.join(cachedir, 'band_coefficients_{0}.npy'.format(key))
+        if os.path.exists(fname):
+            log.debug("Reading cached band coefficients from %s.", fname)
+            coeff = np.load(fname)
+            if cache:
+                _band_cache[key] = coeff
+            return coeff.copy()
+    wmin = min(w.min() for w, t in curves)
+    wmax = max(w.max() for w, t in curves)
+    nwave = int(np.ceil((wmax - wmin)/dwave)) + 1
+    grid = wmin + dwave*np.arange(nwave)
+    #
+    # Throughput on the common grid, with trapezoid-rule integration weights.
+    #
+    S = np.empty((len(curves), nwave), dtype=np.float64)
+    for k, (w, t) in enumerate(curves):
+        i = np.argsort(w, kind='mergesort')
+        S[k] = np.interp(grid, w[i], t[i], left=0.0, right=0.0)
+    S[:, 1:-1] *= dwave
+    S[:, [0, -1]] *= 0.5*dwave
+    norm = S.sum(axis=1)
+    if np.any(norm <= 0):
+        raise ValueError('Filter throughput must be positive somewhere!')
+    S /= norm[:, np.newaxis]
+    #
+    # A(lambda)/E(B-V) = R_V*a + b.
+    #
+    a, b = _ext_ab(grid, law, cache=False)
+    coeff = np.dot(Rv[..., np.newaxis]*a + b, S.T)
+    if cache:
+        _band_cache[key] = coeff
+    if cachedir is not None:
+        tmpname = fname + '.{0:d}.tmp'.format(os.getpid())
+        with open(tmpname, 'wb') as f:
+            np.save(f, coeff)
+        os.replace(tmpname, fname)
+        log.debug("Wrote cached band coefficients to %s.", fname)
+    return coeff.copy()
 
 
 # The SFDMap and _Hemisphere classes and the _bilinear_interpolate and ebv
@@ -174,9 +449,9 @@ def _bilinear_interpolate(data, y, x):
     xw = x - xfloor
 
     # pixel locations
-    y0 = yfloor.astype(np.int)
+    y0 = yfloor.astype(np.intp)
     y1 = y0 + 1
-    x0 = xfloor.astype(np.int)
+    x0 = xfloor.astype(np.intp)
     x1 = x0 + 1
 
     # clip locations out of range
@@ -198,100 +473,238 @@ class _Hemisphere(object):
     Parameters
     ----------
     fname : :class:`str`
-        File name containing one hemisphere of the dust map.
+        File name containing one hemisphere of the map.
     scaling : :class:`float`
-        Multiplicative factor by which to scale the dust map.
+        Multiplicative factor by which to scale the map.
+    memmap : :class:`bool`, optional
+        If ``True``, memory-map the image instead of reading it into memory.
 
     Attributes
     ----------
     data : :class:`~numpy.ndarray`
-        Pixelated array of dust map values.
+        Pixelated array of map values.
     crpix1, crpix2 : :class:`float`
         World Coordinate System: Represent the 1-indexed
         X and Y pixel numbers of the poles.
     lam_scal : :class:`int`
         Number of pixels from b=0 to b=90 deg.
-    lam_nsgp : :class:`int`
+    sign : :class:`int`
         +1 for the northern hemisphere, -1 for the south.
 
     Notes
     -----
-    Taken in full from https://github.com/kbarbary/sfdmap/
+    Modified from https://github.com/kbarbary/sfdmap/
     """
-    def __init__(self, fname, scaling):
-        self.data, header = getdata(fname, header=True)
-        self.data *= scaling
+    def __init__(self, fname, scaling, memmap=False):
+        self.data, header = getdata(fname, header=True, memmap=memmap)
+        self.scaling = scaling
         self.crpix1 = header['CRPIX1']
         self.crpix2 = header['CRPIX2']
         self.lam_scal = header['LAM_SCAL']
         self.sign = header['LAM_NSGP']  # north = 1, south = -1
 
-    def ebv(self, l, b, interpolate):
+    @property
+    def projection(self):
+        """Parameters that fully define the Lambert projection of this image.
+        """
+        return (self.crpix1, self.crpix2, self.lam_scal, self.sign)
+
+    def xy(self, l, b):
         """Project Galactic longitude/latitude to lambert pixels (See SFD98).
 
         Parameters
         ----------
         l, b : :class:`numpy.ndarray`
             Galactic longitude and latitude.
+
+        Returns
+        -------
+        :func:`tuple`
+            The x, y pixel coordinates.
+        """
+        r = self.lam_scal * np.sqrt(1.0 - self.sign * np.sin(b))
+        x = self.crpix1 - 1.0 + r * np.cos(l)
+        y = self.crpix2 - 1.0 - self.sign * r * np.sin(l)
+        return (x, y)
+
+    def lookup(self, x, y, interpolate):
+        """Get map values at pixel coordinates.
+
+        Parameters
+        ----------
+        x, y : :class:`numpy.ndarray`
+            Pixel coordinates, as returned by :meth:`xy`.
         interpolate : :class:`bool`
             If ``True`` use bilinear interpolation to obtain values.
 
         Returns
         -------
         :class:`~numpy.ndarray`
-            Reddening values.
+            Map values.
         """
-        x = (self.crpix1 - 1.0 +
-             self.lam_scal * np.cos(l) *
-             np.sqrt(1.0 - self.sign * np.sin(b)))
-        y = (self.crpix2 - 1.0 -
-             self.sign * self.lam_scal * np.sin(l) *
-             np.sqrt(1.0 - self.sign * np.sin(b)))
-
-        # Get map values at these pixel coordinates.
         if interpolate:
-            return _bilinear_interpolate(self.data, y, x)
+            values = _bilinear_interpolate(self.data, y, x)
         else:
-            x = np.round(x).astype(np.int)
-            y = np.round(y).astype(np.int)
+            x = np.round(x).astype(np.intp)
+            y = np.round(y).astype(np.intp)
 
             # some valid coordinates are right on the border (e.g., x/y = 4096)
             x = np.clip(x, 0, self.data.shape[1]-1)
             y = np.clip(y, 0, self.data.shape[0]-1)
-            return self.data[y, x]
+            values = self.data[y, x]
+        if self.scaling != 1:
+            values = values * self.scaling
+        return values
 
+    def ebv(self, l, b, interpolate):
+        """Get map values at Galactic longitude/latitude.
 
-class SFDMap(object):
-    """Map of E(B-V) from Schlegel, Finkbeiner and Davis (1998).
+        Parameters
+        ----------
+        l, b : :class:`numpy.ndarray`
+            Galactic longitude and latitude.
+        interpolate : :class:`bool`
+            If ``True`` use bilinear interpolation to obtain values.
+
+        Returns
+        -------
+        :class:`~numpy.ndarray`
+            Reddening values.
+        """
+        return self.lookup(*self.xy(l, b), interpolate)
 
-    Use this class for repeated retrieval of E(B-V) values when
-    there is no way to retrieve all the values at the same time: It keeps
-    a reference to the FITS data from the maps so that each FITS image
-    is read only once.
+
+def _galactic(args, frame='icrs', unit='degree'):
+    """Convert coordinate arguments to Galactic longitude and latitude.
+
+    Parameters
+    ----------
+    args : :class:`tuple`
+        Either a single :class:`~astropy.coordinates.SkyCoord`, a single
+        ``(ra, dec)`` tuple, or ``ra, dec``.
+    frame : :class:`str`, optional, defaults to ``'icrs'``
+        Coordinate frame of ``ra, dec``.
+    unit : :class:`str`, optional, defaults to ``'degree'``
+        Unit of ``ra, dec``.
+
+    Returns
+    -------
+    :func:`tuple`
+        Galactic longitude and latitude in radians as 1D arrays,
+        and a flag that is ``True`` if the input was scalar.
+    """
+    # ADM convert to a frame understood by SkyCoords
+    # ADM (for backwards-compatibility)
+    if frame in ('fk5j2000', 'j2000'):
+        frame = 'fk5'
+
+    # compatibility: treat single argument 2-tuple as (RA, Dec)
+    if (
+            (len(args) == 1) and (type(args[0]) is tuple)
+            and (len(args[0]) == 2)
+    ):
+        args = args[0]
+
+    if len(args) == 1:
+        # treat object as already an astropy.coordinates.SkyCoords
+        try:
+            c = args[0]
+        except AttributeError:
+            raise ValueError("single argument must be "
+                             "astropy.coordinates.SkyCoord")
+
+    elif len(args) == 2:
+        lat, lon = args
+        c = SkyCoord(lat, lon, unit=unit, frame=frame)
+
+    else:
+        raise ValueError("too many arguments")
+
+    # ADM extract Galactic coordinates from astropy
+    l, b = c.galactic.l.radian, c.galactic.b.radian
+
+    # Check if l, b are scalar. If so, convert to 1-d arrays.
+    # ADM use numpy.atleast_1d. Store whether the
+    # ADM passed values were scalars or not
+    return_scalar = not np.atleast_1d(l) is l
+    l, b = np.atleast_1d(l), np.atleast_1d(b)
+    return (l, b, return_scalar)
+
+
+def map_values(maps, *args, **kwargs):
+    """Get values of several all-sky maps at given coordinate(s) in one pass.
+
+    The coordinate transformation to Galactic coordinates is performed
+    only once, and maps that share a pixel projection, *e.g.* the
+    various SFD98 4096 pixel maps, also share the projection to pixel
+    coordinates.
+
+    Parameters
+    ----------
+    maps : :class:`list`
+        A list of :class:`LambertMap` or :class:`HEALPixMap` objects.
+    coordinates : :class:`~astropy.coordinates.SkyCoord` or :class:`~numpy.ndarray`
+        See :meth:`SFDMap.ebv`.
+    frame : :class:`str`, optional, defaults to ``'icrs'``
+        See :meth:`SFDMap.ebv`.
+    unit : :class:`str`, optional, defaults to ``'degree'``
+        See :meth:`SFDMap.ebv`.
+    interpolate : :class:`bool`, optional, defaults to ``True``
+        Interpolate between the map values.
+    chunksize : :class:`int`, optional
+        If set, process the coordinates in chunks of this size, to bound
+        the memory used by temporary arrays.
+
+    Returns
+    -------
+    :class:`list`
+        One array (or scalar) of values for each map.
+    """
+    interpolate = kwargs.get('interpolate', True)
+    chunksize = kwargs.get('chunksize', None)
+    l, b, return_scalar = _galactic(args, frame=kwargs.get('frame', 'icrs'),
+                                    unit=kwargs.get('unit', 'degree'))
+    values = [np.empty_like(l) for m in maps]
+    if chunksize is None:
+        chunksize = max(l.size, 1)
+    for i in range(0, l.size, chunksize):
+        chunk = slice(i, i + chunksize)
+        memo = dict()
+        for m, v in zip(maps, values):
+            m._evaluate(l[chunk], b[chunk], interpolate, memo, v[chunk])
+    if return_scalar:
+        return [v[0] for v in values]
+    return values
+
+
+class LambertMap(object):
+    """All-sky map stored as a pair of Lambert-projected images, one for each
+    Galactic hemisphere, in the format of
+    `Schlegel, Finkbeiner & Davis (1998; SFD98)`_.
+
+    This covers the E(B-V), mask, temperature and 100 micron maps of SFD98,
+    as well as any other map stored the same way.  Each FITS image is read
+    only once, when it is first needed.
 
     Parameters
     ----------
+    north, south : :class:`str`
+        Names of north and south galactic pole FITS files.
     mapdir : :class:`str`, optional, defaults to :envvar:`DUST_DIR`+``/maps``.
-        Directory in which to find dust map FITS images, named
-        ``SFD_dust_4096_ngp.fits`` and ``SFD_dust_4096_sgp.fits``.
+        Directory in which to find the FITS images.
         If not specified, the map directory is derived from the value of
-        the :envvar:`DUST_DIR` environment variable, otherwise an empty
-        string is used.
-    north, south : :class:`str`, optional
-        Names of north and south galactic pole FITS files. Defaults are
-        ``SFD_dust_4096_ngp.fits`` and ``SFD_dust_4096_sgp.fits``
-        respectively.
+        the :envvar:`DUST_DIR` environment variable.
     scaling : :class:`float`, optional, defaults to 1
-        Scale all E(B-V) map values by this multiplicative factor.
-        Pass scaling=0.86 for the recalibration from
-        `Schlafly & Finkbeiner (2011) <http://adsabs.harvard.edu/abs/2011ApJ...737..103S)>`_.
+        Scale all map values by this multiplicative factor.
+    memmap : :class:`bool`, optional, defaults to ``False``
+        Memory-map the FITS images instead of reading them into memory.
 
     Notes
     -----
-    Modified from https://github.com/kbarbary/sfdmap/
+    Images that contain integer values, such as the SFD98 mask, should be
+    read with ``interpolate=False``.
     """
-    def __init__(self, mapdir=None, north="SFD_dust_4096_ngp.fits",
-                 south="SFD_dust_4096_sgp.fits", scaling=1.):
+    def __init__(self, north, south, mapdir=None, scaling=1., memmap=False):
 
         if mapdir is None:
             dustdir = os.environ.get('DUST_DIR')
@@ -312,6 +725,112 @@ class SFDMap(object):
         self.hemispheres = {'north': None, 'south': None}
 
         self.scaling = scaling
+        self.memmap = memmap
+
+    def hemisphere(self, pole):
+        """Return one hemisphere of the map, reading it if necessary.
+
+        Parameters
+        ----------
+        pole : :class:`str`
+            Either ``'north'`` or ``'south'``.
+
+        Returns
+        -------
+        :class:`_Hemisphere`
+            The requested hemisphere.
+        """
+        if self.hemispheres[pole] is None:
+            fname = os.path.join(self.mapdir, self.fnames[pole])
+            self.hemispheres[pole] = _Hemisphere(fname, self.scaling,
+                                                 memmap=self.memmap)
+        return self.hemispheres[pole]
+
+    def _evaluate(self, l, b, interpolate, memo, out):
+        """Fill `out` with the map values at Galactic coordinates `l`, `b`.
+
+        `memo` is shared by all maps evaluated on the same coordinates,
+        and holds the pixel coordinates for each distinct projection.
+        """
+        for pole in ('north', 'south'):
+            if ('pole', pole) not in memo:
+                # Treat north (b>0) separately from south (b<0).
+                mask = (b >= 0) if pole == 'north' else (b < 0)
+                memo[('pole', pole)] = mask if np.any(mask) else None
+            mask = memo[('pole', pole)]
+            if mask is None:
+                continue
+            h = self.hemisphere(pole)
+            key = ('lambert', pole) + h.projection
+            if key not in memo:
+                memo[key] = h.xy(l[mask], b[mask])
+            out[mask] = h.lookup(*memo[key], interpolate)
+
+    def values(self, *args, **kwargs):
+        """Get map value(s) at given coordinate(s).
+
+        Parameters
+        ----------
+        coordinates : :class:`~astropy.coordinates.SkyCoord` or :class:`~numpy.ndarray`
+            See :meth:`SFDMap.ebv`.
+        frame : :class:`str`, optional, defaults to ``'icrs'``
+            See :meth:`SFDMap.ebv`.
+        unit : :class:`str`, optional, defaults to ``'degree'``
+            See :meth:`SFDMap.ebv`.
+        interpolate : :class:`bool`, optional, defaults to ``True``
+            Interpolate between the map values using bilinear interpolation.
+        chunksize : :class:`int`, optional
+            If set, process the coordinates in chunks of this size.
+
+        Returns
+        -------
+        :class:`~numpy.ndarray`
+            Map values at the given locations.
+        """
+        return map_values([self], *args, **kwargs)[0]
+
+    def __repr__(self):
+        return ("{}(mapdir={!r}, north={!r}, south={!r}, scaling={!r})"
+                .format(self.__class__.__name__, self.mapdir,
+                        self.fnames['north'], self.fnames['south'],
+                        self.scaling))
+
+
+class SFDMap(LambertMap):
+    """Map of E(B-V) from Schlegel, Finkbeiner and Davis (1998).
+
+    Use this class for repeated retrieval of E(B-V) values when
+    there is no way to retrieve all the values at the same time: It keeps
+    a reference to the FITS data from the maps so that each FITS image
+    is read only once.
+
+    Parameters
+    ----------
+    mapdir : :class:`str`, optional, defaults to :envvar:`DUST_DIR`+``/maps``.
+        Directory in which to find dust map FITS images, named
+        ``SFD_dust_4096_ngp.fits`` and ``SFD_dust_4096_sgp.fits``.
+        If not specified, the map directory is derived from the value of
+        the :envvar:`DUST_DIR` environment variable, otherwise an empty
+        string is used.
+    north, south : :class:`str`, optional
+        Names of north and south galactic pole FITS files. Defaults are
+        ``SFD_dust_4096_ngp.fits`` and ``SFD_dust_4096_sgp.fits``
+        respectively.
+    scaling : :class:`float`, optional, defaults to 1
+        Scale all E(B-V) map values by this multiplicative factor.
+        Pass scaling=0.86 for the recalibration from
+        `Schlafly & Finkbeiner (2011) <http://adsabs.harvard.edu/abs/2011ApJ...737..103S)>`_.
+    memmap : :class:`bool`, optional, defaults to ``False``
+        Memory-map the FITS images instead of reading them into memory.
+
+    Notes
+    -----
+    Modified from https://github.com/kbarbary/sfdmap/
+    """
+    def __init__(self, mapdir=None, north="SFD_dust_4096_ngp.fits",
+                 south="SFD_dust_4096_sgp.fits", scaling=1., memmap=False):
+        super(SFDMap, self).__init__(north, south, mapdir=mapdir,
+                                     scaling=scaling, memmap=memmap)
 
     def ebv(self, *args, **kwargs):
         """Get E(B-V) value(s) at given coordinate(s).
@@ -331,6 +850,8 @@ class SFDMap(object):
             Any :class:`~astropy.coordinates.SkyCoord` unit.
         interpolate : :class:`bool`, optional, defaults to ``True``
             Interpolate between the map values using bilinear interpolation.
+        chunksize : :class:`int`, optional
+            If set, process the coordinates in chunks of this size.
 
         Returns
         -------
@@ -341,72 +862,88 @@ class SFDMap(object):
         -----
         Modified from https://github.com/kbarbary/sfdmap/
         """
-        # collect kwargs
-        frame = kwargs.get('frame', 'icrs')
-        unit = kwargs.get('unit', 'degree')
-        interpolate = kwargs.get('interpolate', True)
-
-        # ADM convert to a frame understood by SkyCoords
-        # ADM (for backwards-compatibility)
-        if frame in ('fk5j2000', 'j2000'):
-            frame = 'fk5'
-
-        # compatibility: treat single argument 2-tuple as (RA, Dec)
-        if (
-                (len(args) == 1) and (type(args[0]) is tuple)
-                and (len(args[0]) == 2)
-        ):
-            args = args[0]
-
-        if len(args) == 1:
-            # treat object as already an astropy.coordinates.SkyCoords
-            try:
-                c = args[0]
-            except AttributeError:
-                raise ValueError("single argument must be "
-                                 "astropy.coordinates.SkyCoord")
-
-        elif len(args) == 2:
-            lat, lon = args
-            c = SkyCoord(lat, lon, unit=unit, frame=frame)
+        return self.values(*args, **kwargs)
 
-        else:
-            raise ValueError("too many arguments")
 
-        # ADM extract Galactic coordinates from astropy
-        l, b = c.galactic.l.radian, c.galactic.b.radian
+class HEALPixMap(object):
+    """All-sky map in Galactic coordinates stored as a HEALPix array.
 
-        # Check if l, b are scalar. If so, convert to 1-d arrays.
-        # ADM use numpy.atleast_1d. Store whether the
-        # ADM passed values were scalars or not
-        return_scalar = not np.atleast_1d(l) is l
-        l, b = np.atleast_1d(l), np.atleast_1d(b)
+    Requires that healpy is installed.
 
-        # Initialize return array
-        values = np.empty_like(l)
+    Parameters
+    ----------
+    data : :class:`~numpy.ndarray` or :class:`str`
+        HEALPix map values, or the name of a FITS file that can be read by
+        :func:`healpy.read_map`.  Arrays, including memory-mapped arrays,
+        are used without copying.
+    nest : :class:`bool`, optional, defaults to ``False``
+        If ``True``, the map uses NESTED pixel ordering, otherwise RING.
+    scaling : :class:`float`, optional, defaults to 1
+        Scale all map values by this multiplicative factor.
+    field : :class:`int`, optional, defaults to 0
+        Column of the FITS file to read, if `data` is a file name.
+    """
+    def __init__(self, data, nest=False, scaling=1., field=0):
+        import healpy as hp
+        if isinstance(data, str):
+            self.fname = data
+            data = hp.read_map(data, field=field, nest=nest, dtype=None)
+        else:
+            self.fname = None
+        self.data = data
+        self.nside = hp.npix2nside(data.size)
+        self.nest = nest
+        self.scaling = scaling
 
-        # Treat north (b>0) separately from south (b<0).
-        for pole, mask in (('north', b >= 0), ('south', b < 0)):
-            if not np.any(mask):
-                continue
+    def _evaluate(self, l, b, interpolate, memo, out):
+        """Fill `out` with the map values at Galactic coordinates `l`, `b`.
 
-            # Initialize hemisphere if it hasn't already been done.
-            if self.hemispheres[pole] is None:
-                fname = os.path.join(self.mapdir, self.fnames[pole])
-                self.hemispheres[pole] = _Hemisphere(fname, self.scaling)
+        `memo` is shared by all maps evaluated on the same coordinates,
+        and holds the pixel indices and weights for each distinct pixelization.
+        """
+        import healpy as hp
+        key = ('healpix', self.nside, self.nest, interpolate)
+        if key not in memo:
+            theta = 0.5*np.pi - b
+            if interpolate:
+                memo[key] = hp.get_interp_weights(self.nside, theta, l,
+                                                  nest=self.nest)
+            else:
+                memo[key] = hp.ang2pix(self.nside, theta, l, nest=self.nest)
+        if interpolate:
+            pix, w = memo[key]
+            out[:] = (self.data[pix] * w).sum(axis=0)
+        else:
+            out[:] = self.data[memo[key]]
+        if self.scaling != 1:
+            out *= self.scaling
 
-            values[mask] = self.hemispheres[pole].ebv(l[mask], b[mask],
-                                                      interpolate)
+    def values(self, *args, **kwargs):
+        """Get map value(s) at given coordinate(s).
 
-        if return_scalar:
-            return values[0]
-        else:
-            return values
+        Parameters
+        ----------
+        coordinates : :class:`~astropy.coordinates.SkyCoord` or :class:`~numpy.ndarray`
+            See :meth:`SFDMap.ebv`.
+        frame : :class:`str`, optional, defaults to ``'icrs'``
+            See :meth:`SFDMap.ebv`.
+        unit : :class:`str`, optional, defaults to ``'degree'``
+            See :meth:`SFDMap.ebv`.
+        interpolate : :class:`bool`, optional, defaults to ``True``
+            Interpolate between the four nearest pixels.
+        chunksize : :class:`int`, optional
+            If set, process the coordinates in chunks of this size.
+
+        Returns
+        -------
+        :class:`~numpy.ndarray`
+            Map values at the given locations.
+        """
+        return map_values([self], *args, **kwargs)[0]
 
     def __repr__(self):
-        return ("SFDMap(mapdir={!r}, north={!r}, south={!r}, scaling={!r})"
-                .format(self.mapdir, self.fnames['north'],
-                        self.fnames['south'], self.scaling))
+        return ("HEALPixMap(nside={!r}, nest={!r}, scaling={!r})"
+                .format(self.nside, self.nest, self.scaling))
 
 
 def ebv(*args, **kwargs):
@@ -416,5 +953,6 @@ def ebv(*args, **kwargs):
     m = SFDMap(mapdir=kwargs.get('mapdir', None),
                north=kwargs.get('north', "SFD_dust_4096_ngp.fits"),
                south=kwargs.get('south', "SFD_dust_4096_sgp.fits"),
-               scaling=kwargs.get('scaling', 1.))
+               scaling=kwargs.get('scaling', 1.),
+               memmap=kwargs.get('memmap', False))
     return m.ebv(*args, **kwargs)
@@ -8,6 +8,8 @@ Test desiutil.dust.
 """
 import unittest
 import os
+from shutil import rmtree
+from tempfile import mkdtemp
 import numpy as np
 from .. import dust
 from pkg_resources import resource_filename
@@ -123,6 +125,186 @@ class TestDust(unittest.TestCase):
         self.assertTrue(np.any(ext_odl_33 == ext_ccm_33))
         self.assertTrue(np.any(ext_odl_33 != ext_ccm_33))
 
+    def test_extinction_broadcast(self):
+        """Test extinction curves for an array of Rv values.
+        """
+        wave = np.arange(1000, 40001, 50)
+        Rv = np.array([2.5, 3.1, 4.0])
+        for law, func in (('odonnell', dust.ext_odonnell),
+                          ('ccm', dust.ext_ccm)):
+            ext = func(wave, Rv=Rv)
+            self.assertEqual(ext.shape, (3, wave.size))
+            for k, r in enumerate(Rv):
+                self.assertTrue(np.allclose(ext[k], func(wave, Rv=r),
+                                            rtol=1e-14, atol=0))
+            ext2 = dust.ext_curve(wave, Rv=Rv, law=law, cache=False)
+            self.assertTrue(np.all(ext == ext2))
+        # Compare to the direct power-series expression in the optical.
+        wave = np.linspace(3100, 9000, 100)
+        yy = 10000. / wave - 1.82
+        afac = (1.0 + 0.104*yy - 0.609*yy**2 + 0.701*yy**3 + 1.137*yy**4 -
+                1.718*yy**5 - 0.827*yy**6 + 1.647*yy**7 - 0.505*yy**8)
+        bfac = (1.952*yy + 2.908*yy**2 - 3.989*yy**3 - 7.985*yy**4 +
+                11.102*yy**5 + 5.491*yy**6 - 10.805*yy**7 + 3.347*yy**8)
+        self.assertTrue(np.allclose(dust.ext_odonnell(wave, Rv=3.1),
+                                    afac + bfac/3.1, rtol=1e-12))
+        with self.assertRaises(ValueError):
+            dust.ext_curve(wave, law='foo')
+
+    def test_extinction_cache(self):
+        """Test caching of extinction curves.
+        """
+        dust._ext_cache.clear()
+        wave = np.arange(3000, 10001, 10, dtype=np.float64)
+        ext1 = dust.ext_odonnell(wave, Rv=3.1)
+        self.assertEqual(len(dust._ext_cache), 1)
+        ext2 = dust.ext_odonnell(wave.copy(), Rv=[3.1, 3.3])
+        self.assertEqual(len(dust._ext_cache), 1)
+        self.assertTrue(np.all(ext1 == ext2[0]))
+        # Returned arrays are not the cached arrays.
+        ext1[:] = 0
+        self.assertTrue(np.all(dust.ext_odonnell(wave, Rv=3.1) == ext2[0]))
+        dust.ext_ccm(wave)
+        self.assertEqual(len(dust._ext_cache), 2)
+        dust.ext_ccm(wave[1:])
+        self.assertEqual(len(dust._ext_cache), 3)
+        dust.ext_curve(wave[2:], cache=False)
+        self.assertEqual(len(dust._ext_cache), 3)
+        dust._ext_cache.clear()
+
+    def test_transmission(self):
+        """Test batch computation of dust transmission.
+        """
+        wave = np.arange(3600, 9800, 0.8)
+        ebv = np.array([0.0, 0.02, 0.1, 0.5, 1.2])
+        t = dust.transmission(wave, ebv)
+        self.assertEqual(t.shape, (ebv.size, wave.size))
+        for k, e in enumerate(ebv):
+            t0 = 10**(-0.4*dust.ext_odonnell(wave, Rv=3.1)*3.1*e)
+            self.assertTrue(np.allclose(t[k], t0, rtol=1e-12))
+        self.assertTrue(np.all(t[0] == 1))
+        #
+        # Scalar E(B-V), float32 and per-spectrum Rv.
+        #
+        t1 = dust.transmission(wave, ebv[3], law='ccm', dtype=np.float32)
+        self.assertEqual(t1.shape, wave.shape)
+        self.assertEqual(t1.dtype, np.float32)
+        t0 = 10**(-0.4*dust.ext_ccm(wave, Rv=3.1)*3.1*ebv[3])
+        self.assertTrue(np.allclose(t1, t0, rtol=1e-5))
+        Rv = np.array([2.5, 3.1, 3.1, 4.0, 5.0])
+        t2 = dust.transmission(wave, ebv, Rv=Rv)
+        for k, e in enumerate(ebv):
+            t0 = 10**(-0.4*dust.ext_odonnell(wave, Rv=Rv[k])*Rv[k]*e)
+            self.assertTrue(np.allclose(t2[k], t0, rtol=1e-12))
+        #
+        # In-place dereddening.
+        #
+        flux = np.ones((ebv.size, wave.size), dtype=np.float32)
+        f = dust.transmission(wave, ebv, Rv=Rv, flux=flux, chunksize=2)
+        self.assertIs(f, flux)
+        self.assertTrue(np.allclose(flux*t2, 1.0, rtol=1e-5))
+        #
+        # Coordinates.
+        #
+        t3 = dust.transmission(wave, ra=self.ra, dec=self.dec,
+                               mapdir=self.mapdir)
+        t0 = dust.transmission(wave, dust.ebv(self.ra, self.dec,
+                                              mapdir=self.mapdir))
+        self.assertTrue(np.all(t3 == t0))
+        with self.assertRaises(ValueError):
+            dust.transmission(wave)
+        with self.assertRaises(ValueError):
+            dust.transmission(wave, ebv, Rv=Rv[:2])
+        with self.assertRaises(ValueError):
+            dust.transmission(wave, ebv, flux=flux[:2])
+
+    def test_band_coefficients(self):
+        """Test band-integrated extinction coefficients.
+        """
+        dust._band_cache.clear()
+        w = np.array([5495.0, 5500.0, 5505.0])
+        narrow = (w, np.array([0.0, 1.0, 0.0]))
+        wide = (np.linspace(4000, 5500, 301), np.ones(301))
+        c = dust.band_coefficients([narrow, wide], dwave=0.5)
+        self.assertEqual(c.shape, (2,))
+        self.assertAlmostEqual(c[0], 3.1*dust.ext_odonnell(np.array([5500.0]))[0], 4)
+        ww = np.arange(4000, 5500.1, 0.5)
+        self.assertAlmostEqual(c[1], 3.1*dust.ext_odonnell(ww).mean(), 3)
+        Rv = np.array([2.5, 3.1, 4.0])
+        c2 = dust.band_coefficients([narrow, wide], Rv=Rv, law='ccm', dwave=0.5)
+        self.assertEqual(c2.shape, (3, 2))
+        for k, r in enumerate(Rv):
+            c1 = dust.band_coefficients([narrow, wide], Rv=r, law='ccm',
+                                        dwave=0.5, cache=False)
+            self.assertTrue(np.allclose(c2[k], c1))
+        self.assertEqual(len(dust._band_cache), 2)
+        c2[:] = 0
+        c3 = dust.band_coefficients([narrow, wide], Rv=Rv, law='ccm', dwave=0.5)
+        self.assertTrue(np.all(c3 != 0))
+        #
+        # On-disk cache.
+        #
+        cachedir = mkdtemp()
+        try:
+            c4 = dust.band_coefficients([wide], cachedir=cachedir)
+            files = os.listdir(cachedir)
+            self.assertEqual(len(files), 1)
+            self.assertTrue(files[0].endswith('.npy'))
+            dust._band_cache.clear()
+            np.save(os.path.join(cachedir, files[0]), np.array([-1.0]))
+            c5 = dust.band_coefficients([wide], cachedir=cachedir)
+            self.assertEqual(c5[0], -1.0)
+            self.assertNotEqual(c4[0], -1.0)
+        finally:
+            rmtree(cachedir)
+        dust._band_cache.clear()
+        with self.assertRaises(ValueError):
+            dust.band_coefficients([])
+        with self.assertRaises(ValueError):
+            dust.band_coefficients([(w, np.zeros(3))])
+        with self.assertRaises(ValueError):
+            dust.band_coefficients([(w, np.zeros(2))])
+
+    def test_map_values(self):
+        """Test generic map lookup of several maps at once.
+        """
+        m1 = dust.SFDMap(mapdir=self.mapdir)
+        m2 = dust.LambertMap('SFD_dust_4096_ngp.fits', 'SFD_dust_4096_sgp.fits',
+                             mapdir=self.mapdir, scaling=2.0, memmap=True)
+        self.assertEqual(repr(m2), ("LambertMap(mapdir={!r}, north='SFD_dust_4096_ngp.fits', " +
+                                    "south='SFD_dust_4096_sgp.fits', scaling=2.0)").format(self.mapdir))
+        v1, v2 = dust.map_values([m1, m2], self.ra, self.dec, chunksize=2)
+        self.assertTrue(np.all(v1.astype('<f4') == self.ebv))
+        self.assertTrue(np.allclose(v2, 2.0*v1, rtol=1e-7))
+        v1, v2 = dust.map_values([m1, m2], self.ra[0], self.dec[0],
+                                 interpolate=False)
+        self.assertEqual(v2, 2.0*v1)
+        self.assertEqual(m1.ebv(self.ra, self.dec, chunksize=3).astype('<f4').tolist(),
+                         self.ebv.tolist())
+
+    def test_healpix_map(self):
+        """Test lookup of HEALPix maps.
+        """
+        try:
+            import healpy as hp
+        except ImportError:
+            raise unittest.SkipTest('healpy not installed.')
+        nside = 16
+        npix = hp.nside2npix(nside)
+        theta, phi = hp.pix2ang(nside, np.arange(npix))
+        data = np.cos(theta)
+        m = dust.HEALPixMap(data, scaling=2.0)
+        self.assertEqual(repr(m), "HEALPixMap(nside=16, nest=False, scaling=2.0)")
+        c = SkyCoord(l=np.degrees(phi[:20])*u.degree,
+                     b=(90 - np.degrees(theta[:20]))*u.degree, frame='galactic')
+        v = m.values(c, interpolate=False)
+        self.assertTrue(np.allclose(v, 2.0*data[:20]))
+        v = m.values(c)
+        self.assertTrue(np.allclose(v, 2.0*data[:20], atol=0.1))
+        nested = dust.HEALPixMap(hp.reorder(data, r2n=True), nest=True)
+        v1, v2 = dust.map_values([m, nested], c, interpolate=False)
+        self.assertTrue(np.allclose(v1, 2.0*v2))
+
 
 def test_suite():
     """Allows testing of only this module with the command::
@@ -56,9 +56,64 @@ Users would then access this mask with:
 >>> ccdmask.comment('COSMIC')
 'Cosmic ray'
 
+Arrays of masks can be decoded without looping over elements:
+
+>>> import numpy as np
+>>> m = np.array([0, 3, 16], dtype=np.uint32)
+>>> ccdmask.bitplanes(m, ['HOT', 'COSMIC'])
+array([[False,  True, False],
+       [False, False,  True]])
+>>> ccdmask.names_array(m).tolist()
+[[], ['BAD', 'HOT'], ['COSMIC']]
+
 
 .. _desispec: http://desispec.readthedocs.io
 """
+import re
+import numpy as np
+
+#
+# Tokens of mask expressions: bit names or numbers, operators and parentheses.
+# Bit names may contain any character other than whitespace and the operators.
+#
+_token = re.compile(r'\s*(?:([^\s|&~()]+)|(\S))')
+
+#
+# Number of elements processed at a time by the array tests of BitMask.
+#
+_chunksize = 2**16
+
+#
+# Multi-word masks store bits 64*w to 64*w + 63 in word w.
+#
+_wordbits = 64
+_wordmask = 2**_wordbits - 1
+
+
+def _unsigned(mask):
+    """Return an integer mask array as an unsigned integer array.
+
+    Signed integer arrays are viewed, not copied, as unsigned integers of the
+    same size, so that the highest bit can be tested like any other.
+
+    Parameters
+    ----------
+    mask : array-like
+        Integer mask values.
+
+    Returns
+    -------
+    :class:`~numpy.ndarray`
+        Unsigned integer array of the same shape.
+    """
+    mask = np.asarray(mask)
+    if mask.dtype.kind == 'u':
+        return mask
+    if mask.dtype.kind == 'i':
+        return mask.view(mask.dtype.str.replace('i', 'u'))
+    if mask.dtype.kind == 'b':
+        return mask.astype(np.uint8)
+    raise TypeError("Mask arrays must have an integer type, not {0}!".format(mask.dtype))
 
 
 class _MaskBit(int):
@@ -100,6 +155,105 @@ class _MaskBit(int):
     #     return "_MaskBit(name='{0.name}', bitnum={0.bitnum:d}, comment='{0.comment}')".format(self)
 
 
+def _unpack(mask):
+    """Unpack every bit of a flat mask array.
+
+    Parameters
+    ----------
+    mask : :class:`~numpy.ndarray`
+        1D unsigned integer mask array.
+
+    Returns
+    -------
+    :class:`~numpy.ndarray`
+        Array of shape ``(mask.size, 8*mask.itemsize)`` containing 0 or 1;
+        column ``k`` holds bit number ``k``.
+    """
+    itemsize = mask.dtype.itemsize
+    le = np.ascontiguousarray(mask.astype(mask.dtype.newbyteorder('<'), copy=False))
+    return np.unpackbits(le.view(np.uint8).reshape(mask.size, itemsize),
+                         axis=1, bitorder='little')
+
+
+def _vote(layers, k, dtype):
+    """Set each bit of the result if it is set in at least `k` of `layers`.
+
+    The number of votes for every bit is kept in bit-sliced counters:
+    ``counters[j]`` holds bit ``j`` of the count for every bit of every
+    element, so each layer is added with a few bitwise operations on whole
+    arrays, independently of the number of bits.
+
+    Parameters
+    ----------
+    layers : :class:`list`
+        Unsigned integer mask arrays, all with the same shape.
+    k : :class:`int`
+        Minimum number of votes, ``1 <= k <= len(layers)``.
+    dtype : :class:`~numpy.dtype`
+        Unsigned integer type of the result.
+
+    Returns
+    -------
+    :class:`~numpy.ndarray`
+        The combined mask.
+    """
+    n = len(layers)
+    if k == 1 or k == n:
+        result = layers[0].astype(dtype)
+        for layer in layers[1:]:
+            if k == 1:
+                result |= layer
+            else:
+                result &= layer
+        return result
+    counters = [np.zeros(layers[0].shape, dtype=dtype) for j in range(n.bit_length())]
+    carry = np.empty(layers[0].shape, dtype=dtype)
+    t = np.empty(layers[0].shape, dtype=dtype)
+    for layer in layers:
+        carry[...] = layer
+        for c in counters:
+            np.bitwise_and(c, carry, out=t)
+            c ^= carry
+            carry, t = t, carry
+            if not carry.any():
+                break
+    #
+    # Compare the counters to k, from the most significant bit down.
+    #
+    ones = np.bitwise_not(dtype.type(0))
+    greater = np.zeros(layers[0].shape, dtype=dtype)
+    equal = np.full(layers[0].shape, ones, dtype=dtype)
+    for j in range(len(counters) - 1, -1, -1):
+        if (k >> j) & 1:
+            equal &= counters[j]
+        else:
+            np.bitwise_and(equal, counters[j], out=t)
+            greater |= t
+            np.bitwise_not(counters[j], out=t)
+            equal &= t
+    greater |= equal
+    return greater
+
+
+def _split(value, nwords):
+    """Split an integer mask into 64-bit words.
+
+    Parameters
+    ----------
+    value : :class:`int`
+        Non-negative integer mask of any size.
+    nwords : :class:`int`
+        Number of words.
+
+    Returns
+    -------
+    :class:`~numpy.ndarray`
+        Array of `nwords` :class:`~numpy.uint64`, least significant word first.
+    """
+    return np.array([(value >> (_wordbits*w)) & _wordmask for w in range(nwords)],
+                    dtype=np.uint64)
+
+
 #  Class to provide mask bit utility functions
 class BitMask(object):
     """BitMask object to represent bit names, masks, and comments.
@@ -135,6 +289,17 @@ class BitMask(object):
                 extra = dict()
             self._bits[bitname] = _MaskBit(bitname, bitnum, comment, extra)
             self._bits[bitnum] = self._bits[bitname]
+        self._allbits = 0
+        for bitnum in self._bits:
+            if isinstance(bitnum, int):
+                self._allbits |= self._bits[bitnum].mask
+        self._compiled = dict()
+
+    @property
+    def nwords(self):
+        """Number of 64-bit words needed to hold all known bits.
+        """
+        return max(1, -(-self._allbits.bit_length() // _wordbits))
 
     def __getitem__(self, bitname):
         """Return mask for individual bitname.
@@ -206,14 +371,345 @@ class BitMask(object):
         8
         >>> bitmask.mask('BLAT')
         >>> bitmask.mask('BLAT|FOO')
+        >>> bitmask.mask('~(BLAT|FOO)')
+
+        See :meth:`compile` for the syntax of mask expressions.
         """
         if isinstance(name_or_num, int):
             return self._bits[name_or_num].mask
         else:
-            mask = 0
-            for name in name_or_num.split('|'):
-                mask |= self._bits[name].mask
+            return self.compile(name_or_num)
+
+    def compile(self, expr):
+        """Compile a mask expression into an integer.
+
+        Expressions combine bit names (or numbers) with ``|`` (or), ``&``
+        (and), ``~`` (not) and parentheses, with the usual precedence
+        ``~`` > ``&`` > ``|``.  The complement ``~`` is taken with respect
+        to the known bits of this mask.  Results are cached, so compiling
+        the same expression again is a dictionary lookup.
+
+        Parameters
+        ----------
+        expr : :class:`str`
+            The mask expression.
+
+        Returns
+        -------
+        :class:`int`
+            The value of the expression.
+
+        Raises
+        ------
+        KeyError
+            If a bit name is not known.
+        ValueError
+            If the expression can not be parsed.
+        """
+        try:
+            return self._compiled[expr]
+        except KeyError:
+            pass
+        tokens = list()
+        for name, op in _token.findall(expr):
+            tokens.append(name if name else op)
+        value, n = self._parse_or(tokens, 0, expr)
+        if n != len(tokens):
+            raise ValueError("Unexpected '{0}' in mask expression '{1}'!".format(tokens[n], expr))
+        self._compiled[expr] = value
+        return value
+
+    def _parse_or(self, tokens, n, expr):
+        """Parse ``term ('|' term)*`` starting at token `n`.
+        """
+        value, n = self._parse_and(tokens, n, expr)
+        while n < len(tokens) and tokens[n] == '|':
+            v, n = self._parse_and(tokens, n + 1, expr)
+            value |= v
+        return (value, n)
+
+    def _parse_and(self, tokens, n, expr):
+        """Parse ``factor ('&' factor)*`` starting at token `n`.
+        """
+        value, n = self._parse_not(tokens, n, expr)
+        while n < len(tokens) and tokens[n] == '&':
+            v, n = self._parse_not(tokens, n + 1, expr)
+            value &= v
+        return (value, n)
+
+    def _parse_not(self, tokens, n, expr):
+        """Parse ``'~' factor``, ``'(' expr ')'`` or a bit name starting at token `n`.
+        """
+        if n >= len(tokens):
+            raise ValueError("Unexpected end of mask expression '{0}'!".format(expr))
+        token = tokens[n]
+        if token == '~':
+            value, n = self._parse_not(tokens, n + 1, expr)
+            return (self._allbits & ~value, n)
+        if token == '(':
+            value, n = self._parse_or(tokens, n + 1, expr)
+            if n >= len(tokens) or tokens[n] != ')':
+                raise ValueError("Unbalanced parentheses in mask expression '{0}'!".format(expr))
+            return (value, n + 1)
+        if token in ('|', '&', ')'):
+            raise ValueError("Unexpected '{0}' in mask expression '{1}'!".format(token, expr))
+        if token.isdigit():
+            return (self._bits[int(token)].mask, n + 1)
+        return (self._bits[token].mask, n + 1)
+
+    def _test(self, mask, expr, op, wide=False):
+        """Compare ``mask & expr`` to a value, in chunks.
+
+        Parameters
+        ----------
+        mask : array-like
+            Array of integer masks.
+        expr : :class:`int` or :class:`str`
+            Compiled mask, or a mask expression.
+        op : :class:`str`
+            One of ``'any'``, ``'all'`` or ``'none'``.
+        wide : :class:`bool`, optional
+            If ``True``, `mask` is a multi-word mask.
+
+        Returns
+        -------
+        :class:`~numpy.ndarray`
+            Boolean array with the shape of `mask`, excluding the word axis.
+        """
+        if isinstance(expr, str):
+            expr = self.compile(expr)
+        else:
+            expr = int(expr)
+        if wide:
+            return self._test_words(self._words(mask), expr, op)
+        mask = _unsigned(mask)
+        result = np.empty(mask.shape, dtype=bool)
+        nbits = 8*mask.dtype.itemsize
+        value = expr & (2**nbits - 1)
+        if op == 'all' and value != expr:
+            # Bits that can't be stored in mask are never set.
+            result[...] = False
+            return result
+        value = mask.dtype.type(value)
+        if op == 'any':
+            compare, target = np.not_equal, 0
+        elif op == 'all':
+            compare, target = np.equal, value
+        else:
+            compare, target = np.equal, 0
+        flat = mask.reshape(-1)
+        out = result.reshape(-1)
+        buf = np.empty((min(_chunksize, flat.size),), dtype=mask.dtype)
+        for i in range(0, flat.size, _chunksize):
+            chunk = flat[i:i+_chunksize]
+            b = buf[:chunk.size]
+            np.bitwise_and(chunk, value, out=b)
+            compare(b, target, out=out[i:i+_chunksize])
+        return result
+
+    def _test_words(self, words, expr, op):
+        """Compare ``words & expr`` to a value, in chunks of rows.
+        """
+        nwords = words.shape[-1]
+        value = _split(expr, nwords)
+        result = np.empty(words.shape[:-1], dtype=bool)
+        if op == 'all' and expr >> (_wordbits*nwords):
+            result[...] = False
+            return result
+        flat = words.reshape(-1, nwords)
+        out = result.reshape(-1)
+        buf = np.empty((min(_chunksize, flat.shape[0]), nwords), dtype=np.uint64)
+        test = np.empty(buf.shape, dtype=bool)
+        for i in range(0, flat.shape[0], _chunksize):
+            chunk = flat[i:i+_chunksize]
+            b = buf[:chunk.shape[0]]
+            t = test[:chunk.shape[0]]
+            o = out[i:i+_chunksize]
+            np.bitwise_and(chunk, value, out=b)
+            if op == 'all':
+                np.equal(b, value, out=t)
+                np.all(t, axis=1, out=o)
+            else:
+                np.not_equal(b, 0, out=t)
+                np.any(t, axis=1, out=o)
+                if op == 'none':
+                    np.logical_not(o, out=o)
+        return result
+
+    def any_set(self, mask, expr, wide=False):
+        """Test whether any of the bits in `expr` are set.
+
+        The test is applied to chunks of `mask` through one small reusable
+        buffer, so no temporary arrays the size of `mask` are created.
+
+        Parameters
+        ----------
+        mask : array-like
+            Array of (signed or unsigned) integer masks, of any shape.
+        expr : :class:`int` or :class:`str`
+            Compiled mask, as returned by :meth:`compile`, or a mask expression.
+        wide : :class:`bool`, optional
+            If ``True``, `mask` is a multi-word mask, see :meth:`to_words`.
+
+        Returns
+        -------
+        :class:`~numpy.ndarray`
+            Boolean array with the shape of `mask` (without the word axis).
+        """
+        return self._test(mask, expr, 'any', wide)
+
+    def all_set(self, mask, expr, wide=False):
+        """Test whether all of the bits in `expr` are set.
+
+        Parameters
+        ----------
+        mask : array-like
+            Array of (signed or unsigned) integer masks, of any shape.
+        expr : :class:`int` or :class:`str`
+            Compiled mask, as returned by :meth:`compile`, or a mask expression.
+        wide : :class:`bool`, optional
+            If ``True``, `mask` is a multi-word mask, see :meth:`to_words`.
+
+        Returns
+        -------
+        :class:`~numpy.ndarray`
+            Boolean array with the shape of `mask` (without the word axis).
+        """
+        return self._test(mask, expr, 'all', wide)
+
+    def none_set(self, mask, expr, wide=False):
+        """Test whether none of the bits in `expr` are set.
+
+        Parameters
+        ----------
+        mask : array-like
+            Array of (signed or unsigned) integer masks, of any shape.
+        expr : :class:`int` or :class:`str`
+            Compiled mask, as returned by :meth:`compile`, or a mask expression.
+        wide : :class:`bool`, optional
+            If ``True``, `mask` is a multi-word mask, see :meth:`to_words`.
+
+        Returns
+        -------
+        :class:`~numpy.ndarray`
+            Boolean array with the shape of `mask` (without the word axis).
+        """
+        return self._test(mask, expr, 'none', wide)
+
+    def _words(self, words):
+        """Check that `words` is a multi-word mask array.
+        """
+        words = np.asarray(words)
+        if words.dtype != np.uint64 or words.ndim == 0:
+            raise TypeError("Multi-word masks must be uint64 arrays with words along the last axis!")
+        return words
+
+    def to_words(self, mask, nwords=None):
+        """Convert masks to multi-word masks.
+
+        A multi-word mask is an array of :class:`~numpy.uint64` with an extra
+        last axis of length `nwords`.  Word ``w`` holds bits ``64*w`` to
+        ``64*w + 63``.
+
+        Parameters
+        ----------
+        mask : array-like
+            Array of integer masks, either of a numpy integer type or an
+            object array of Python :class:`int` of any size.
+        nwords : :class:`int`, optional
+            Number of words; default is :attr:`nwords`.
+
+        Returns
+        -------
+        :class:`~numpy.ndarray`
+            Array of shape ``mask.shape + (nwords,)``.
+        """
+        if nwords is None:
+            nwords = self.nwords
+        mask = np.asarray(mask)
+        words = np.zeros(mask.shape + (nwords,), dtype=np.uint64)
+        if mask.dtype.kind == 'O':
+            if mask.size > 0 and np.any(mask < 0):
+                raise ValueError("Masks must not be negative!")
+            for w in range(nwords):
+                words[..., w] = (mask >> (_wordbits*w)) & _wordmask
+            if mask.size > 0 and np.any((mask >> (_wordbits*nwords)) != 0):
+                raise ValueError("Masks do not fit in {0:d} words!".format(nwords))
+        else:
+            words[..., 0] = _unsigned(mask)
+        return words
+
+    def from_words(self, words, dtype=None):
+        """Convert multi-word masks to single integers.
+
+        Parameters
+        ----------
+        words : :class:`~numpy.ndarray`
+            Multi-word masks, see :meth:`to_words`.
+        dtype : :class:`~numpy.dtype`, optional
+            If set, return an array of this integer type; otherwise return
+            an object array of Python :class:`int`.
+
+        Returns
+        -------
+        :class:`~numpy.ndarray`
+            Array with the shape of `words` without the word axis.
+
+        Raises
+        ------
+        ValueError
+            If `dtype` is too small to hold the set bits.
+        """
+        words = self._words(words)
+        if dtype is None:
+            mask = words[..., 0].astype(object)
+            for w in range(1, words.shape[-1]):
+                mask = mask | (words[..., w].astype(object) << (_wordbits*w))
             return mask
+        dtype = np.dtype(dtype)
+        nbits = 8*dtype.itemsize - (1 if dtype.kind == 'i' else 0)
+        if np.any(words[..., 1:]) or (nbits < _wordbits and
+                                      np.any(words[..., 0] >> np.uint64(nbits))):
+            raise ValueError("Masks do not fit in {0}!".format(dtype))
+        return words[..., 0].astype(dtype)
+
+    def set_bits(self, mask, expr, wide=False):
+        """Set bits in an array of masks, in place.
+
+        Parameters
+        ----------
+        mask : :class:`~numpy.ndarray`
+            Array of integer masks, or multi-word masks if `wide` is ``True``.
+        expr : :class:`int` or :class:`str`
+            Compiled mask, as returned by :meth:`compile`, or a mask expression.
+        wide : :class:`bool`, optional
+            If ``True``, `mask` is a multi-word mask, see :meth:`to_words`.
+
+        Returns
+        -------
+        :class:`~numpy.ndarray`
+            `mask`, for convenience.
+
+        Raises
+        ------
+        ValueError
+            If a bit does not fit in `mask`.
+        """
+        if isinstance(expr, str):
+            expr = self.compile(expr)
+        else:
+            expr = int(expr)
+        if wide:
+            words = self._words(mask)
+            if expr >> (_wordbits*words.shape[-1]):
+                raise ValueError("Bits do not fit in {0:d} words!".format(words.shape[-1]))
+            words |= _split(expr, words.shape[-1])
+            return mask
+        u = _unsigned(mask)
+        if expr >> (8*u.dtype.itemsize):
+            raise ValueError("Bits do not fit in {0}!".format(mask.dtype))
+        u |= u.dtype.type(expr)
+        return mask
 
     def names(self, mask=None):
         """Return list of names of masked bits.
@@ -248,6 +744,244 @@ class BitMask(object):
 
         return names
 
+    def bitplanes(self, mask, names=None, wide=False):
+        """Decode an array of masks into one boolean array per bit.
+
+        Parameters
+        ----------
+        mask : array-like
+            Array of (signed or unsigned) integer masks, of any shape.
+        names : :class:`list`, optional
+            Names or numbers of the bits to decode.  If not supplied,
+            decode all known bits, in the order returned by :meth:`names`.
+        wide : :class:`bool`, optional
+            If ``True``, `mask` is a multi-word mask, see :meth:`to_words`.
+
+        Returns
+        -------
+        :class:`~numpy.ndarray`
+            Boolean array of shape ``(len(names),) + mask.shape``, which is
+            ``True`` where the corresponding bit is set.  For multi-word
+            masks, the word axis is not included.
+        """
+        if wide:
+            words = self._words(mask)
+            mask = words[..., 0]
+            nwords = words.shape[-1]
+        else:
+            mask = _unsigned(mask)
+            nwords = 1
+        if names is None:
+            names = self.names()
+        nbits = 8*mask.dtype.itemsize
+        planes = np.zeros((len(names),) + mask.shape, dtype=bool)
+        for k, name in enumerate(names):
+            w, bitnum = divmod(self._bits[name].bitnum, nbits)
+            if w < nwords:
+                word = words[..., w] if wide else mask
+                np.not_equal(word & mask.dtype.type(2**bitnum), 0,
+                             out=planes[k])
+        return planes
+
+    def names_array(self, mask, wide=False):
+        """Decode an array of masks into a list of names for each element.
+
+        Only the distinct mask values are decoded with :meth:`names`, so the
+        cost is dominated by :func:`numpy.unique` rather than a loop over
+        elements.
+
+        Parameters
+        ----------
+        mask : array-like
+            Array of (signed or unsigned) integer masks, of any shape.
+        wide : :class:`bool`, optional
+            If ``True``, `mask` is a multi-word mask, see :meth:`to_words`.
+
+        Returns
+        -------
+        :class:`~numpy.ndarray`
+            Object array with the shape of `mask`, holding the list of names
+            of the bits set in each element.  Elements with the same mask
+            value share the same list object.  For multi-word masks, the
+            word axis is not included.
+        """
+        if wide:
+            words = self._words(mask)
+            shape = words.shape[:-1]
+            values, inverse = np.unique(words.reshape(-1, words.shape[-1]),
+                                        axis=0, return_inverse=True)
+            values = self.from_words(values)
+        else:
+            mask = _unsigned(mask)
+            shape = mask.shape
+            values, inverse = np.unique(mask, return_inverse=True)
+        decoded = np.empty(values.shape, dtype=object)
+        for k, value in enumerate(values):
+            decoded[k] = self.names(value)
+        return decoded[inverse.reshape(-1)].reshape(shape)
+
+    def bitstats(self, mask, groups=None, chunksize=None):
+        """Count how often each bit is set in an array of masks.
+
+        All bits of each element are unpacked at once with
+        :func:`numpy.unpackbits`, so every bit is counted in a single
+        vectorized pass over the data.
+
+        Parameters
+        ----------
+        mask : array-like
+            Array of (signed or unsigned) integer masks, of any shape.
+        groups : array-like, optional
+            Group labels, *e.g.* fiber or brick.  Either the shape of `mask`, or
+            the shape of its leading dimensions, in which case each label applies
+            to all elements along the remaining dimensions.
+        chunksize : :class:`int`, optional
+            If set, accumulate the counts over chunks of this many elements,
+            to bound the memory used by temporary arrays.
+
+        Returns
+        -------
+        :class:`~astropy.table.Table`
+            One row per known bit, plus one row for each unknown bit that is set
+            at least once, with columns ``NAME``, ``BITNUM``, ``COMMENT``,
+            ``COUNT`` and ``FRACTION``.  If `groups` is set, ``COUNT`` and
+            ``FRACTION`` have one column per group, and the sorted group
+            labels and number of elements per group are stored in
+            ``meta['GROUPS']`` and ``meta['NTOTAL']``; otherwise
+            ``meta['NTOTAL']`` is the total number of elements.
+        """
+        from astropy.table import Table
+        mask = _unsigned(mask)
+        flat = mask.reshape(-1)
+        nbits = 8*mask.dtype.itemsize
+        if groups is None:
+            labels = None
+            index = None
+            ngroups = 1
+        else:
+            groups = np.asarray(groups)
+            if groups.shape != mask.shape[:groups.ndim]:
+                raise ValueError("Shape of groups does not match shape of mask!")
+            labels, index = np.unique(groups, return_inverse=True)
+            index = np.broadcast_to(index.reshape(groups.shape + (1,)*(mask.ndim - groups.ndim)),
+                                    mask.shape).reshape(-1)
+            ngroups = labels.size
+        counts = np.zeros((ngroups, nbits), dtype=np.int64)
+        ntotal = np.zeros((ngroups,), dtype=np.int64)
+        if chunksize is None:
+            chunksize = max(flat.size, 1)
+        for i in range(0, flat.size, chunksize):
+            bits = _unpack(flat[i:i+chunksize])
+            if index is None:
+                counts[0] += bits.sum(axis=0, dtype=np.int64)
+                ntotal[0] += bits.shape[0]
+            else:
+                g = index[i:i+chunksize]
+                rows, cols = np.nonzero(bits)
+                counts += np.bincount(g[rows]*nbits + cols,
+                                      minlength=ngroups*nbits).reshape(ngroups, nbits)
+                ntotal += np.bincount(g, minlength=ngroups)
+        #
+        # Rows for the known bits, plus any unknown bits that were set.
+        #
+        bitnums = sorted(set(x for x in self._bits.keys() if isinstance(x, int) and x < nbits) |
+                         set(np.flatnonzero(counts.sum(axis=0)).tolist()))
+        names = list()
+        comments = list()
+        for bitnum in bitnums:
+            if bitnum in self._bits:
+                names.append(self._bits[bitnum].name)
+                comments.append(self._bits[bitnum].comment)
+            else:
+                names.append('UNKNOWN' + str(bitnum))
+                comments.append('')
+        count = counts[:, bitnums].T
+        with np.errstate(invalid='ignore', divide='ignore'):
+            fraction = count / ntotal
+        if labels is None:
+            count = count[:, 0]
+            fraction = fraction[:, 0]
+        result = Table([names, bitnums, comments, count, fraction],
+                       names=('NAME', 'BITNUM', 'COMMENT', 'COUNT', 'FRACTION'))
+        if labels is None:
+            result.meta['NTOTAL'] = int(ntotal[0])
+        else:
+            result.meta['GROUPS'] = labels
+            result.meta['NTOTAL'] = ntotal
+        return result
+
+    def combine(self, masks, op='or', axis=0, chunksize=None):
+        """Combine a stack of masks, *e.g.* from several exposures, bit by bit.
+
+        Parameters
+        ----------
+        masks : :class:`~numpy.ndarray` or :class:`list`
+            Either an array of integer masks, stacked along `axis`, or a
+            list of integer mask arrays with the same shape, which are
+            not copied into a stack.
+        op : :class:`str` or :class:`int`, optional
+            ``'or'`` (default) to set bits that are set in any input,
+            ``'and'`` to set bits that are set in all inputs, or an integer
+            `k` to set bits that are set in at least `k` inputs.
+        axis : :class:`int`, optional
+            Axis along which masks are stacked, if `masks` is an array.
+        chunksize : :class:`int`, optional
+            If set, process this many rows (along the first axis of each
+            mask) at a time, to bound the memory used by vote counters.
+
+        Multi-word masks (see :meth:`to_words`) can be combined as well,
+        since bits are combined independently, as long as `axis` is not the
+        word axis.
+
+        Returns
+        -------
+        :class:`~numpy.ndarray`
+            The combined mask, with the shape of one input mask.  Masks of
+            different types give an integer of the largest size, which is
+            unsigned unless all masks are signed.
+
+        Raises
+        ------
+        ValueError
+            If there are no masks, their shapes differ, or `op` is invalid.
+        """
+        if isinstance(masks, np.ndarray):
+            dtype = masks.dtype
+            layers = list(np.moveaxis(_unsigned(masks), axis, 0))
+        else:
+            layers = [_unsigned(m) for m in masks]
+            # Masks of different types are combined as unsigned integers
+            # of the largest size; the result is signed only if all inputs are.
+            dtype = None
+            if layers:
+                itemsize = max([m.dtype.itemsize for m in layers])
+                signed = all([np.asarray(m).dtype.kind == 'i' for m in masks])
+                dtype = np.dtype('{0}{1:d}'.format('i' if signed else 'u', itemsize))
+        n = len(layers)
+        if n == 0:
+            raise ValueError("No masks to combine!")
+        shape = layers[0].shape
+        for layer in layers:
+            if layer.shape != shape:
+                raise ValueError("All masks must have the same shape!")
+        if op == 'or':
+            k = 1
+        elif op == 'and':
+            k = n
+        elif isinstance(op, (int, np.integer)) and 1 <= op <= n:
+            k = int(op)
+        else:
+            raise ValueError("Invalid combination {0!r} of {1:d} masks!".format(op, n))
+        udtype = _unsigned(np.zeros((), dtype=dtype)).dtype
+        if len(shape) == 0 or chunksize is None:
+            result = _vote(layers, k, udtype)
+        else:
+            result = np.empty(shape, dtype=udtype)
+            for i in range(0, shape[0], chunksize):
+                rows = slice(i, i + chunksize)
+                result[rows] = _vote([layer[rows] for layer in layers], k, udtype)
+        return result.view(dtype)
+
     def __getattr__(self, name):
         """Enable ``mask.BITNAME`` equivalent to ``mask['BITNAME']``.
         """
@@ -275,3 +1009,315 @@ class BitMask(object):
             result.append(line)
 
         return "\n".join(result)
+
+
+class SparseMask(object):
+    """Run-length encoded array of masks.
+
+    Runs of identical, non-zero values along the flattened (C-order) array
+    are stored as three 1D arrays, so masks that are almost entirely zero
+    take very little memory, and can be combined and queried without
+    converting them back to dense arrays.
+
+    Parameters
+    ----------
+    shape : :class:`tuple`
+        Shape of the dense mask array.
+    start : array-like
+        Flat index of the first element of each run, in increasing order.
+    length : array-like
+        Number of elements in each run.
+    value : array-like
+        Mask value of each run.
+    bitmask : :class:`BitMask`, optional
+        If set, used to compile mask expressions passed to the methods
+        of this object.
+
+    Attributes
+    ----------
+    shape : :class:`tuple`
+        Shape of the dense mask array.
+    start, length, value : :class:`~numpy.ndarray`
+        The runs.
+    bitmask : :class:`BitMask`
+        Bit definitions, or ``None``.
+    """
+
+    def __init__(self, shape, start, length, value, bitmask=None):
+        self.shape = tuple(shape)
+        self.start = np.asarray(start, dtype=np.int64)
+        self.length = np.asarray(length, dtype=np.int64)
+        self.value = np.asarray(value)
+        if self.value.dtype.kind not in 'iu':
+            raise TypeError("Mask values must have an integer type, not {0}!".format(self.value.dtype))
+        if not (self.start.shape == self.length.shape == self.value.shape) or self.start.ndim != 1:
+            raise ValueError("start, length and value must be 1D arrays of the same size!")
+        self.bitmask = bitmask
+
+    @classmethod
+    def from_dense(cls, mask, bitmask=None):
+        """Compress a dense array of masks.
+
+        Parameters
+        ----------
+        mask : array-like
+            Array of integer masks, of any shape.
+        bitmask : :class:`BitMask`, optional
+            Bit definitions for the new object.
+
+        Returns
+        -------
+        :class:`SparseMask`
+            The compressed masks.
+        """
+        mask = np.asarray(mask)
+        flat = mask.reshape(-1)
+        start = np.flatnonzero(flat[1:] != flat[:-1]) + 1
+        start = np.concatenate(([0], start)) if flat.size > 0 else start
+        length = np.diff(np.append(start, flat.size))
+        value = flat[start]
+        keep = value != 0
+        return cls(mask.shape, start[keep], length[keep], value[keep], bitmask=bitmask)
+
+    @property
+    def dtype(self):
+        """Data type of the mask values.
+        """
+        return self.value.dtype
+
+    @property
+    def size(self):
+        """Number of elements of the dense mask array.
+        """
+        return int(np.prod(self.shape, dtype=np.int64))
+
+    @property
+    def nnz(self):
+        """Number of non-zero elements.
+        """
+        return int(self.length.sum())
+
+    def to_dense(self):
+        """Expand to a dense array of masks.
+
+        Returns
+        -------
+        :class:`~numpy.ndarray`
+            Array of masks with shape :attr:`shape`.
+        """
+        dense = np.zeros((self.size,), dtype=self.dtype)
+        dense[self._indices(self.start, self.length)] = np.repeat(self.value, self.length)
+        return dense.reshape(self.shape)
+
+    @staticmethod
+    def _indices(start, length):
+        """Return the flat indices of all elements of the runs.
+        """
+        offset = np.repeat(start - np.cumsum(length) + length, length)
+        return offset + np.arange(offset.size, dtype=np.int64)
+
+    def _compile(self, expr):
+        """Convert a mask expression to an integer that fits the value type.
+        """
+        if isinstance(expr, str):
+            if self.bitmask is None:
+                raise ValueError("Mask expressions require bit definitions!")
+            expr = self.bitmask.compile(expr)
+        return _unsigned(self.value).dtype.type(int(expr) & (2**(8*self.dtype.itemsize) - 1))
+
+    def values_at(self, index):
+        """Return the mask values at flat indices.
+
+        Parameters
+        ----------
+        index : array-like
+            Flat (C-order) indices into the dense array.
+
+        Returns
+        -------
+        :class:`~numpy.ndarray`
+            Mask values.
+        """
+        index = np.asarray(index, dtype=np.int64)
+        i = np.searchsorted(self.start, index, side='right') - 1
+        inside = (i >= 0)
+        i = np.maximum(i, 0)
+        if self.start.size > 0:
+            inside &= index < self.start[i] + self.length[i]
+            return np.where(inside, self.value[i], 0).astype(self.dtype)
+        return np.zeros(index.shape, dtype=self.dtype)
+
+    def count(self, expr=None):
+        """Count elements with any of the bits in `expr` set.
+
+        Parameters
+        ----------
+        expr : :class:`int` or :class:`str`, optional
+            Compiled mask or mask expression; if not set, count all
+            non-zero elements.
+
+        Returns
+        -------
+        :class:`int`
+            The number of elements.
+        """
+        if expr is None:
+            return self.nnz
+        bits = self._compile(expr)
+        return int(self.length[(_unsigned(self.value) & bits) != 0].sum())
+
+    def select(self, expr):
+        """Keep only the bits in `expr`.
+
+        Parameters
+        ----------
+        expr : :class:`int` or :class:`str`
+            Compiled mask or mask expression.
+
+        Returns
+        -------
+        :class:`SparseMask`
+            Masks with all other bits cleared.
+        """
+        bits = self._compile(expr)
+        value = (_unsigned(self.value) & bits).view(self.dtype)
+        return self._normalize(self.start, self.length, value)
+
+    def indices(self, expr=None):
+        """Return the flat indices of elements with any of the bits in `expr` set.
+
+        Parameters
+        ----------
+        expr : :class:`int` or :class:`str`, optional
+            Compiled mask or mask expression; if not set, return the indices
+            of all non-zero elements.
+
+        Returns
+        -------
+        :class:`~numpy.ndarray`
+            Flat (C-order) indices; use :func:`numpy.unravel_index` to
+            convert to array indices.
+        """
+        if expr is None:
+            return self._indices(self.start, self.length)
+        bits = self._compile(expr)
+        keep = (_unsigned(self.value) & bits) != 0
+        return self._indices(self.start[keep], self.length[keep])
+
+    def _normalize(self, start, length, value):
+        """Drop zero runs and merge adjacent runs with equal values.
+        """
+        keep = value != 0
+        start, length, value = start[keep], length[keep], value[keep]
+        if start.size > 1:
+            new = np.ones(start.shape, dtype=bool)
+            new[1:] = (start[1:] != start[:-1] + length[:-1]) | (value[1:] != value[:-1])
+            first = np.flatnonzero(new)
+            last = np.append(first[1:] - 1, start.size - 1)
+            length = start[last] + length[last] - start[first]
+            start, value = start[first], value[first]
+        return SparseMask(self.shape, start, length, value, bitmask=self.bitmask)
+
+    def _combine(self, other, op):
+        """Combine with another :class:`SparseMask` by splitting both into
+        segments on which neither changes value.
+
+        The values are combined as unsigned integers of the larger size, so
+        that the bits of a signed mask are not extended into the higher bits.
+        The result is signed only if both masks are signed.
+        """
+        if not isinstance(other, SparseMask):
+            return NotImplemented
+        if other.shape != self.shape:
+            raise ValueError("Masks must have the same shape!")
+        bounds = np.unique(np.concatenate((self.start, self.start + self.length,
+                                           other.start, other.start + other.length)))
+        start = bounds[:-1]
+        length = np.diff(bounds)
+        itemsize = max(self.dtype.itemsize, other.dtype.itemsize)
+        utype = np.dtype('u{0:d}'.format(itemsize))
+        value = op(_unsigned(self.values_at(start)).astype(utype),
+                   _unsigned(other.values_at(start)).astype(utype))
+        if self.dtype.kind == other.dtype.kind == 'i':
+            value = value.view('i{0:d}'.format(itemsize))
+        return self._normalize(start, length, value)
+
+    def __or__(self, other):
+        return self._combine(other, np.bitwise_or)
+
+    def __and__(self, other):
+        return self._combine(other, np.bitwise_and)
+
+    def __eq__(self, other):
+        if not isinstance(other, SparseMask):
+            return NotImplemented
+        return (self.shape == other.shape and
+                np.array_equal(self.start, other.start) and
+                np.array_equal(self.length, other.length) and
+                np.array_equal(self.value, other.value))
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        if result is NotImplemented:
+            return result
+        return not result
+
+    def to_hdu(self, extname='MASK'):
+        """Convert to a FITS binary table.
+
+        Parameters
+        ----------
+        extname : :class:`str`, optional
+            Name of the HDU.
+
+        Returns
+        -------
+        :class:`~astropy.io.fits.BinTableHDU`
+            Table with columns ``START``, ``LENGTH`` and ``VALUE``; the shape
+            of the dense array is stored in the ``MASKDIMn`` header keywords.
+            Unsigned values are stored with the usual ``TZERO`` offset, and
+            8-bit signed values, which FITS does not support, as 16-bit integers.
+        """
+        from astropy.io import fits
+        itemsize = self.dtype.itemsize
+        value, bzero = self.value, None
+        if self.dtype.kind == 'i' and itemsize == 1:
+            value, itemsize = value.astype(np.int16), 2
+        elif self.dtype.kind == 'u' and itemsize > 1:
+            bzero = 2**(8*itemsize - 1)
+        columns = [fits.Column(name='START', format='K', array=self.start),
+                   fits.Column(name='LENGTH', format='K', array=self.length),
+                   fits.Column(name='VALUE', array=value, bzero=bzero,
+                               format={1: 'B', 2: 'I', 4: 'J', 8: 'K'}[itemsize])]
+        hdu = fits.BinTableHDU.from_columns(columns, name=extname)
+        hdu.header['MASKNDIM'] = (len(self.shape), 'Number of dimensions of mask')
+        for k, n in enumerate(self.shape):
+            hdu.header['MASKDIM{0:d}'.format(k + 1)] = (n, 'Size of mask dimension {0:d}'.format(k + 1))
+        hdu.header['MASKTYPE'] = (self.dtype.name, 'Data type of mask')
+        return hdu
+
+    @classmethod
+    def from_hdu(cls, hdu, bitmask=None):
+        """Read from a FITS binary table written by :meth:`to_hdu`.
+
+        Parameters
+        ----------
+        hdu : :class:`~astropy.io.fits.BinTableHDU`
+            The table.
+        bitmask : :class:`BitMask`, optional
+            Bit definitions for the new object.
+
+        Returns
+        -------
+        :class:`SparseMask`
+            The compressed masks.
+        """
+        header = hdu.header
+        shape = tuple(header['MASKDIM{0:d}'.format(k + 1)] for k in range(header['MASKNDIM']))
+        data = hdu.data
+        return cls(shape, data['START'], data['LENGTH'],
+                   np.asarray(data['VALUE']).astype(header['MASKTYPE']), bitmask=bitmask)
+
+    def __repr__(self):
+        return "SparseMask(shape={0!r}, dtype={1}, nruns={2:d}, nnz={3:d})".format(
+            self.shape, self.dtype.name, self.start.size, self.nnz)
@@ -13,12 +13,471 @@ Fall 2015
 from __future__ import (print_function, absolute_import, division,
                         unicode_literals)
 
+import os
 import numpy as np
 import copy
+import hashlib
 import warnings
+from collections import OrderedDict
 
+#
+# Functions that compute the pseudo-Vandermonde matrix of each fitting function.
+#
+_vanders = {'polynomial': np.polynomial.polynomial.polyvander,
+            'legendre': np.polynomial.legendre.legvander,
+            'chebyshev': np.polynomial.chebyshev.chebvander}
 
-def func_fit(x, y, func, deg, xmin=None, xmax=None, w=None, **kwargs):
+#
+# Functions that fit and evaluate each fitting function, used when the
+# basis is not cached.
+#
+_fitters = {'polynomial': np.polynomial.polynomial.polyfit,
+            'legendre': np.polynomial.legendre.legfit,
+            'chebyshev': np.polynomial.chebyshev.chebfit}
+_values = {'polynomial': np.polynomial.polynomial.polyval,
+           'legendre': np.polynomial.legendre.legval,
+           'chebyshev': np.polynomial.chebyshev.chebval}
+
+
+def _limits(x, xmin=None, xmax=None):
+    """Return the limits used to normalize `x`, following :func:`func_fit`.
+    """
+    if xmin is None or xmax is None:
+        if x.size == 1:
+            xmin, xmax = -1.0, 1.0
+        else:
+            xmin, xmax = x.min(), x.max()
+    return (xmin, xmax)
+
+
+def _vander(x, func, deg, xmin, xmax):
+    """Evaluate the basis functions of a fit.
+
+    Parameters
+    ----------
+    x : :class:`~numpy.ndarray`
+        Independent data values.
+    func : :class:`str`
+        Name of the fitting function:  polynomial, legendre, chebyshev.
+    deg : :class:`int`
+        Order of the fit.
+    xmin, xmax : :class:`float`
+        Limits mapped to [-1, 1].
+
+    Returns
+    -------
+    :class:`~numpy.ndarray`
+        Array of shape ``x.shape + (deg+1,)``.
+    """
+    xv = 2.0 * (x-xmin)/(xmax-xmin) - 1.0
+    try:
+        # The numpy vander functions promote 0-d input to 1-d.
+        return _vanders[func](xv, deg).reshape(np.shape(x) + (deg+1,))
+    except KeyError:
+        raise ValueError("Fitting function '{0:s}' is not implemented yet.".format(func))
+
+
+class BasisCache(object):
+    """Least-recently-used cache of fitting-function bases.
+
+    Entries are keyed by the fitting function, order, limits and a hash
+    of the x grid, so fits and evaluations on a grid that has been seen
+    before reduce to one matrix product against the cached basis.
+
+    Parameters
+    ----------
+    maxsize : :class:`int`, optional
+        Maximum number of grids to keep.
+    """
+
+    def __init__(self, maxsize=32):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __repr__(self):
+        return "BasisCache(maxsize={0:d}, size={1:d}, hits={2:d}, misses={3:d})".format(
+            self.maxsize, len(self), self.hits, self.misses)
+
+    def clear(self):
+        """Remove all entries.
+        """
+        self._entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def _entry(self, x, func, deg, xmin, xmax):
+        """Find or create the entry for a grid.
+        """
+        x = np.asarray(x)
+        # ascontiguousarray() promotes 0-d input to 1-d, so only hash the copy.
+        key = (func, int(deg), float(xmin), float(xmax), x.shape, x.dtype.str,
+               hashlib.sha1(np.ascontiguousarray(x).view(np.uint8)).hexdigest())
+        try:
+            entry = self._entries[key]
+        except KeyError:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return entry
+        V = _vander(x, func, deg, xmin, xmax)
+        V.flags.writeable = False
+        entry = {'V': V, 'rcond': _rcond(x)}
+        if self.maxsize > 0:
+            self._entries[key] = entry
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return entry
+
+    def basis(self, x, func, deg, xmin, xmax):
+        """Return the basis evaluated on `x`.
+
+        Parameters
+        ----------
+        x : :class:`~numpy.ndarray`
+            Independent data values.
+        func : :class:`str`
+            Name of the fitting function:  polynomial, legendre, chebyshev.
+        deg : :class:`int`
+            Order of the fit.
+        xmin, xmax : :class:`float`
+            Limits mapped to [-1, 1].
+
+        Returns
+        -------
+        :class:`~numpy.ndarray`
+            Read-only array of shape ``x.shape + (deg+1,)``.
+        """
+        return self._entry(x, func, deg, xmin, xmax)['V']
+
+    def solver(self, x, func, deg, xmin, xmax):
+        """Return the matrix mapping data on `x` to unweighted fit coefficients.
+
+        The matrix is the column-scaled pseudo-inverse of the basis, with
+        the same singular-value cutoff used by :func:`numpy.polynomial.polynomial.polyfit`.
+
+        Parameters
+        ----------
+        x : :class:`~numpy.ndarray`
+            Independent data values, shape (npix,).
+        func : :class:`str`
+            Name of the fitting function:  polynomial, legendre, chebyshev.
+        deg : :class:`int`
+            Order of the fit.
+        xmin, xmax : :class:`float`
+            Limits mapped to [-1, 1].
+
+        Returns
+        -------
+        :func:`tuple`
+            Read-only array of shape (deg+1, npix) and the rank of the basis.
+        """
+        entry = self._entry(x, func, deg, xmin, xmax)
+        if 'P' not in entry:
+            P, entry['rank'] = _pinv(entry['V'], entry['rcond'])
+            P.flags.writeable = False
+            entry['P'] = P
+        return entry['P'], entry['rank']
+
+
+#
+# Module cache, used by the fitting functions when called with cache=True.
+#
+_basis_cache = BasisCache()
+
+
+def _get_cache(cache):
+    """Interpret the `cache` argument of the fitting functions.
+
+    Returns ``None`` if the basis should not be cached.
+    """
+    if cache is True:
+        return _basis_cache
+    if cache is False or cache is None:
+        return None
+    return cache
+
+
+def _basis(cache, x, func, deg, xmin, xmax):
+    """Evaluate the basis, using `cache` unless it is ``None``.
+    """
+    if cache is None:
+        return _vander(x, func, deg, xmin, xmax)
+    return cache.basis(x, func, deg, xmin, xmax)
+
+
+def _solver(cache, x, func, deg, xmin, xmax):
+    """Return the unweighted solver of :meth:`BasisCache.solver`, using
+    `cache` unless it is ``None``.
+    """
+    if cache is None:
+        return _pinv(_vander(x, func, deg, xmin, xmax), _rcond(x))
+    return cache.solver(x, func, deg, xmin, xmax)
+
+
+def _pinv(V, rcond):
+    """Column-scaled pseudo-inverse of the basis `V` and its rank.
+    """
+    scl = np.sqrt((V*V).sum(axis=0))
+    scl[scl == 0] = 1
+    u, sv, vt = np.linalg.svd(V / scl, full_matrices=False)
+    keep = sv > rcond*sv.max()
+    sinv = np.where(keep, 1.0/np.where(keep, sv, 1.0), 0.0)
+    return (np.dot(vt.T * sinv, u.T) / scl[:, np.newaxis], int(keep.sum()))
+
+
+def _rcond(x):
+    """Relative singular-value cutoff used by numpy's polynomial fits.
+    """
+    x = np.asarray(x)
+    return x.size*np.finfo(x.dtype if x.dtype.kind == 'f' else np.float64).eps
+
+
+def _lstsq(V, y, w, deg, rcond):
+    """Weighted least squares as done by :func:`numpy.polynomial.polynomial.polyfit`.
+
+    Parameters
+    ----------
+    V : :class:`~numpy.ndarray`
+        Design matrix, shape (npix, deg+1).
+    y : :class:`~numpy.ndarray`
+        Data, shape (npix,) or (npix, nrow).
+    w : :class:`~numpy.ndarray` or ``None``
+        Weights, shape (npix,).
+    deg : :class:`int`
+        Order of the fit.
+    rcond : :class:`float`
+        Relative cutoff for small singular values.
+
+    Returns
+    -------
+    :class:`~numpy.ndarray`
+        Coefficients, shape (deg+1,) or (deg+1, nrow).
+    """
+    lhs = V
+    rhs = y
+    if w is not None:
+        lhs = lhs * w[:, np.newaxis]
+        rhs = (rhs.T * w).T
+    scl = np.sqrt((lhs*lhs).sum(axis=0))
+    scl[scl == 0] = 1
+    c, resids, rank, s = np.linalg.lstsq(lhs/scl, rhs, rcond=rcond)
+    if rank != deg + 1:
+        warnings.warn("The fit may be poorly conditioned",
+                      np.polynomial.polyutils.RankWarning)
+    return (c.T / scl).T
+
+
+def _bspline_basis(xv, ncoeff):
+    """Evaluate the uniform cubic B-splines that are nonzero at each point.
+
+    The breakpoints divide [-1, 1] into ``ncoeff - 3`` equal intervals, and
+    the knots continue uniformly beyond the ends, so each point has exactly
+    four nonzero basis functions.
+
+    Parameters
+    ----------
+    xv : :class:`~numpy.ndarray`
+        Normalized coordinates.
+    ncoeff : :class:`int`
+        Number of B-spline coefficients, at least 4.
+
+    Returns
+    -------
+    :func:`tuple`
+        The index of the first nonzero coefficient at each point, shape
+        ``xv.shape``, and the four basis values, shape ``xv.shape + (4,)``.
+    """
+    nint = ncoeff - 3
+    if nint < 1:
+        raise ValueError("B-spline fits need an order of at least 3!")
+    t = 0.5*(np.asarray(xv, dtype=np.float64) + 1.0)*nint
+    i = np.clip(np.floor(t), 0, nint - 1).astype(np.intp)
+    u = t - i
+    u2 = u*u
+    u3 = u2*u
+    B = np.stack(((1.0 - u)**3, 3.0*u3 - 6.0*u2 + 4.0,
+                  -3.0*u3 + 3.0*u2 + 3.0*u + 1.0, u3), axis=-1) / 6.0
+    return i, B
+
+
+def _bspline_val(xv, coeff):
+    """Evaluate B-spline fits.
+
+    Parameters
+    ----------
+    xv : :class:`~numpy.ndarray`
+        Normalized coordinates, shape (npix,) or (nrow, npix).
+    coeff : :class:`~numpy.ndarray`
+        Coefficients, shape (nrow, ncoeff).
+
+    Returns
+    -------
+    :class:`~numpy.ndarray`
+        Values, shape (nrow, npix).
+    """
+    i, B = _bspline_basis(np.atleast_2d(xv), coeff.shape[1])
+    i = np.broadcast_to(i, (coeff.shape[0], i.shape[1]))
+    val = np.zeros(i.shape, dtype=np.float64)
+    for j in range(4):
+        val += B[..., j]*np.take_along_axis(coeff, i + j, axis=1)
+    return val
+
+
+def _banded_solve(ab, b):
+    """Solve symmetric positive-definite banded systems by Cholesky decomposition.
+
+    Parameters
+    ----------
+    ab : :class:`~numpy.ndarray`
+        Lower bands of the matrices, shape (nrow, p+1, n), with
+        ``ab[:, d, c] = A[:, c+d, c]``.  Overwritten.
+    b : :class:`~numpy.ndarray`
+        Right-hand sides, shape (nrow, n).
+
+    Returns
+    -------
+    :class:`~numpy.ndarray`
+        Solutions, shape (nrow, n).
+    """
+    p = ab.shape[1] - 1
+    n = ab.shape[2]
+    # A small ridge keeps coefficients that no data constrain at zero.
+    diag = ab[:, 0, :]
+    ridge = 1e-12*diag.max(axis=1)
+    ridge[ridge <= 0] = 1.0
+    if (diag <= ridge[:, np.newaxis]).any():
+        warnings.warn("The fit may be poorly conditioned",
+                      np.polynomial.polyutils.RankWarning)
+    diag += ridge[:, np.newaxis]
+    for c in range(n):
+        ab[:, 0, c] = np.sqrt(ab[:, 0, c])
+        m = min(p, n - 1 - c)
+        ab[:, 1:m+1, c] /= ab[:, 0, c, np.newaxis]
+        for d1 in range(1, m + 1):
+            for d2 in range(d1, m + 1):
+                ab[:, d2 - d1, c + d1] -= ab[:, d2, c]*ab[:, d1, c]
+    z = np.array(b, dtype=np.float64)
+    for c in range(n):
+        for d in range(1, min(p, c) + 1):
+            z[:, c] -= ab[:, d, c - d]*z[:, c - d]
+        z[:, c] /= ab[:, 0, c]
+    for c in range(n - 1, -1, -1):
+        for d in range(1, min(p, n - 1 - c) + 1):
+            z[:, c] -= ab[:, d, c]*z[:, c + d]
+        z[:, c] /= ab[:, 0, c]
+    return z
+
+
+def _bspline_solve(x, deg, xmin, xmax, y, w2):
+    """Weighted least-squares B-spline fits of many rows sharing one grid.
+
+    The normal equations are banded, so they are accumulated and solved in
+    time proportional to the number of points plus the number of coefficients.
+
+    Parameters
+    ----------
+    x : :class:`~numpy.ndarray`
+        Independent data values, shape (npix,).
+    deg : :class:`int`
+        Order of the fit; the number of coefficients is ``deg + 1``.
+    xmin, xmax : :class:`float`
+        Limits mapped to [-1, 1].
+    y : :class:`~numpy.ndarray`
+        Data, shape (nrow, npix).
+    w2 : :class:`~numpy.ndarray`
+        Squared weights, shape (nrow, npix) or (npix,).  Zero weight excludes a point.
+
+    Returns
+    -------
+    :class:`~numpy.ndarray`
+        Coefficients, shape (nrow, deg+1).
+    """
+    ncoeff = deg + 1
+    i, B = _bspline_basis(2.0 * (x-xmin)/(xmax-xmin) - 1.0, ncoeff)
+    nrow = y.shape[0]
+    w2 = np.broadcast_to(w2, y.shape)
+    wy = np.where(w2 > 0, w2*y, 0.)
+    offset = (np.arange(nrow)*ncoeff)[:, np.newaxis]
+    ab = np.zeros((nrow, 4, ncoeff), dtype=np.float64)
+    b = np.zeros((nrow, ncoeff), dtype=np.float64)
+    for l in range(4):
+        idx = (offset + i + l).ravel()
+        b += np.bincount(idx, weights=(wy*B[:, l]).ravel(),
+                         minlength=nrow*ncoeff).reshape(nrow, ncoeff)
+        for j in range(l, 4):
+            ab[:, j - l, :] += np.bincount(idx, weights=(w2*(B[:, j]*B[:, l])).ravel(),
+                                           minlength=nrow*ncoeff).reshape(nrow, ncoeff)
+    return _banded_solve(ab, b)
+
+
+def _fit_rows(x, func, deg, xmin, xmax, y, w2, cache=False):
+    """Weighted least-squares fits of many rows sharing one grid.
+    """
+    if func == 'bspline':
+        return _bspline_solve(x, deg, xmin, xmax, y, w2)
+    return _solve_normal(_basis(_get_cache(cache), x, func, deg, xmin, xmax), y,
+                         np.broadcast_to(w2, y.shape))
+
+
+def _solve_normal(V, y, w2):
+    """Solve many weighted least-squares problems sharing one design matrix.
+
+    Parameters
+    ----------
+    V : :class:`~numpy.ndarray`
+        Design matrix, shape (npix, ncoeff).
+    y : :class:`~numpy.ndarray`
+        Data, shape (nrow, npix).
+    w2 : :class:`~numpy.ndarray`
+        Squared weights, shape (nrow, npix).  Zero weight excludes a point.
+
+    Returns
+    -------
+    :class:`~numpy.ndarray`
+        Coefficients, shape (nrow, ncoeff).
+    """
+    # Scale the columns to improve the condition number, as numpy does.
+    scl = np.sqrt((V*V).sum(axis=0))
+    scl[scl == 0] = 1
+    Vs = V / scl
+    ncoeff = V.shape[1]
+    # All normal matrices at once: A[r] = sum_n w2[r, n] V[n, :, None] V[n, None, :].
+    A = np.dot(w2, (Vs[:, :, np.newaxis] * Vs[:, np.newaxis, :]).reshape(-1, ncoeff*ncoeff))
+    A = A.reshape(-1, ncoeff, ncoeff)
+    b = np.dot(w2 * y, Vs)
+    return _solve(A, b) / scl
+
+
+def _solve(A, b):
+    """Solve the normal equations ``A c = b``, falling back to a
+    pseudo-inverse if `A` is singular.
+
+    Parameters
+    ----------
+    A : :class:`~numpy.ndarray`
+        Normal matrices, shape (..., ncoeff, ncoeff).
+    b : :class:`~numpy.ndarray`
+        Right-hand sides, shape (..., ncoeff).
+
+    Returns
+    -------
+    :class:`~numpy.ndarray`
+        Solutions, shape (..., ncoeff).
+    """
+    try:
+        return np.linalg.solve(A, b[..., np.newaxis])[..., 0]
+    except np.linalg.LinAlgError:
+        return np.matmul(np.linalg.pinv(A), b[..., np.newaxis])[..., 0]
+
+
+def func_fit(x, y, func, deg, xmin=None, xmax=None, w=None, cache=False,
+             **kwargs):
     """Simple function fit to 2 arrays.
 
     Modified code originally from Ryan Cooke (PYPIT).
@@ -30,9 +489,11 @@ def func_fit(x, y, func, deg, xmin=None, xmax=None, w=None, **kwargs):
     y : :class:`~numpy.ndarray`
         Dependent data to fit.
     func : :class:`str`
-        Name of the fitting function:  polynomial, legendre, chebyshev.
+        Name of the fitting function:  polynomial, legendre, chebyshev,
+        bspline.
     deg : :class:`int` or :class:`dict`
-        Order of the fit.
+        Order of the fit.  For uniform cubic B-splines (bspline), this is
+        the number of coefficients minus one, at least 3.
     xmin : :class:`float`, optional
         Minimum value in the array (or the left limit for a
         legendre/chebyshev polynomial).
@@ -41,6 +502,10 @@ def func_fit(x, y, func, deg, xmin=None, xmax=None, w=None, **kwargs):
         legendre/chebyshev polynomial).
     w : :class:`~numpy.ndarray`, optional
         Weights to be used in the fitting (weights = 1/sigma).
+    cache : :class:`bool` or :class:`BasisCache`, optional
+        If ``True``, use the module basis cache; pass a :class:`BasisCache`
+        to use a different one.  By default the basis is evaluated without
+        caching it, since a cached basis is kept in memory after the call.
 
     Returns
     -------
@@ -48,27 +513,99 @@ def func_fit(x, y, func, deg, xmin=None, xmax=None, w=None, **kwargs):
         Dictionary describing the Fit including the coefficients.
     """
     # Normalize
-    if xmin is None or xmax is None:
-        if x.size == 1:
-            xmin, xmax = -1.0, 1.0
-        else:
-            xmin, xmax = x.min(), x.max()
-    xv = 2.0 * (x-xmin)/(xmax-xmin) - 1.0
+    xmin, xmax = _limits(x, xmin, xmax)
     # Fit
-    fitters = {'polynomial': np.polynomial.polynomial.polyfit,
-               'legendre': np.polynomial.legendre.legfit,
-               'chebyshev': np.polynomial.chebyshev.chebfit}
-    try:
-        fit = fitters[func](xv, y, deg, w=w)
-    except KeyError:
-        raise ValueError("Fitting function '{0:s}' is not implemented yet.".format(func))
+    cache = _get_cache(cache)
+    if func == 'bspline':
+        w2 = np.ones(x.shape) if w is None else np.asarray(w)**2
+        fit = _bspline_solve(x, deg, xmin, xmax, y[np.newaxis, :], w2)[0]
+    elif cache is None:
+        xv = 2.0 * (x-xmin)/(xmax-xmin) - 1.0
+        try:
+            fit = _fitters[func](xv, y, deg, w=w)
+        except KeyError:
+            raise ValueError("Fitting function '{0:s}' is not implemented yet.".format(func))
+    elif w is None:
+        P, rank = cache.solver(x, func, deg, xmin, xmax)
+        if rank != deg + 1:
+            warnings.warn("The fit may be poorly conditioned",
+                          np.polynomial.polyutils.RankWarning)
+        fit = np.dot(P, y)
+    else:
+        fit = _lstsq(cache.basis(x, func, deg, xmin, xmax), y, w, deg, _rcond(x))
     # Finish
     fit_dict = dict(coeff=fit, order=deg, func=func, xmin=xmin, xmax=xmax,
                     **kwargs)
     return fit_dict
 
 
-def func_val(x, fit_dict):
+def func_fit_batch(x, y, func, deg, xmin=None, xmax=None, w=None, cache=False,
+                   **kwargs):
+    """Fit the same function to many rows of data sharing one x grid.
+
+    The basis is evaluated once, and all rows are solved together: with a
+    single least-squares call if the weights are the same for every row,
+    or with one stacked solve of the normal equations otherwise.
+
+    Parameters
+    ----------
+    x : :class:`~numpy.ndarray`
+        Independent data values, shape (npix,).
+    y : :class:`~numpy.ndarray`
+        Dependent data to fit, shape (nrow, npix).
+    func : :class:`str`
+        Name of the fitting function:  polynomial, legendre, chebyshev, bspline.
+    deg : :class:`int`
+        Order of the fit.
+    xmin : :class:`float`, optional
+        Minimum value in the array (or the left limit for a
+        legendre/chebyshev polynomial).
+    xmax : :class:`float`, optional
+        Maximum value in the array (or the right limit for a
+        legendre/chebyshev polynomial).
+    w : :class:`~numpy.ndarray`, optional
+        Weights to be used in the fitting (weights = 1/sigma), either of
+        shape (npix,) for all rows, or (nrow, npix).
+    cache : :class:`bool` or :class:`BasisCache`, optional
+        Basis cache to use, as in :func:`func_fit`.
+
+    Returns
+    -------
+    :class:`dict`
+        Dictionary describing the fits, as returned by :func:`func_fit`,
+        except that ``coeff`` has shape (nrow, deg+1), and ``batch`` is
+        ``True``.
+    """
+    y = np.atleast_2d(y)
+    xmin, xmax = _limits(x, xmin, xmax)
+    cache = _get_cache(cache)
+    if func == 'bspline':
+        w2 = np.ones(x.shape) if w is None else np.asarray(w)**2
+        coeff = _bspline_solve(x, deg, xmin, xmax, y, w2)
+    elif cache is None and np.ndim(w) < 2:
+        xv = 2.0 * (x-xmin)/(xmax-xmin) - 1.0
+        try:
+            coeff = _fitters[func](xv, y.T, deg, w=w).T
+        except KeyError:
+            raise ValueError("Fitting function '{0:s}' is not implemented yet.".format(func))
+    elif w is None:
+        P, rank = cache.solver(x, func, deg, xmin, xmax)
+        if rank != deg + 1:
+            warnings.warn("The fit may be poorly conditioned",
+                          np.polynomial.polyutils.RankWarning)
+        coeff = np.dot(y, P.T)
+    elif np.ndim(w) == 1:
+        coeff = _lstsq(cache.basis(x, func, deg, xmin, xmax), y.T, w, deg,
+                       _rcond(x)).T
+    else:
+        V = _basis(cache, x, func, deg, xmin, xmax)
+        coeff = _solve_normal(V, y, np.asarray(w)**2)
+    fit_dict = dict(coeff=coeff, order=deg, func=func, xmin=xmin, xmax=xmax,
+                    batch=True, **kwargs)
+    return fit_dict
+
+
+def func_val(x, fit_dict, cache=False):
     """Get values from a fit_dict.
 
     Modified code originally from Ryan Cooke (PYPIT).
@@ -77,21 +614,38 @@ def func_val(x, fit_dict):
     ----------
     x : :class:`~numpy.ndarray`
         Evaluate the fit at these coordinates.
+    cache : :class:`bool` or :class:`BasisCache`, optional
+        Basis cache to use, as in :func:`func_fit`.
 
     Returns
     -------
     :class:`~numpy.ndarray`
-        Array containing the values.
+        Array containing the values.  If the fit_dict holds a batch of fits
+        from :func:`func_fit_batch`, or several fits from :func:`func_fit`
+        with 2D `y`, the shape is ``(nrow,) + x.shape``.
     """
-    xv = 2.0 * (x-fit_dict['xmin'])/(fit_dict['xmax']-fit_dict['xmin']) - 1.0
-    values = {'polynomial': np.polynomial.polynomial.polyval,
-              'legendre': np.polynomial.legendre.legval,
-              'chebyshev': np.polynomial.chebyshev.chebval}
-    try:
-        val = values[fit_dict['func']](xv, fit_dict['coeff'])
-    except KeyError:
-        raise ValueError("Fitting function '{0:s}' is not implemented yet.".format(fit_dict['func']))
-    return val
+    coeff = np.asarray(fit_dict['coeff'])
+    if fit_dict['func'] == 'bspline':
+        x = np.asarray(x)
+        xv = 2.0 * (x-fit_dict['xmin'])/(fit_dict['xmax']-fit_dict['xmin']) - 1.0
+        val = _bspline_val(xv.ravel(), np.atleast_2d(coeff))
+        return val.reshape(coeff.shape[:-1] + x.shape)[()]
+    # Batches have one row per fit; 2D fits from func_fit, as in numpy,
+    # have one column per fit.
+    if coeff.ndim == 2 and not fit_dict.get('batch', False):
+        coeff = coeff.T
+    cache = _get_cache(cache)
+    if cache is None:
+        xv = 2.0 * (np.asarray(x)-fit_dict['xmin'])/(fit_dict['xmax']-fit_dict['xmin']) - 1.0
+        try:
+            return _values[fit_dict['func']](xv, coeff.T)
+        except KeyError:
+            raise ValueError("Fitting function '{0:s}' is not implemented yet.".format(fit_dict['func']))
+    V = cache.basis(np.asarray(x), fit_dict['func'], coeff.shape[-1] - 1,
+                    fit_dict['xmin'], fit_dict['xmax'])
+    if coeff.ndim == 2:
+        return np.moveaxis(np.dot(V, coeff.T), -1, 0)
+    return np.dot(V, coeff)
 
 
 def iter_fit(xarray, yarray, func, order, weights=None, sigma=None,
@@ -109,7 +663,7 @@ def iter_fit(xarray, yarray, func, order, weights=None, sigma=None,
     yarray : :class:`~numpy.ndarray`
         Dependent variable values.
     func : :class:`str`
-        Name of the fitting function:  polynomial, legendre, chebyshev.
+        Name of the fitting function:  polynomial, legendre, chebyshev, bspline.
     order : :class:`int`
         The order of the function to be used in the fitting.
     sigma : :class:`~numpy.ndarray`, optional
@@ -143,9 +697,21 @@ def iter_fit(xarray, yarray, func, order, weights=None, sigma=None,
         The tuple contains a dict containing the fit and a mask array
         containing masked values.
     """
+    if func == 'bspline':
+        # The banded solver works on batches, so fit a batch of one.
+        fdict, mask = iter_fit_batch(xarray, yarray[np.newaxis, :], func, order,
+                                     weights=weights, sigma=sigma, max_rej=max_rej,
+                                     maxone=maxone, sig_rej=sig_rej,
+                                     initialmask=(None if initialmask is None
+                                                  else initialmask[np.newaxis, :]),
+                                     forceimask=forceimask, xmin=xmin, xmax=xmax,
+                                     niter=niter, **kwargs)
+        fdict['coeff'] = fdict['coeff'][0]
+        del fdict['batch']
+        return fdict, mask[0]
     # Setup the initial mask
     if initialmask is None:
-        mask = np.zeros(xarray.size, dtype=np.int)
+        mask = np.zeros(xarray.size, dtype=int)
         if forceimask:
             warnings.warn("Initial mask cannot be enforced -- no initital mask supplied")
             forceimask = False
@@ -156,6 +722,19 @@ def iter_fit(xarray, yarray, func, order, weights=None, sigma=None,
         mask[weights <= 0.] = 1
     mskcnt = np.sum(mask)
     imskcnt = copy.copy(mskcnt)
+    # Accumulate the normal equations once, with masked points given
+    # zero weight.  Rejected points are then removed by downdating
+    # A and b, rather than refitting from scratch.
+    lo, hi = _limits(xarray, xmin, xmax)
+    V = _vander(xarray, func, order, lo, hi)
+    scl = np.sqrt((V*V).sum(axis=0))
+    scl[scl == 0] = 1
+    Vs = V / scl
+    w2 = np.ones(xarray.size) if weights is None else weights**2
+    w2 = np.where(mask == 0, w2, 0.)
+    wy = np.where(mask == 0, w2*yarray, 0.)
+    A = np.dot(Vs.T * w2, Vs)
+    b = np.dot(Vs.T, wy)
     # Iterate, and mask out new values on each iteration
     iiter = 0
     while True:
@@ -163,49 +742,38 @@ def iter_fit(xarray, yarray, func, order, weights=None, sigma=None,
         if iiter > niter:
             warnings.warn("Reached maximum number of iterations")
             break
-        # Mask
-        w = np.where(mask == 0)
-        xfit = xarray[w]
-        yfit = yarray[w]
-        if weights is not None:
-            wfit = weights[w]
-        else:
-            wfit = None
+        good = mask == 0
         # Fit
-        dfit = func_fit(xfit, yfit, func, order, xmin=xmin, xmax=xmax, w=wfit,
-                        **kwargs)
-        yrng = func_val(xarray, dfit)
+        yrng = np.dot(Vs, _solve(A, b))
+        resid = np.abs(yarray-yrng)
         # Reject
-        sigmed = 1.4826*np.median(np.abs(yfit-yrng[w]))
+        sigmed = 1.4826*np.median(resid[good])
         # Check number of parameters
         if xarray.size-np.sum(mask) <= order+2:
             warnings.warn("More parameters than data points - fit might be undesirable")
             break  # More data was masked than allowed by order
         if maxone:  # Only remove the most deviant point
             if sigma is not None:
-                tst = np.abs(yarray[w]-yrng[w])/sigma[w]
+                tst = np.where(good, resid/sigma, -np.inf)
                 m = np.argmax(tst)
-                if tst[m] > sig_rej:
-                    mask[w[0][m]] = 1
+                new = [m] if tst[m] > sig_rej else []
             else:
-                tst = np.abs(yarray[w]-yrng[w])
+                tst = np.where(good, resid, -np.inf)
                 m = np.argmax(tst)
-                if tst[m] > sig_rej*sigmed:
-                    mask[w[0][m]] = 1
+                new = [m] if tst[m] > sig_rej*sigmed else []
         else:
-            if forceimask:
-                if sigma is not None:
-                    w = np.where((np.abs(yarray-yrng) > sig_rej*sigma) |
-                                 (initialmask == 1))
-                else:
-                    w = np.where((np.abs(yarray-yrng) > sig_rej*sigmed) |
-                                 (initialmask == 1))
+            if sigma is not None:
+                bad = resid > sig_rej*sigma
             else:
-                if sigma is not None:
-                    w = np.where(np.abs(yarray-yrng) > sig_rej*sigma)
-                else:
-                    w = np.where(np.abs(yarray-yrng) > sig_rej*sigmed)
-            mask[w] = 1
+                bad = resid > sig_rej*sigmed
+            if forceimask:
+                bad |= initialmask == 1
+            new = np.flatnonzero(bad & good)
+        if len(new) > 0:
+            mask[new] = 1
+            Vn = Vs[new]
+            A -= np.dot(Vn.T * w2[new], Vn)
+            b -= np.dot(Vn.T, wy[new])
         if mskcnt == np.sum(mask):
             break   # No new values have been included in the mask
         if max_rej is not None:
@@ -220,6 +788,589 @@ def iter_fit(xarray, yarray, func, order, weights=None, sigma=None,
     return fdict, mask
 
 
+def _masked_median(a, good):
+    """Median of each row of `a`, using only the elements where `good` is ``True``.
+
+    Parameters
+    ----------
+    a : :class:`~numpy.ndarray`
+        Data, shape (nrow, npix).
+    good : :class:`~numpy.ndarray`
+        Boolean array of the same shape.
+
+    Returns
+    -------
+    :class:`~numpy.ndarray`
+        Medians, shape (nrow,); NaN for rows without good elements.
+    """
+    s = np.sort(np.where(good, a, np.inf), axis=1)
+    k = good.sum(axis=1)
+    rows = np.arange(a.shape[0])
+    lo = s[rows, np.maximum(k - 1, 0) // 2]
+    hi = s[rows, np.minimum(k // 2, a.shape[1] - 1)]
+    with np.errstate(invalid='ignore'):
+        med = 0.5*(lo + hi)
+    med[k == 0] = np.nan
+    return med
+
+
+def iter_fit_batch(xarray, yarray, func, order, weights=None, sigma=None,
+                   max_rej=None, maxone=True, sig_rej=3.0, initialmask=None,
+                   forceimask=False, xmin=None, xmax=None, niter=999, **kwargs):
+    """Perform :func:`iter_fit` on many rows of data sharing one x grid.
+
+    All rows are fit together in each iteration, with rejected points given
+    zero weight, and rows stop iterating as soon as they converge.  The
+    rejection rules are the same as in :func:`iter_fit`, so the masks and
+    fitted values match those of separate calls to :func:`iter_fit`.
+
+    Parameters
+    ----------
+    xarray : :class:`~numpy.ndarray`
+        Independent variable values, shape (npix,).
+    yarray : :class:`~numpy.ndarray`
+        Dependent variable values, shape (nrow, npix).
+    func : :class:`str`
+        Name of the fitting function:  polynomial, legendre, chebyshev, bspline.
+    order : :class:`int`
+        The order of the function to be used in the fitting.
+    sigma : :class:`~numpy.ndarray`, optional
+        Error in the yvalues, shape (npix,) or (nrow, npix).  Used only for rejection.
+    weights : :class:`~numpy.ndarray`, optional
+        Weights to be used in the fitting (weights = 1/sigma),
+        shape (npix,) or (nrow, npix).
+    maxone : :class:`bool`, optional [True]
+        If ``True``, only the most deviant point of each row in a given
+        iteration will be removed.
+    sig_rej : :class:`float`, optional [3.0]
+        Confidence interval for rejection.
+    max_rej : :class:`int`, optional [None]
+        Maximum number of points to reject.
+    initialmask : :class:`~numpy.ndarray`
+        A mask of shape (nrow, npix) can be supplied as input, these values
+        will be masked for the first iteration. 1 = value masked.
+    forceimask : :class:`bool`, optional [False]
+        If ``True``, the initialmask will be forced for all iterations.
+    niter : :class:`int`, optional [999]
+        Maximum number of iterations.
+    xmin : :class:`float`
+        Minimum value in the array (or the left limit for a
+        legendre/chebyshev polynomial).
+    xmax : :class:`float`
+        Maximum value in the array (or the right limit for a
+        legendre/chebyshev polynomial).
+
+    Returns
+    -------
+    :func:`tuple`
+        The tuple contains a dict containing the fits, as returned by
+        :func:`func_fit_batch`, and a mask array of shape (nrow, npix)
+        containing masked values.
+
+    Notes
+    -----
+    Unlike :func:`iter_fit`, the default `xmin`, `xmax` are taken from
+    all of `xarray`, rather than from the unmasked points, so that all
+    rows share them.  This changes the coefficients but not the fitted
+    values.
+    """
+    yarray = np.atleast_2d(yarray)
+    nrow, npix = yarray.shape
+    xmin, xmax = _limits(xarray, xmin, xmax)
+    # Setup the initial mask
+    if initialmask is None:
+        mask = np.zeros((nrow, npix), dtype=int)
+        if forceimask:
+            warnings.warn("Initial mask cannot be enforced -- no initital mask supplied")
+            forceimask = False
+    else:
+        mask = np.array(np.broadcast_to(initialmask, (nrow, npix)), dtype=int)
+        initialmask = mask.copy()
+    # Avoid zero or negative weights
+    if weights is not None:
+        weights = np.broadcast_to(weights, (nrow, npix))
+        mask[weights <= 0.] = 1
+    if sigma is not None:
+        sigma = np.broadcast_to(sigma, (nrow, npix))
+    mskcnt = mask.sum(axis=1)
+    imskcnt = mskcnt.copy()
+    # Every iteration uses the same basis, but it is not needed afterwards.
+    cache = BasisCache(maxsize=1)
+    # Iterate, and mask out new values on each iteration
+    active = np.ones((nrow,), dtype=bool)
+    toofew_warned = False
+    iiter = 0
+    while active.any():
+        iiter += 1
+        if iiter > niter:
+            warnings.warn("Reached maximum number of iterations")
+            break
+        rows = np.flatnonzero(active)
+        m = mask[rows]
+        good = m == 0
+        y = yarray[rows]
+        w2 = good.astype(float)
+        if weights is not None:
+            w2 *= weights[rows]**2
+        # Fit
+        yrng = func_val(xarray, mk_fit_dict(_fit_rows(xarray, func, order, xmin, xmax,
+                                                      y, w2, cache=cache),
+                                            order, func, xmin=xmin, xmax=xmax,
+                                            batch=True),
+                        cache=cache)
+        resid = np.abs(y - yrng)
+        # Reject
+        sigmed = 1.4826*_masked_median(resid, good)
+        # Check number of parameters
+        toofew = npix - m.sum(axis=1) <= order + 2
+        if toofew.any() and not toofew_warned:
+            warnings.warn("More parameters than data points - fit might be undesirable")
+            toofew_warned = True
+        if maxone:  # Only remove the most deviant point
+            if sigma is not None:
+                tst = resid/sigma[rows]
+                thresh = sig_rej
+            else:
+                tst = resid
+                thresh = sig_rej*sigmed
+            tst = np.where(good, tst, -np.inf)
+            worst = np.argmax(tst, axis=1)
+            reject = (tst[np.arange(rows.size), worst] > thresh) & ~toofew
+            m[np.flatnonzero(reject), worst[reject]] = 1
+        else:
+            if sigma is not None:
+                bad = resid > sig_rej*sigma[rows]
+            else:
+                bad = resid > sig_rej*sigmed[:, np.newaxis]
+            if forceimask:
+                bad |= initialmask[rows] == 1
+            bad &= ~toofew[:, np.newaxis]
+            m[bad] = 1
+        mask[rows] = m
+        newcnt = m.sum(axis=1)
+        done = toofew | (newcnt == mskcnt[rows])
+        if max_rej is not None:
+            done |= mskcnt[rows] - imskcnt[rows] > max_rej
+        mskcnt[rows] = newcnt
+        active[rows[done]] = False
+    # Final fit
+    coeff = _fit_rows(xarray, func, order, xmin, xmax, yarray, (mask == 0).astype(float),
+                      cache=cache)
+    fdict = dict(coeff=coeff, order=order, func=func, xmin=xmin, xmax=xmax,
+                 batch=True, **kwargs)
+    return fdict, mask
+
+
+def _huber(u, c):
+    """Huber weights of standardized residuals `u`.
+    """
+    au = np.abs(u)
+    return np.where(au <= c, 1.0, c/np.maximum(au, c))
+
+
+def _tukey(u, c):
+    """Tukey biweight weights of standardized residuals `u`.
+    """
+    return np.where(np.abs(u) < c, (1.0 - (u/c)**2)**2, 0.0)
+
+
+#
+# Robust weight functions and their default tuning constants, which give
+# 95% efficiency for normally-distributed errors.
+#
+_robust_weights = {'huber': (_huber, 1.345),
+                   'tukey': (_tukey, 4.685)}
+
+
+def robust_fit(xarray, yarray, func, order, weights=None, sigma=None,
+               loss='huber', c=None, niter=50, tol=1e-6, xmin=None, xmax=None,
+               **kwargs):
+    """A robust fit by iteratively reweighted least squares.
+
+    Instead of rejecting points, each iteration down-weights points
+    according to their residuals from the previous fit.  The basis is
+    evaluated once, and rows of a 2D `yarray` are fit together, with
+    converged rows dropping out of later iterations.
+
+    Parameters
+    ----------
+    xarray : :class:`~numpy.ndarray`
+        Independent variable values, shape (npix,).
+    yarray : :class:`~numpy.ndarray`
+        Dependent variable values, shape (npix,) or (nrow, npix).
+    func : :class:`str`
+        Name of the fitting function:  polynomial, legendre, chebyshev, bspline.
+    order : :class:`int`
+        The order of the function to be used in the fitting.
+    weights : :class:`~numpy.ndarray`, optional
+        Weights to be used in the fitting (weights = 1/sigma).  Points with
+        zero weight are ignored.
+    sigma : :class:`~numpy.ndarray` or :class:`float`, optional
+        Error in the yvalues, used to standardize the residuals.  If not
+        set, the residuals of each row are scaled by their median absolute
+        deviation.
+    loss : :class:`str`, optional ['huber']
+        Weight function:  huber, tukey.
+    c : :class:`float`, optional
+        Tuning constant of the weight function, in units of the residual
+        scale.  Defaults to 1.345 for huber and 4.685 for tukey.
+    niter : :class:`int`, optional [50]
+        Maximum number of iterations.
+    tol : :class:`float`, optional [1e-6]
+        Convergence tolerance on the change of the coefficients, relative
+        to their largest absolute value.
+    xmin : :class:`float`
+        Minimum value in the array (or the left limit for a
+        legendre/chebyshev polynomial).
+    xmax : :class:`float`
+        Maximum value in the array (or the right limit for a
+        legendre/chebyshev polynomial).
+
+    Returns
+    -------
+    :func:`tuple`
+        The tuple contains a dict containing the fit, as returned by
+        :func:`func_fit` or :func:`func_fit_batch`, and the final robust
+        weights, with the shape of `yarray`.
+    """
+    try:
+        wfunc, c0 = _robust_weights[loss]
+    except KeyError:
+        raise ValueError("Robust loss '{0}' is not implemented!".format(loss))
+    if c is None:
+        c = c0
+    single = np.ndim(yarray) == 1
+    y = np.atleast_2d(yarray)
+    nrow, npix = y.shape
+    xmin, xmax = _limits(xarray, xmin, xmax)
+    if weights is None:
+        w2 = np.ones((nrow, npix))
+    else:
+        weights = np.broadcast_to(weights, (nrow, npix))
+        w2 = np.where(weights > 0, weights**2, 0.)
+    if sigma is not None:
+        sigma = np.broadcast_to(sigma, (nrow, npix))
+    good = w2 > 0
+    cache = BasisCache(maxsize=1)
+    coeff = _fit_rows(xarray, func, order, xmin, xmax, y, w2, cache=cache)
+    rw = np.ones((nrow, npix))
+    active = np.ones((nrow,), dtype=bool)
+    for iiter in range(niter):
+        rows = np.flatnonzero(active)
+        if rows.size == 0:
+            break
+        resid = y[rows] - func_val(xarray, mk_fit_dict(coeff[rows], order, func,
+                                                       xmin=xmin, xmax=xmax,
+                                                       batch=True),
+                                   cache=cache)
+        if sigma is not None:
+            u = resid/sigma[rows]
+        else:
+            scale = 1.4826*_masked_median(np.abs(resid), good[rows])
+            scale[~(scale > 0)] = np.finfo(np.float64).tiny
+            u = resid/scale[:, np.newaxis]
+        rw[rows] = np.where(good[rows], wfunc(u, c), 0.)
+        new = _fit_rows(xarray, func, order, xmin, xmax, y[rows], w2[rows]*rw[rows],
+                        cache=cache)
+        change = np.abs(new - coeff[rows]).max(axis=1)
+        coeff[rows] = new
+        active[rows[change <= tol*np.abs(new).max(axis=1)]] = False
+    else:
+        if active.any():
+            warnings.warn("Reached maximum number of iterations")
+    fdict = dict(coeff=coeff, order=order, func=func, xmin=xmin, xmax=xmax,
+                 **kwargs)
+    if single:
+        fdict['coeff'] = coeff[0]
+        rw = rw[0]
+    else:
+        fdict['batch'] = True
+    return fdict, rw
+
+
+def _degrees(deg):
+    """Split the order of a 2D fit into the orders along each axis.
+    """
+    if np.ndim(deg) == 0:
+        return (int(deg), int(deg))
+    return (int(deg[0]), int(deg[1]))
+
+
+def _fit2d(x, y, z, func, degx, degy, limits, w2=None, grid=False, cache=False):
+    """Weighted least-squares fit of a tensor-product surface.
+
+    Parameters
+    ----------
+    x, y : :class:`~numpy.ndarray`
+        Coordinates of the data, either of each point, or of each axis of a grid.
+    z : :class:`~numpy.ndarray`
+        Data, shape ``x.shape``, or ``(x.size, y.size)`` for a grid.
+    func : :class:`str`
+        Name of the fitting function:  polynomial, legendre, chebyshev.
+    degx, degy : :class:`int`
+        Order of the fit along each axis.
+    limits : :func:`tuple`
+        The values of xmin, xmax, ymin, ymax.
+    w2 : :class:`~numpy.ndarray`, optional
+        Squared weights, shape ``z.shape``.  Zero weight excludes a point.
+    grid : :class:`bool`, optional
+        If ``True``, `z` is sampled on the grid defined by `x` and `y`.
+    cache : :class:`bool` or :class:`BasisCache`, optional
+        Basis cache to use, as in :func:`func_fit`.
+
+    Returns
+    -------
+    :class:`~numpy.ndarray`
+        Coefficients, shape (degx+1, degy+1).
+    """
+    xmin, xmax, ymin, ymax = limits
+    cache = _get_cache(cache)
+    px, py = degx + 1, degy + 1
+    if w2 is not None:
+        z = np.where(w2 > 0, z, 0.)
+    if grid and w2 is None:
+        # Separable: C = Px Z Py^T with the per-axis pseudo-inverses.
+        Px, rx = _solver(cache, x, func, degx, xmin, xmax)
+        Py, ry = _solver(cache, y, func, degy, ymin, ymax)
+        if rx != px or ry != py:
+            warnings.warn("The fit may be poorly conditioned",
+                          np.polynomial.polyutils.RankWarning)
+        return np.dot(np.dot(Px, z), Py.T)
+    Vx = _basis(cache, x, func, degx, xmin, xmax)
+    Vy = _basis(cache, y, func, degy, ymin, ymax)
+    if not grid:
+        V = (Vx[:, :, np.newaxis]*Vy[:, np.newaxis, :]).reshape(x.size, px*py)
+        w = None if w2 is None else np.sqrt(w2)
+        return _lstsq(V, z, w, px*py - 1, _rcond(x)).reshape(px, py)
+    # Normal equations of a weighted grid, built from per-axis products:
+    # A[(a,b),(c,d)] = sum_ij w2[i,j] Vx[i,a] Vx[i,c] Vy[j,b] Vy[j,d].
+    sx = np.sqrt((Vx*Vx).sum(axis=0))
+    sx[sx == 0] = 1
+    sy = np.sqrt((Vy*Vy).sum(axis=0))
+    sy[sy == 0] = 1
+    Xs = Vx / sx
+    Ys = Vy / sy
+    Kx = (Xs[:, :, np.newaxis]*Xs[:, np.newaxis, :]).reshape(x.size, px*px)
+    Ky = (Ys[:, :, np.newaxis]*Ys[:, np.newaxis, :]).reshape(y.size, py*py)
+    A = np.dot(np.dot(Kx.T, w2), Ky).reshape(px, px, py, py)
+    A = A.transpose(0, 2, 1, 3).reshape(px*py, px*py)
+    b = np.dot(np.dot(Xs.T, w2*z), Ys).ravel()
+    return _solve(A, b).reshape(px, py) / np.outer(sx, sy)
+
+
+def func_fit2d(x, y, z, func, deg, xmin=None, xmax=None, ymin=None, ymax=None,
+               w=None, grid=False, cache=False, **kwargs):
+    """Fit a 2D tensor-product surface.
+
+    Parameters
+    ----------
+    x, y : :class:`~numpy.ndarray`
+        Coordinates of each data point or, if `grid` is ``True``, of the
+        columns and rows of a grid.
+    z : :class:`~numpy.ndarray`
+        Dependent data to fit.  For a grid, ``z[i, j]`` is the value at
+        ``(x[i], y[j])``, as in :func:`numpy.polynomial.legendre.leggrid2d`.
+    func : :class:`str`
+        Name of the fitting function:  polynomial, legendre, chebyshev.
+    deg : :class:`int` or :func:`tuple`
+        Order of the fit, or the orders along x and y.
+    xmin, xmax, ymin, ymax : :class:`float`, optional
+        Limits mapped to [-1, 1] along each axis.
+    w : :class:`~numpy.ndarray`, optional
+        Weights to be used in the fitting (weights = 1/sigma), shape ``z.shape``.
+    grid : :class:`bool`, optional
+        If ``True``, fit data sampled on a grid.  Unweighted grids are
+        solved with one factorization per axis.
+    cache : :class:`bool` or :class:`BasisCache`, optional
+        Basis cache to use, as in :func:`func_fit`.
+
+    Returns
+    -------
+    :class:`dict`
+        Dictionary describing the fit.  ``coeff`` has shape
+        (degx+1, degy+1), and ``order`` is (degx, degy).
+    """
+    degx, degy = _degrees(deg)
+    x = np.asarray(x)
+    y = np.asarray(y)
+    z = np.asarray(z)
+    if grid and z.shape != (x.size, y.size):
+        raise ValueError("Gridded data must have shape (x.size, y.size)!")
+    xmin, xmax = _limits(x, xmin, xmax)
+    ymin, ymax = _limits(y, ymin, ymax)
+    w2 = None if w is None else np.asarray(w)**2
+    coeff = _fit2d(x, y, z, func, degx, degy, (xmin, xmax, ymin, ymax), w2, grid,
+                   cache)
+    fit_dict = dict(coeff=coeff, order=(degx, degy), func=func, xmin=xmin,
+                    xmax=xmax, ymin=ymin, ymax=ymax, **kwargs)
+    return fit_dict
+
+
+def func_val2d(x, y, fit_dict, grid=False, cache=False):
+    """Get values from a 2D fit_dict.
+
+    Parameters
+    ----------
+    x, y : :class:`~numpy.ndarray`
+        Evaluate the fit at these coordinates.
+    fit_dict : :class:`dict`
+        The fit, as returned by :func:`func_fit2d` or :func:`iter_fit2d`.
+    grid : :class:`bool`, optional
+        If ``True``, evaluate on the grid defined by `x` and `y`.
+    cache : :class:`bool` or :class:`BasisCache`, optional
+        Basis cache to use, as in :func:`func_fit`.
+
+    Returns
+    -------
+    :class:`~numpy.ndarray`
+        Array containing the values, of the broadcast shape of `x` and `y`,
+        or of shape ``x.shape + y.shape`` for a grid.
+    """
+    coeff = np.asarray(fit_dict['coeff'])
+    x = np.asarray(x)
+    y = np.asarray(y)
+    if not grid:
+        x, y = np.broadcast_arrays(x, y)
+    cache = _get_cache(cache)
+    Vx = _basis(cache, x, fit_dict['func'], coeff.shape[0] - 1,
+                fit_dict['xmin'], fit_dict['xmax'])
+    Vy = _basis(cache, y, fit_dict['func'], coeff.shape[1] - 1,
+                fit_dict['ymin'], fit_dict['ymax'])
+    if grid:
+        return np.tensordot(np.dot(Vx, coeff), Vy, axes=([-1], [-1]))
+    return (np.dot(Vx, coeff)*Vy).sum(axis=-1)
+
+
+def iter_fit2d(x, y, z, func, deg, weights=None, sigma=None, max_rej=None,
+               maxone=True, sig_rej=3.0, initialmask=None, forceimask=False,
+               niter=999, xmin=None, xmax=None, ymin=None, ymax=None, grid=False,
+               **kwargs):
+    """A 2D surface fit with iterative rejection, following :func:`iter_fit`.
+
+    Parameters
+    ----------
+    x, y : :class:`~numpy.ndarray`
+        Coordinates of each data point, or of the axes of a grid.
+    z : :class:`~numpy.ndarray`
+        Dependent variable values, as in :func:`func_fit2d`.
+    func : :class:`str`
+        Name of the fitting function:  polynomial, legendre, chebyshev.
+    deg : :class:`int` or :func:`tuple`
+        Order of the fit, or the orders along x and y.
+    weights : :class:`~numpy.ndarray`, optional
+        Weights to be used in the fitting (weights = 1/sigma).
+    sigma : :class:`~numpy.ndarray`, optional
+        Error in the zvalues.  Used only for rejection.
+    max_rej : :class:`int`, optional [None]
+        Maximum number of points to reject.
+    maxone : :class:`bool`, optional [True]
+        If ``True``, only the most deviant point in a given iteration will
+        be removed.
+    sig_rej : :class:`float`, optional [3.0]
+        Confidence interval for rejection.
+    initialmask : :class:`~numpy.ndarray`
+        A mask can be supplied as input, these values will be masked for
+        the first iteration. 1 = value masked.
+    forceimask : :class:`bool`, optional [False]
+        If ``True``, the initialmask will be forced for all iterations.
+    niter : :class:`int`, optional [999]
+        Maximum number of iterations.
+    xmin, xmax, ymin, ymax : :class:`float`, optional
+        Limits mapped to [-1, 1] along each axis.
+    grid : :class:`bool`, optional
+        If ``True``, fit data sampled on a grid.
+
+    Returns
+    -------
+    :func:`tuple`
+        The tuple contains a dict containing the fit and a mask array
+        containing masked values.
+
+    Notes
+    -----
+    As in :func:`iter_fit`, the weights are used during the rejection
+    iterations, and the final fit to the unmasked points is unweighted.
+    Unlike :func:`iter_fit`, the default limits are taken from all of `x`
+    and `y`, rather than from the unmasked points.  This changes the
+    coefficients but not the fitted values.
+    """
+    degx, degy = _degrees(deg)
+    x = np.asarray(x)
+    y = np.asarray(y)
+    z = np.asarray(z)
+    if grid and z.shape != (x.size, y.size):
+        raise ValueError("Gridded data must have shape (x.size, y.size)!")
+    limits = _limits(x, xmin, xmax) + _limits(y, ymin, ymax)
+    ncoeff = (degx + 1)*(degy + 1)
+    # Setup the initial mask
+    if initialmask is None:
+        mask = np.zeros(z.shape, dtype=int)
+        if forceimask:
+            warnings.warn("Initial mask cannot be enforced -- no initital mask supplied")
+            forceimask = False
+    else:
+        mask = initialmask.copy()
+    # Avoid zero or negative weights
+    if weights is not None:
+        mask[weights <= 0.] = 1
+    w2 = np.ones(z.shape) if weights is None else weights**2
+    # Every iteration uses the same bases, but they are not needed afterwards.
+    cache = BasisCache(maxsize=2)
+    fdict = dict(order=(degx, degy), func=func, xmin=limits[0], xmax=limits[1],
+                 ymin=limits[2], ymax=limits[3], **kwargs)
+    mskcnt = np.sum(mask)
+    imskcnt = copy.copy(mskcnt)
+    # Iterate, and mask out new values on each iteration
+    iiter = 0
+    while True:
+        iiter += 1
+        if iiter > niter:
+            warnings.warn("Reached maximum number of iterations")
+            break
+        good = mask == 0
+        # Fit
+        uniform = weights is None and good.all()
+        fdict['coeff'] = _fit2d(x, y, z, func, degx, degy, limits,
+                                None if uniform else np.where(good, w2, 0.), grid,
+                                cache)
+        resid = np.abs(z - func_val2d(x, y, fdict, grid=grid, cache=cache))
+        # Reject
+        sigmed = 1.4826*np.median(resid[good])
+        # Check number of parameters
+        if z.size - np.sum(mask) <= ncoeff + 1:
+            warnings.warn("More parameters than data points - fit might be undesirable")
+            break  # More data was masked than allowed by order
+        if maxone:  # Only remove the most deviant point
+            if sigma is not None:
+                tst = np.where(good, resid/sigma, -np.inf)
+                thresh = sig_rej
+            else:
+                tst = np.where(good, resid, -np.inf)
+                thresh = sig_rej*sigmed
+            m = np.unravel_index(np.argmax(tst), tst.shape)
+            if tst[m] > thresh:
+                mask[m] = 1
+        else:
+            if sigma is not None:
+                bad = resid > sig_rej*sigma
+            else:
+                bad = resid > sig_rej*sigmed
+            if forceimask:
+                bad |= initialmask == 1
+            mask[bad] = 1
+        if mskcnt == np.sum(mask):
+            break   # No new values have been included in the mask
+        if max_rej is not None:
+            if mskcnt-imskcnt > max_rej:
+                break
+        mskcnt = np.sum(mask)
+    # Final fit
+    fdict['coeff'] = _fit2d(x, y, z, func, degx, degy, limits,
+                            None if (mask == 0).all() else (mask == 0).astype(float),
+                            grid, cache)
+    return fdict, mask
+
+
 def mk_fit_dict(coeff, order, func, xmin=None, xmax=None, **kwargs):
     """Generate a dict that is formatted for using func_val.
 
@@ -230,7 +1381,7 @@ def mk_fit_dict(coeff, order, func, xmin=None, xmax=None, **kwargs):
     order : :class:`int`
         The order of the function to be used in the fitting.
     func : :class:`str`
-        Name of the fitting function:  polynomial, legendre, chebyshev.
+        Name of the fitting function:  polynomial, legendre, chebyshev, bspline.
     xmin : :class:`float`
         Minimum value in the array (or the left limit for a
         legendre/chebyshev polynomial).
@@ -246,3 +1397,407 @@ def mk_fit_dict(coeff, order, func, xmin=None, xmax=None, **kwargs):
     # Finish
     fit_dict = dict(coeff=coeff, order=order, func=func, xmin=xmin, xmax=xmax, **kwargs)
     return fit_dict
+
+
+class FitSet(object):
+    """Columnar container for many fits.
+
+    Parameters
+    ----------
+    coeff : :class:`~numpy.ndarray`
+        Coefficients, shape (nfit, ncoeff), zero-padded beyond the order
+        of each fit.
+    order : :class:`int` or :class:`~numpy.ndarray`
+        The order of each fit.
+    func : :class:`str` or :class:`~numpy.ndarray`
+        Name of the fitting function of each fit:  polynomial, legendre, chebyshev, bspline.
+    xmin, xmax : :class:`float` or :class:`~numpy.ndarray`
+        Limits of each fit.
+    meta : :class:`dict`, optional
+        Per-fit metadata, as a mapping of names to arrays of length nfit.
+    """
+
+    _columns = ('COEFF', 'ORDER', 'FUNC', 'XMIN', 'XMAX')
+
+    def __init__(self, coeff, order, func, xmin, xmax, meta=None):
+        self.coeff = np.atleast_2d(np.asarray(coeff, dtype=np.float64))
+        n = self.coeff.shape[0]
+        self.order = np.array(np.broadcast_to(order, (n,)), dtype=np.int64)
+        self.func = np.array(np.broadcast_to(np.asarray(func, dtype=str), (n,)))
+        self.xmin = np.array(np.broadcast_to(xmin, (n,)), dtype=np.float64)
+        self.xmax = np.array(np.broadcast_to(xmax, (n,)), dtype=np.float64)
+        if n > 0 and self.order.max() + 1 > self.coeff.shape[1]:
+            raise ValueError("Not enough coefficients for the order of the fits!")
+        for f in np.unique(self.func):
+            if f not in _values and f != 'bspline':
+                raise ValueError("Fitting function '{0:s}' is not implemented yet.".format(f))
+        self.meta = OrderedDict()
+        if meta is not None:
+            for key in meta:
+                if key.upper() in self._columns:
+                    raise ValueError("Metadata name '{0}' is reserved!".format(key))
+                value = np.asarray(meta[key])
+                if value.ndim == 0:
+                    value = np.array(np.broadcast_to(value, (n,)))
+                if value.shape[0] != n:
+                    raise ValueError("Metadata '{0}' does not have one value per fit!".format(key))
+                self.meta[key] = value
+
+    @classmethod
+    def from_dicts(cls, fits):
+        """Collect fit dicts, as returned by :func:`func_fit` or :func:`iter_fit`.
+
+        Parameters
+        ----------
+        fits : sequence of :class:`dict`
+            The fits.  Keys other than those set by :func:`mk_fit_dict`
+            become metadata, and must be present in every fit.
+
+        Returns
+        -------
+        :class:`FitSet`
+            The fits.
+        """
+        fits = list(fits)
+        n = len(fits)
+        ncoeff = max([len(f['coeff']) for f in fits] + [1])
+        coeff = np.zeros((n, ncoeff), dtype=np.float64)
+        for k, f in enumerate(fits):
+            coeff[k, :len(f['coeff'])] = f['coeff']
+        standard = ('coeff', 'order', 'func', 'xmin', 'xmax')
+        keys = [key for key in (fits[0] if n > 0 else {}) if key not in standard]
+        try:
+            meta = OrderedDict([(key, [f[key] for f in fits]) for key in keys])
+        except KeyError as e:
+            raise ValueError("Metadata {0} is not present in every fit!".format(e))
+        return cls(coeff, [f['order'] for f in fits], [f['func'] for f in fits],
+                   [f['xmin'] for f in fits], [f['xmax'] for f in fits], meta=meta)
+
+    @classmethod
+    def from_batch(cls, fit_dict):
+        """Convert the result of :func:`func_fit_batch` or :func:`iter_fit_batch`.
+
+        Parameters
+        ----------
+        fit_dict : :class:`dict`
+            The fits.  Extra keys become metadata; they must be scalars
+            or have one value per fit.
+
+        Returns
+        -------
+        :class:`FitSet`
+            The fits.
+        """
+        meta = OrderedDict([(key, fit_dict[key]) for key in fit_dict
+                            if key not in ('coeff', 'order', 'func', 'xmin', 'xmax', 'batch')])
+        return cls(fit_dict['coeff'], fit_dict['order'], fit_dict['func'],
+                   fit_dict['xmin'], fit_dict['xmax'], meta=meta)
+
+    def __len__(self):
+        return self.coeff.shape[0]
+
+    def __getitem__(self, key):
+        """Return one fit as a dict, or a subset of fits as a :class:`FitSet`.
+        """
+        if isinstance(key, (int, np.integer)):
+            order = int(self.order[key])
+            return mk_fit_dict(self.coeff[key, :order+1].copy(), order,
+                               str(self.func[key]), xmin=float(self.xmin[key]),
+                               xmax=float(self.xmax[key]),
+                               **dict([(m, self.meta[m][key]) for m in self.meta]))
+        return FitSet(self.coeff[key], self.order[key], self.func[key],
+                      self.xmin[key], self.xmax[key],
+                      meta=OrderedDict([(m, self.meta[m][key]) for m in self.meta]))
+
+    def __iter__(self):
+        for k in range(len(self)):
+            yield self[k]
+
+    def __repr__(self):
+        return "FitSet(nfit={0:d}, ncoeff={1:d}, funcs={2})".format(
+            len(self), self.coeff.shape[1], ','.join(np.unique(self.func)))
+
+    def to_dicts(self):
+        """Convert to a list of fit dicts usable by :func:`func_val`.
+
+        Returns
+        -------
+        :class:`list`
+            The fits.
+        """
+        return list(self)
+
+    def evaluate(self, x):
+        """Evaluate all fits.
+
+        Parameters
+        ----------
+        x : :class:`~numpy.ndarray`
+            Coordinates, either shape (npix,) shared by all fits, or
+            shape (nfit, npix) with one grid per fit.
+
+        Returns
+        -------
+        :class:`~numpy.ndarray`
+            Values, shape (nfit, npix).
+        """
+        x = np.asarray(x, dtype=np.float64)
+        n = len(self)
+        if x.ndim == 2 and x.shape[0] != n:
+            raise ValueError("Per-fit coordinates must have one row per fit!")
+        out = np.empty((n, x.shape[-1]), dtype=np.float64)
+        for f in np.unique(self.func):
+            i = np.flatnonzero(self.func == f)
+            xi = x[i] if x.ndim == 2 else x[np.newaxis, :]
+            xv = (2.0*(xi - self.xmin[i, np.newaxis]) /
+                  (self.xmax - self.xmin)[i, np.newaxis] - 1.0)
+            if f == 'bspline':
+                # The breakpoints depend on the number of coefficients.
+                for o in np.unique(self.order[i]):
+                    k = self.order[i] == o
+                    out[i[k]] = _bspline_val(xv[k] if xv.shape[0] > 1 else xv,
+                                             self.coeff[i[k], :o+1])
+            else:
+                out[i] = _values[f](xv, self.coeff[i].T[:, :, np.newaxis], tensor=False)
+        return out
+
+    def to_hdu(self, extname='FITS'):
+        """Convert to a FITS binary table.
+
+        Parameters
+        ----------
+        extname : :class:`str`, optional
+            Name of the HDU.
+
+        Returns
+        -------
+        :class:`~astropy.io.fits.BinTableHDU`
+            Table with columns ``COEFF``, ``ORDER``, ``FUNC``, ``XMIN``,
+            ``XMAX`` and one column for each metadata item.
+        """
+        from astropy.io import fits
+        from astropy.table import Table
+        t = Table()
+        for name, value in zip(self._columns, (self.coeff, self.order, self.func,
+                                               self.xmin, self.xmax)):
+            t[name] = value
+        for key in self.meta:
+            t[key] = self.meta[key]
+        hdu = fits.table_to_hdu(t)
+        hdu.name = extname
+        return hdu
+
+    @classmethod
+    def from_hdu(cls, hdu):
+        """Read from a FITS binary table written by :meth:`to_hdu`.
+
+        Parameters
+        ----------
+        hdu : :class:`~astropy.io.fits.BinTableHDU`
+            The table.
+
+        Returns
+        -------
+        :class:`FitSet`
+            The fits.
+        """
+        from astropy.table import Table
+        t = Table.read(hdu)
+        meta = OrderedDict([(key, np.asarray(t[key])) for key in t.colnames
+                            if key not in cls._columns])
+        return cls(np.asarray(t['COEFF']), np.asarray(t['ORDER']),
+                   np.asarray(t['FUNC']), np.asarray(t['XMIN']),
+                   np.asarray(t['XMAX']), meta=meta)
+
+
+def _iter_fit_chunk(args):
+    """Fit one chunk of rows for :func:`iter_fit_pool`.
+
+    The inputs are read from, and the mask written to, ``.npy`` files
+    opened as memory maps, so only file names cross process boundaries.
+
+    Parameters
+    ----------
+    args : :func:`tuple`
+        Directory holding the arrays, start and stop rows, function,
+        order, names of the per-row keyword arrays and the other keywords.
+
+    Returns
+    -------
+    :func:`tuple`
+        Start row, coefficients, xmin and xmax of the chunk, and a list of
+        the (category, message) of the warnings issued by the fits, with
+        the rows they refer to appended to the message.
+    """
+    tmpdir, start, stop, func, order, rowkeys, kwargs = args
+    x = np.load(os.path.join(tmpdir, 'x.npy'), mmap_mode='r')
+    y = np.array(np.load(os.path.join(tmpdir, 'y.npy'), mmap_mode='r')[start:stop])
+    for key in rowkeys:
+        kwargs[key] = np.array(np.load(os.path.join(tmpdir, key + '.npy'),
+                                       mmap_mode='r')[start:stop])
+    caught = []
+
+    def record(w, first, last):
+        rows = ("fit {0:d}".format(first) if first == last
+                else "fits {0:d}-{1:d}".format(first, last))
+        for m in w:
+            caught.append((m.category, "{0} ({1})".format(m.message, rows)))
+
+    if x.ndim == 1:
+        with warnings.catch_warnings(record=True) as w:
+            warnings.simplefilter('always')
+            fit, mask = iter_fit_batch(np.array(x), y, func, order, **kwargs)
+        record(w, start, stop - 1)
+        coeff, xmin, xmax = fit['coeff'], fit['xmin'], fit['xmax']
+    else:
+        x = np.array(x[start:stop])
+        n = stop - start
+        coeff = np.zeros((n, order + 1), dtype=np.float64)
+        xmin = np.zeros((n,), dtype=np.float64)
+        xmax = np.zeros((n,), dtype=np.float64)
+        mask = np.zeros(y.shape, dtype=int)
+        for k in range(n):
+            rkw = dict([(key, kwargs[key][k] if key in rowkeys else kwargs[key])
+                        for key in kwargs])
+            with warnings.catch_warnings(record=True) as w:
+                warnings.simplefilter('always')
+                fit, mask[k] = iter_fit(x[k], y[k], func, order, **rkw)
+            record(w, start + k, start + k)
+            coeff[k], xmin[k], xmax[k] = fit['coeff'], fit['xmin'], fit['xmax']
+    out = np.load(os.path.join(tmpdir, 'mask.npy'), mmap_mode='r+')
+    out[start:stop] = mask
+    out.flush()
+    del out
+    return start, coeff, xmin, xmax, caught
+
+
+def iter_fit_pool(xarray, yarray, func, order, nproc=None, chunksize=256,
+                  tmpdir=None, **kwargs):
+    """Run :func:`iter_fit` on many independent rows with a process pool.
+
+    The inputs are copied once to memory-mapped files in a temporary
+    directory, and each worker fits chunks of rows, reading its rows from,
+    and writing its masks to, those files.  Rows sharing one x grid are
+    fit with :func:`iter_fit_batch`.  Warnings issued by the fits in the
+    workers are issued again in this process, naming the rows they refer to.
+
+    Parameters
+    ----------
+    xarray : :class:`~numpy.ndarray`
+        Independent variable values, either shape (npix,) for all rows,
+        or shape (nfit, npix).
+    yarray : :class:`~numpy.ndarray`
+        Dependent variable values, shape (nfit, npix).
+    func : :class:`str`
+        Name of the fitting function:  polynomial, legendre, chebyshev, bspline.
+    order : :class:`int`
+        The order of the function to be used in the fitting.
+    nproc : :class:`int`, optional
+        Number of worker processes; defaults to the number of CPUs.  With
+        ``nproc=1`` the chunks are fit in this process.
+    chunksize : :class:`int`, optional
+        Number of rows given to a worker at a time.
+    tmpdir : :class:`str`, optional
+        Directory in which to create the memory-mapped files.
+    kwargs : :class:`dict`
+        Other arguments passed to :func:`iter_fit`.  Arrays of shape
+        (nfit, npix), such as `weights`, `sigma` or `initialmask`, are
+        split by row.
+
+    Returns
+    -------
+    :func:`tuple`
+        The tuple contains a :class:`FitSet` and a mask array of shape
+        (nfit, npix) containing masked values.
+    """
+    import multiprocessing
+    from shutil import rmtree
+    from tempfile import mkdtemp
+    xarray = np.asarray(xarray)
+    yarray = np.atleast_2d(yarray)
+    nfit, npix = yarray.shape
+    if xarray.ndim == 2 and xarray.shape != yarray.shape:
+        raise ValueError("Per-fit x values must have the same shape as the y values!")
+    if nproc is None:
+        nproc = multiprocessing.cpu_count()
+    rowkeys = [key for key in kwargs
+               if isinstance(kwargs[key], np.ndarray) and kwargs[key].shape == yarray.shape]
+    d = mkdtemp(dir=tmpdir)
+    try:
+        np.save(os.path.join(d, 'x.npy'), xarray)
+        np.save(os.path.join(d, 'y.npy'), yarray)
+        for key in rowkeys:
+            np.save(os.path.join(d, key + '.npy'), kwargs[key])
+        mask = np.lib.format.open_memmap(os.path.join(d, 'mask.npy'), mode='w+',
+                                         dtype=int, shape=yarray.shape)
+        del mask
+        other = dict([(key, kwargs[key]) for key in kwargs if key not in rowkeys])
+        chunks = [(d, start, min(start + chunksize, nfit), func, order, rowkeys, other)
+                  for start in range(0, nfit, chunksize)]
+        coeff = np.zeros((nfit, order + 1), dtype=np.float64)
+        xmin = np.zeros((nfit,), dtype=np.float64)
+        xmax = np.zeros((nfit,), dtype=np.float64)
+        if nproc == 1:
+            results = map(_iter_fit_chunk, chunks)
+            pool = None
+        else:
+            pool = multiprocessing.Pool(nproc)
+            results = pool.imap_unordered(_iter_fit_chunk, chunks)
+        try:
+            for start, c, lo, hi, caught in results:
+                stop = start + c.shape[0]
+                coeff[start:stop], xmin[start:stop], xmax[start:stop] = c, lo, hi
+                for category, message in caught:
+                    warnings.warn(message, category)
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+        mask = np.array(np.load(os.path.join(d, 'mask.npy'), mmap_mode='r'))
+    finally:
+        rmtree(d)
+    return FitSet(coeff, order, func, xmin, xmax), mask
+
+
+def iter_fit_pool_benchmark(nfit=20000, npix=1000, order=5, nprocs=None,
+                            chunksize=500, seed=1):
+    """Measure how :func:`iter_fit_pool` scales with the number of processes.
+
+    Parameters
+    ----------
+    nfit : :class:`int`, optional
+        Number of rows of simulated data.
+    npix : :class:`int`, optional
+        Number of points in each row.
+    order : :class:`int`, optional
+        Order of the Legendre fits.
+    nprocs : sequence of :class:`int`, optional
+        Numbers of processes to try; defaults to powers of two up to the
+        number of CPUs.
+    chunksize : :class:`int`, optional
+        Number of rows given to a worker at a time.
+    seed : :class:`int`, optional
+        Random seed of the simulated data.
+
+    Returns
+    -------
+    :class:`list`
+        A list of (number of processes, seconds, fits per second) tuples.
+    """
+    import multiprocessing
+    from time import time
+    if nprocs is None:
+        ncpu = multiprocessing.cpu_count()
+        nprocs = [2**k for k in range(ncpu.bit_length()) if 2**k <= ncpu]
+    rng = np.random.RandomState(seed)
+    x = np.linspace(3600, 9800, npix)
+    y = (np.sin(x/1000.)[np.newaxis, :] + rng.normal(0, 0.01, (nfit, npix)))
+    outliers = rng.randint(0, npix, (nfit, 5))
+    y[np.arange(nfit)[:, np.newaxis], outliers] += 1.0
+    results = []
+    for nproc in nprocs:
+        t0 = time()
+        iter_fit_pool(x, y, 'legendre', order, nproc=nproc, chunksize=chunksize)
+        t = time() - t0
+        results.append((nproc, t, nfit/t))
+    return results
@@ -15,6 +15,8 @@ import os
 import numpy as np
 import numpy.ma
 
+from .stats import binned_stats
+
 try:
     basestring
 except NameError:  # For Python 3
@@ -67,20 +69,13 @@ def plot_slices(x, y, x_lo, x_hi, y_cut, num_slices=5, min_count=100, axis=None,
     if axis is None:
         axis = plt.gca()
 
-    x_bins = np.linspace(x_lo, x_hi, num_slices + 1)
-    x_i = np.digitize(x, x_bins) - 1
-    limits = []
-    counts = []
-    for s in range(num_slices):
-        # Calculate percentile statistics for ok fits.
-        y_slice = y[(x_i == s)]
-        counts.append(len(y_slice))
-        if counts[-1] > 0:
-            limits.append(np.percentile(y_slice, (2.5, 16, 50, 84, 97.5)))
-        else:
-            limits.append((0., 0., 0., 0., 0.))
-    limits = np.array(limits)
-    counts = np.array(counts)
+    # Calculate percentile statistics for ok fits.
+    stats = binned_stats(x, y, bins=num_slices, range=(x_lo, x_hi),
+                         per=(2.5, 16, 50, 84, 97.5))
+    x_bins = stats['edges']
+    counts = stats['count']
+    limits = stats['percentiles']
+    limits[counts == 0] = 0.
 
     # Plot scatter of all fits.
     axis.scatter(x, y, s=15, marker='.', lw=0, color='b', alpha=0.5)
@@ -28,15 +28,76 @@ class GaussianMixtureModel(object):
         number of dimensions.
     covtype : :class:`str`, optional
         Type of covariance.  Defaults to 'full'.
+
+    Notes
+    -----
+    The covariances are factored once, when the model is created or
+    `covars` is assigned.  Assign a new array to `covars`, rather than
+    changing it in place, to change the covariances of a model.
     """
 
     def __init__(self, weights, means, covars, covtype='full'):
         self.weights = weights
         self.means = means
-        self.covars = covars
         self.covtype = covtype
+        self.covars = covars
         self.n_components, self.n_dimensions = self.means.shape
 
+    @property
+    def covars(self):
+        """The covariances of the components.
+        """
+        return self._covars
+
+    @covars.setter
+    def covars(self, value):
+        self._covars = value
+        self._factors = None
+        if self.covtype == 'full':
+            self._factors = self._factor(value)
+
+    @staticmethod
+    def _factor(covars):
+        """Compute matrices `L` with ``L L^T`` equal to each covariance.
+
+        Parameters
+        ----------
+        covars : :class:`numpy.ndarray`
+            A 3D array of covariances.
+
+        Returns
+        -------
+        :class:`numpy.ndarray`
+            The Cholesky factors, or for covariances that are only positive
+            semi-definite, the eigenvectors scaled by the square root of
+            the eigenvalues.
+
+        Warns
+        -----
+        RuntimeWarning
+            If a covariance has significantly negative eigenvalues.  These
+            are set to zero, as :meth:`numpy.random.RandomState.multivariate_normal`
+            would, so the samples do not have that covariance.
+        """
+        import warnings
+        import numpy as np
+        covars = np.asarray(covars, dtype=np.float64)
+        try:
+            return np.linalg.cholesky(covars)
+        except np.linalg.LinAlgError:
+            pass
+        factors = np.empty(covars.shape, dtype=np.float64)
+        for comp, cov in enumerate(covars):
+            try:
+                factors[comp] = np.linalg.cholesky(cov)
+            except np.linalg.LinAlgError:
+                s, v = np.linalg.eigh(cov)
+                if s.min() < -1e-8*max(np.abs(s).max(), np.finfo(np.float64).tiny):
+                    warnings.warn("covariance is not positive-semidefinite.",
+                                  RuntimeWarning)
+                factors[comp] = v * np.sqrt(np.clip(s, 0, None))
+        return factors
+
     @staticmethod
     def save(model, filename):
         """Save a model to a file.
@@ -110,18 +171,24 @@ class GaussianMixtureModel(object):
         if random_state is None:
             random_state = np.random.RandomState()
 
+        if self._factors is None:
+            self._factors = self._factor(self.covars)
+
         weight_cdf = np.cumsum(self.weights)
         X = np.empty((n_samples, self.n_dimensions))
         rand = random_state.rand(n_samples)
         # decide which component to use for each sample
-        comps = weight_cdf.searchsorted(rand)
-        # for each component, generate all needed samples
+        comps = np.minimum(weight_cdf.searchsorted(rand), self.n_components - 1)
+        # group the samples by component, and draw all normal deviates at once
+        order = np.argsort(comps.astype(np.min_scalar_type(self.n_components)),
+                           kind='stable')
+        counts = np.bincount(comps, minlength=self.n_components)
+        offsets = np.concatenate(([0], np.cumsum(counts)))
+        Z = random_state.standard_normal((n_samples, self.n_dimensions))
+        # transform the deviates of each component with one matrix product
         for comp in range(self.n_components):
-            # occurrences of current component in X
-            comp_in_X = (comp == comps)
-            # number of those occurrences
-            num_comp_in_X = comp_in_X.sum()
-            if num_comp_in_X > 0:
-                X[comp_in_X] = random_state.multivariate_normal(
-                    self.means[comp], self.covars[comp], num_comp_in_X)
+            start, stop = offsets[comp], offsets[comp + 1]
+            if stop > start:
+                X[order[start:stop]] = (self.means[comp] +
+                                        np.dot(Z[start:stop], self._factors[comp].T))
         return X
@@ -5,13 +5,16 @@
 lvmutil.stats
 ==============
 
-Just contains a dead-simple wrapper on :func:`numpy.percentile`.
+Percentiles and related statistics: a dead-simple wrapper on
+:func:`numpy.percentile`, batch and binned versions of it, and streaming
+accumulators for data that do not fit in memory.
 """
 from __future__ import (print_function, absolute_import, division,
                         unicode_literals)
+import numpy as np
 
 
-def perc(x, per=68.2):
+def perc(x, per=68.2, weights=None):
     """Calculate the percentile bounds of a distribution,
     *i.e.* for per=68, the code returns the upper and lower bounds
     that encompass 68 percent of the distribution.
@@ -24,11 +27,941 @@ def perc(x, per=68.2):
         numpy array of values
     per : :class:`float`, optional
         Percentile for the calculation [0-100].
+    weights : :class:`numpy.ndarray`, optional
+        Weight of each value, see :func:`weighted_percentile`.
 
     Returns
     -------
     :class:`numpy.ndarray`
         Value at lower, value at upper.
     """
+    if weights is not None:
+        return weighted_percentile(x, [50-per/2.0, 50+per/2.0], weights)
     from numpy import percentile
     return percentile(x, [50-per/2.0, 50+per/2.0])
+
+
+def _group_percentiles(group, values, weights, offsets, q):
+    """Interpolate percentiles within groups of sorted values.
+
+    Parameters
+    ----------
+    group : :class:`numpy.ndarray`
+        Group of each value, sorted.
+    values : :class:`numpy.ndarray`
+        Values, sorted within each group.
+    weights : :class:`numpy.ndarray`
+        Positive weights of the values.
+    offsets : :class:`numpy.ndarray`
+        Index of the first value of each group, and the total number of
+        values, shape (ngroup+1,).
+    q : :class:`numpy.ndarray`
+        Quantiles, in [0, 1].
+
+    Returns
+    -------
+    :class:`numpy.ndarray`
+        Percentiles, shape (ngroup, q.size); NaN for empty groups.
+    """
+    ngroup = offsets.size - 1
+    count = np.diff(offsets)
+    result = np.full((ngroup, q.size), np.nan)
+    if values.size == 0:
+        return result
+    # Weight before each value, normalized within its group so that the
+    # first value is at 0 and the last at 1.  With equal weights this is
+    # the linear interpolation of numpy.percentile.
+    cw = np.cumsum(weights)
+    before = cw - weights
+    base = np.concatenate(([0.], cw))[offsets[:-1]]
+    last = np.maximum(offsets[1:] - 1, 0)
+    span = (cw[last] - weights[last]) - base
+    ok = count > 0
+    with np.errstate(invalid='ignore', divide='ignore'):
+        c = np.where(span[group] > 0, (before - base[group])/span[group], 0.)
+    # Groups are separated by offsetting the positions by twice the group number.
+    key = 2.0*group + c
+    b = np.flatnonzero(ok)
+    target = 2.0*b[:, np.newaxis] + q[np.newaxis, :]
+    lo = np.searchsorted(key, target, side='right') - 1
+    lo = np.clip(lo, offsets[b, np.newaxis], last[b, np.newaxis])
+    hi = np.minimum(lo + 1, last[b, np.newaxis])
+    with np.errstate(invalid='ignore', divide='ignore'):
+        frac = np.where(hi > lo, (target - key[lo])/(key[hi] - key[lo]), 0.)
+    frac = np.clip(frac, 0., 1.)
+    result[b] = values[lo] + frac*(values[hi] - values[lo])
+    return result
+
+
+def weighted_percentile(x, per, weights=None):
+    """Calculate weighted percentiles of a distribution.
+
+    The sorted values are placed at the fraction of the total weight
+    that precedes them, normalized so the smallest value is at 0 and the
+    largest at 100, and percentiles are linearly interpolated between
+    them.  With equal weights this is the same as :func:`numpy.percentile`.
+
+    Parameters
+    ----------
+    x : :class:`numpy.ndarray`
+        Values.
+    per : :class:`float` or array-like
+        Percentiles for the calculation [0-100].
+    weights : :class:`numpy.ndarray`, optional
+        Non-negative weight of each value; values with zero weight are ignored.
+
+    Returns
+    -------
+    :class:`float` or :class:`numpy.ndarray`
+        Values at the requested percentiles.
+    """
+    x = np.asarray(x, dtype=np.float64).ravel()
+    w = np.ones(x.shape) if weights is None else np.asarray(weights, dtype=np.float64).ravel()
+    if np.any(w < 0):
+        raise ValueError("Weights must not be negative!")
+    per = np.asarray(per, dtype=np.float64)
+    if np.any((per < 0) | (per > 100)):
+        raise ValueError("Percentiles must be in the range [0, 100]!")
+    keep = w > 0
+    x = x[keep]
+    w = w[keep]
+    i = np.argsort(x, kind='mergesort')
+    result = _group_percentiles(np.zeros(x.shape, dtype=np.intp), x[i], w[i],
+                                np.array([0, x.size]), per.ravel()/100.0)
+    return result[0].reshape(per.shape)[()]
+
+
+def binned_stats(x, y, bins=10, range=None, weights=None,
+                 per=(2.5, 16., 50., 84., 97.5)):
+    """Calculate statistics of `y` in bins of `x`.
+
+    The values are sorted once, by bin and then by `y`, so every bin is a
+    contiguous slice, and all statistics of all bins are computed together.
+
+    Parameters
+    ----------
+    x : :class:`numpy.ndarray`
+        Values used to bin the data.
+    y : :class:`numpy.ndarray`
+        Values for which the statistics are computed.
+    bins : :class:`int` or :class:`numpy.ndarray`, optional
+        Number of equal bins, or increasing bin edges.  As in
+        :func:`numpy.histogram`, each bin includes its left edge and excludes
+        its right edge, except for the last bin, which includes both.
+    range : :func:`tuple`, optional
+        Lower and upper edges of the bins if `bins` is a number; default to
+        the range of `x`, which must then not be empty.
+    weights : :class:`numpy.ndarray`, optional
+        Non-negative weight of each value; values with zero weight are ignored.
+    per : array-like, optional
+        Percentiles to compute in each bin [0-100].
+
+    Returns
+    -------
+    :class:`dict`
+        A dict with the bin ``edges``, and for each bin the ``count`` of
+        values, the sum of their weights (``weight``), their weighted
+        ``mean``, and the ``percentiles``, shape (nbins, len(per)).  Empty
+        bins have NaN mean and percentiles.
+    """
+    x = np.asarray(x, dtype=np.float64).ravel()
+    y = np.asarray(y, dtype=np.float64).ravel()
+    w = np.ones(x.shape) if weights is None else np.asarray(weights, dtype=np.float64).ravel()
+    if np.any(w < 0):
+        raise ValueError("Weights must not be negative!")
+    if np.ndim(bins) == 0:
+        if range is None and x.size == 0:
+            raise ValueError("The range of the bins must be given if x is empty!")
+        lo, hi = (x.min(), x.max()) if range is None else range
+        edges = np.linspace(lo, hi, int(bins) + 1)
+    else:
+        edges = np.asarray(bins, dtype=np.float64)
+    nbins = edges.size - 1
+    per = np.asarray(per, dtype=np.float64)
+    ibin = np.searchsorted(edges, x, side='right') - 1
+    ibin[x == edges[-1]] = nbins - 1
+    keep = (ibin >= 0) & (ibin < nbins) & (w > 0) & ~np.isnan(y)
+    ibin = ibin[keep]
+    y = y[keep]
+    w = w[keep]
+    # Sort by y, then stably by bin; small integer bins use a radix sort.
+    i = np.argsort(y)
+    i = i[np.argsort(ibin[i].astype(np.min_scalar_type(nbins)), kind='stable')]
+    ibin = ibin[i]
+    y = y[i]
+    w = w[i]
+    count = np.bincount(ibin, minlength=nbins)
+    offsets = np.concatenate(([0], np.cumsum(count)))
+    # bincount() returns integers for empty input, even with weights.
+    weight = np.bincount(ibin, weights=w, minlength=nbins).astype(np.float64)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = np.bincount(ibin, weights=w*y, minlength=nbins)/weight
+    mean[count == 0] = np.nan
+    percentiles = _group_percentiles(ibin, y, w, offsets, per.ravel()/100.0)
+    return dict(edges=edges, count=count, weight=weight, mean=mean,
+                percentiles=percentiles)
+
+
+def _ranked(a, ranks):
+    """Select the values of given rank in each row.
+
+    Parameters
+    ----------
+    a : :class:`numpy.ndarray`
+        Data, shape (nrow, n), with invalid values set to +inf.
+    ranks : :class:`numpy.ndarray`
+        Integer ranks, shape (nrow, nrank).
+
+    Returns
+    -------
+    :class:`numpy.ndarray`
+        Values, shape (nrow, nrank).
+    """
+    kth = np.unique(ranks)
+    if kth.size <= 512:
+        # One partial sort puts every requested rank of every row in place.
+        a = np.partition(a, kth, axis=1)
+    else:
+        a = np.sort(a, axis=1)
+    return np.take_along_axis(a, ranks, axis=1)
+
+
+def perc_batch(x, per=68.2, axis=-1, ignore_nan=True, out=None):
+    """Calculate percentile bounds of many distributions at once.
+
+    For each `per`, returns the lower and upper bounds that encompass
+    that percentage of the values along `axis`, using the same linear
+    interpolation as :func:`perc`.
+
+    Parameters
+    ----------
+    x : :class:`numpy.ndarray` or :class:`numpy.ma.MaskedArray`
+        Values; masked values are ignored.
+    per : :class:`float` or array-like, optional
+        Percentiles for the calculation [0-100].
+    axis : :class:`int`, optional
+        Axis along which to compute the bounds.
+    ignore_nan : :class:`bool`, optional
+        If ``True`` (the default), NaN values are ignored; otherwise the
+        bounds of any distribution containing NaN are NaN.
+    out : :class:`numpy.ndarray`, optional
+        Preallocated output array, of the shape of the result.  The bounds
+        are computed directly into `out` if it is a C-contiguous
+        float64 array, and copied into it otherwise.
+
+    Returns
+    -------
+    :class:`numpy.ndarray`
+        Lower and upper bounds, of shape ``per.shape + (2,)`` followed by
+        the shape of `x` without `axis`.  Distributions without valid
+        values have NaN bounds.
+    """
+    per = np.asarray(per, dtype=np.float64)
+    q = np.stack((50-per/2.0, 50+per/2.0), axis=-1)/100.0
+    if np.any((q < 0) | (q > 1)):
+        raise ValueError("Percentiles must be in the range [0, 100]!")
+    valid = ~np.ma.getmaskarray(x)
+    a = np.moveaxis(np.ma.getdata(x), axis, -1)
+    valid = np.moveaxis(valid, axis, -1)
+    rest = a.shape[:-1]
+    n = a.shape[-1]
+    a = a.reshape(-1, n).astype(np.float64)
+    unmasked = valid.reshape(-1, n)
+    isnan = np.isnan(a)
+    valid = unmasked & ~isnan
+    m = valid.sum(axis=1)
+    a[~valid] = np.inf
+    # Positions of each quantile in each sorted row.
+    pos = q.ravel()[np.newaxis, :]*np.maximum(m - 1, 0)[:, np.newaxis]
+    lo = np.floor(pos).astype(np.intp)
+    hi = np.minimum(lo + 1, np.maximum(m - 1, 0)[:, np.newaxis])
+    v = _ranked(a, np.hstack((lo, hi)))
+    vlo, vhi = v[:, :lo.shape[1]], v[:, lo.shape[1]:]
+    shape = q.shape + rest
+    if out is not None and out.shape != shape:
+        raise ValueError("out must have shape {0}!".format(shape))
+    direct = (out is not None and out.dtype == np.float64 and
+              out.flags.c_contiguous and out.flags.writeable)
+    result = out if direct else np.empty(shape, dtype=np.float64)
+    # Rows of x are the columns of the result.
+    res = result.reshape(q.size, -1).T
+    with np.errstate(invalid='ignore'):
+        np.subtract(vhi, vlo, out=res)
+        res *= pos - lo
+        res += vlo
+    same = vlo == vhi
+    res[same] = vlo[same]
+    bad = m == 0
+    if not ignore_nan:
+        bad |= (isnan & unmasked).any(axis=1)
+    res[bad] = np.nan
+    if out is None or direct:
+        return result
+    out[...] = result
+    return out
+
+
+def _median(a, valid):
+    """Median of each row of `a`, using only the `valid` elements.
+
+    Parameters
+    ----------
+    a : :class:`numpy.ndarray`
+        Data, shape (nrow, n).
+    valid : :class:`numpy.ndarray`
+        Boolean array of the same shape.
+
+    Returns
+    -------
+    :class:`numpy.ndarray`
+        Medians, shape (nrow,); NaN for rows without valid elements.
+    """
+    m = valid.sum(axis=1)
+    ranks = np.stack((np.maximum(m - 1, 0)//2, m//2), axis=1)
+    ranks = np.minimum(ranks, a.shape[1] - 1)
+    v = _ranked(np.where(valid, a, np.inf), ranks)
+    with np.errstate(invalid='ignore'):
+        med = 0.5*(v[:, 0] + v[:, 1])
+    med[m == 0] = np.nan
+    return med
+
+
+def sigma_clipped_stats(x, sigma=3.0, sigma_lower=None, sigma_upper=None,
+                        maxiters=5, cenfunc='median', axis=None, mask=None,
+                        return_mask=False):
+    """Calculate sigma-clipped statistics of many distributions at once.
+
+    In each iteration, values further than `sigma` standard deviations
+    from the center of their distribution are masked.  All distributions
+    are processed together, and those whose mask stops changing drop out
+    of later iterations.
+
+    Parameters
+    ----------
+    x : :class:`numpy.ndarray` or :class:`numpy.ma.MaskedArray`
+        Values.  Masked and non-finite values are ignored.
+    sigma : :class:`float`, optional
+        Clipping limit, in standard deviations.
+    sigma_lower, sigma_upper : :class:`float`, optional
+        Separate lower and upper limits; default to `sigma`.
+    maxiters : :class:`int`, optional
+        Maximum number of iterations; ``None`` iterates until convergence.
+    cenfunc : :class:`str`, optional
+        Center of the clipping limits:  median, mean.
+    axis : :class:`int`, optional
+        Axis along which to compute the statistics; by default, use all values.
+    mask : :class:`numpy.ndarray`, optional
+        Boolean mask of values to ignore, ``True`` = masked.
+    return_mask : :class:`bool`, optional
+        If ``True``, also return the final mask.
+
+    Returns
+    -------
+    :func:`tuple`
+        Clipped mean, median, standard deviation and normalized median
+        absolute deviation (``1.4826*median(abs(x - median))``), each of the
+        shape of `x` without `axis`, followed by the mask of clipped or
+        ignored values if `return_mask` is set.  Distributions without
+        valid values give NaN.
+    """
+    if cenfunc not in ('median', 'mean'):
+        raise ValueError("Unknown cenfunc '{0}'!".format(cenfunc))
+    sl = sigma if sigma_lower is None else sigma_lower
+    su = sigma if sigma_upper is None else sigma_upper
+    data = np.ma.getdata(x)
+    invalid = np.ma.getmaskarray(x)
+    if mask is not None:
+        invalid = invalid | mask
+    if axis is None:
+        shape = data.shape
+        a = data.reshape(1, -1)
+        valid = ~invalid.reshape(1, -1)
+        rest = ()
+    else:
+        a = np.moveaxis(data, axis, -1)
+        shape = a.shape
+        rest = a.shape[:-1]
+        a = a.reshape(-1, a.shape[-1])
+        valid = ~np.moveaxis(invalid, axis, -1).reshape(a.shape)
+    a = a.astype(np.float64)
+    valid &= np.isfinite(a)
+    active = np.ones((a.shape[0],), dtype=bool)
+    iiter = 0
+    while active.any() and (maxiters is None or iiter < maxiters):
+        iiter += 1
+        rows = np.flatnonzero(active)
+        sub = a[rows]
+        v = valid[rows]
+        n = v.sum(axis=1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = np.where(v, sub, 0.).sum(axis=1)/n
+            std = np.sqrt(np.where(v, (sub - mean[:, np.newaxis])**2, 0.).sum(axis=1)/n)
+        center = _median(sub, v) if cenfunc == 'median' else mean
+        with np.errstate(invalid='ignore'):
+            keep = ((sub >= (center - sl*std)[:, np.newaxis]) &
+                    (sub <= (center + su*std)[:, np.newaxis]))
+        new = v & keep
+        valid[rows] = new
+        active[rows[new.sum(axis=1) == n]] = False
+    # Final statistics.
+    n = valid.sum(axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = np.where(valid, a, 0.).sum(axis=1)/n
+        std = np.sqrt(np.where(valid, (a - mean[:, np.newaxis])**2, 0.).sum(axis=1)/n)
+    median = _median(a, valid)
+    mad = 1.4826*_median(np.abs(a - median[:, np.newaxis]), valid)
+    result = tuple(r.reshape(rest)[()] for r in (mean, median, std, mad))
+    if return_mask:
+        clipped = ~valid.reshape(shape)
+        if axis is not None:
+            clipped = np.moveaxis(clipped, -1, axis)
+        result += (clipped,)
+    return result
+
+
+class QuantileSketch(object):
+    """Streaming, mergeable approximation of the distribution of a data set.
+
+    This is a KLL sketch (Karnin, Lang & Liberty 2016).  Values are kept
+    in a hierarchy of buffers; when a buffer is full it is sorted and
+    every other value, starting at a random offset, is promoted to the
+    next buffer with twice the weight.  Memory is bounded by about
+    ``3*k`` values, whatever the number of values added.
+
+    Parameters
+    ----------
+    k : :class:`int`, optional
+        Size of the largest buffer, which sets the accuracy.
+    seed : :class:`int`, optional
+        Seed of the random offsets, for reproducible results.
+
+    Notes
+    -----
+    Quantiles are exact until more than `k` values have been added.  After
+    that, each compaction of a buffer of weight :math:`2^h` moves the rank
+    of any value by at most :math:`2^h`, and :meth:`error_bound` returns the
+    sum of these, divided by :attr:`n`, which is a guaranteed bound on
+    the normalized rank error.  Because the offsets are random, the
+    errors mostly cancel, and the actual normalized rank error of a
+    single query is below :meth:`expected_error` (about 1.3% for
+    ``k=200``) with 99% probability.
+    """
+
+    def __init__(self, k=200, seed=None):
+        if k < 8:
+            raise ValueError("Sketch size k must be at least 8!")
+        self.k = int(k)
+        self.n = 0
+        self.min = np.nan
+        self.max = np.nan
+        self._levels = [np.empty((0,), dtype=np.float64)]
+        self._error = 0.0
+        self._rng = np.random.RandomState(seed)
+
+    def __len__(self):
+        return self.n
+
+    def __repr__(self):
+        return "QuantileSketch(k={0:d}, n={1:d}, size={2:d})".format(
+            self.k, self.n, self.size)
+
+    @property
+    def size(self):
+        """Number of values stored.
+        """
+        return sum([level.size for level in self._levels])
+
+    def _capacity(self, h):
+        """Capacity of the buffer at level `h`.
+        """
+        depth = len(self._levels) - 1 - h
+        return max(2, int(np.ceil(self.k * (2.0/3.0)**depth)))
+
+    def _compress(self):
+        """Compact full buffers, from the lowest level up.
+        """
+        h = 0
+        while h < len(self._levels):
+            level = self._levels[h]
+            if level.size > self._capacity(h):
+                if h + 1 == len(self._levels):
+                    self._levels.append(np.empty((0,), dtype=np.float64))
+                level = np.sort(level)
+                # With an odd number of values, the smallest one stays behind.
+                odd = level.size % 2
+                promoted = level[odd + self._rng.randint(2)::2]
+                self._levels[h] = level[:odd]
+                self._levels[h + 1] = np.concatenate((self._levels[h + 1], promoted))
+                self._error += 2.0**h
+            h += 1
+
+    def update(self, values):
+        """Add values to the sketch.
+
+        Parameters
+        ----------
+        values : array-like
+            The values.  NaN values are ignored.
+
+        Returns
+        -------
+        :class:`QuantileSketch`
+            The sketch, to allow chaining.
+        """
+        values = np.asarray(values, dtype=np.float64).ravel()
+        values = values[~np.isnan(values)]
+        if values.size == 0:
+            return self
+        self.n += values.size
+        self.min = np.fmin(self.min, values.min())
+        self.max = np.fmax(self.max, values.max())
+        self._levels[0] = np.concatenate((self._levels[0], values))
+        self._compress()
+        return self
+
+    def merge(self, other):
+        """Add the contents of another sketch to this one.
+
+        Parameters
+        ----------
+        other : :class:`QuantileSketch`
+            A sketch with the same `k`, for example one built from another
+            file or in another process.
+
+        Returns
+        -------
+        :class:`QuantileSketch`
+            The sketch, to allow chaining.
+        """
+        if other.k != self.k:
+            raise ValueError("Only sketches with the same k can be merged!")
+        while len(self._levels) < len(other._levels):
+            self._levels.append(np.empty((0,), dtype=np.float64))
+        for h, level in enumerate(other._levels):
+            self._levels[h] = np.concatenate((self._levels[h], level))
+        self.n += other.n
+        self.min = np.fmin(self.min, other.min)
+        self.max = np.fmax(self.max, other.max)
+        self._error += other._error
+        self._compress()
+        return self
+
+    def _sorted(self):
+        """Stored values in order, with the cumulative weights.
+        """
+        values = np.concatenate(self._levels)
+        weights = np.concatenate([np.full(level.shape, 2.0**h)
+                                  for h, level in enumerate(self._levels)])
+        i = np.argsort(values, kind='mergesort')
+        return values[i], np.cumsum(weights[i])
+
+    def quantile(self, q):
+        """Approximate quantiles.
+
+        Parameters
+        ----------
+        q : :class:`float` or array-like
+            Quantiles, in [0, 1].
+
+        Returns
+        -------
+        :class:`float` or :class:`numpy.ndarray`
+            Values at the requested quantiles, NaN if the sketch is empty.
+        """
+        q = np.asarray(q, dtype=np.float64)
+        if np.any((q < 0) | (q > 1)):
+            raise ValueError("Quantiles must be in the range [0, 1]!")
+        if self.n == 0:
+            return np.full(q.shape, np.nan)[()]
+        values, cumw = self._sorted()
+        i = np.searchsorted(cumw, q*cumw[-1], side='left')
+        result = values[np.clip(i, 0, values.size - 1)]
+        result = np.where(q == 0, self.min, np.where(q == 1, self.max, result))
+        return result[()]
+
+    def percentile(self, per):
+        """Approximate percentiles, like :func:`numpy.percentile`.
+
+        Parameters
+        ----------
+        per : :class:`float` or array-like
+            Percentiles, in [0, 100].
+
+        Returns
+        -------
+        :class:`float` or :class:`numpy.ndarray`
+            Values at the requested percentiles.
+        """
+        return self.quantile(np.asarray(per, dtype=np.float64)/100.0)
+
+    def perc(self, per=68.2):
+        """Approximate percentile bounds, like :func:`perc`.
+
+        Parameters
+        ----------
+        per : :class:`float`, optional
+            Percentile for the calculation [0-100].
+
+        Returns
+        -------
+        :class:`numpy.ndarray`
+            Value at lower, value at upper.
+        """
+        return self.percentile([50-per/2.0, 50+per/2.0])
+
+    def cdf(self, x):
+        """Approximate fraction of values less than or equal to `x`.
+
+        Parameters
+        ----------
+        x : :class:`float` or array-like
+            Values.
+
+        Returns
+        -------
+        :class:`float` or :class:`numpy.ndarray`
+            Normalized ranks.
+        """
+        x = np.asarray(x, dtype=np.float64)
+        if self.n == 0:
+            return np.full(x.shape, np.nan)[()]
+        values, cumw = self._sorted()
+        i = np.searchsorted(values, x, side='right')
+        cumw = np.concatenate(([0.], cumw))
+        return (cumw[i]/cumw[-1])[()]
+
+    def error_bound(self):
+        """Guaranteed bound on the normalized rank error of any query.
+
+        Returns
+        -------
+        :class:`float`
+            The bound; zero while the sketch is exact.
+        """
+        return self._error/self.n if self.n > 0 else 0.0
+
+    def expected_error(self):
+        """Normalized rank error not exceeded by a single query with 99% probability.
+
+        This is the empirical fit for KLL sketches from the Apache
+        DataSketches library, and is zero while the sketch is exact.
+
+        Returns
+        -------
+        :class:`float`
+            The error.
+        """
+        if self._error == 0:
+            return 0.0
+        return min(2.296/self.k**0.9723, self.error_bound())
+
+
+def _to_bytes(a):
+    """Serialize an array in :mod:`numpy` ``.npy`` format.
+    """
+    from io import BytesIO
+    f = BytesIO()
+    np.save(f, a, allow_pickle=False)
+    return f.getvalue()
+
+
+def _from_bytes(data):
+    """Deserialize an array written by :func:`_to_bytes`.
+    """
+    from io import BytesIO
+    return np.load(BytesIO(data), allow_pickle=False)
+
+
+class RunningStats(object):
+    """Mergeable running count, mean, variance, minimum and maximum.
+
+    Each chunk is reduced with vectorized operations, and combined with
+    the previous state using the pairwise update of Chan, Golub & LeVeque
+    (1979), which generalizes Welford's algorithm and is numerically stable.
+
+    Parameters
+    ----------
+    axis : :class:`int`, optional
+        Axis of each chunk along which values are accumulated; by default
+        all values of a chunk are accumulated into scalar statistics.
+        Otherwise the statistics have the shape of a chunk without `axis`.
+    """
+
+    def __init__(self, axis=None):
+        self.axis = axis
+        self.n = None
+        self._mean = None
+        self._m2 = None
+        self.min = None
+        self.max = None
+
+    def __repr__(self):
+        return "RunningStats(axis={0!r}, shape={1!r})".format(
+            self.axis, None if self.n is None else self.n.shape)
+
+    def _combine(self, n, mean, m2, vmin, vmax):
+        """Combine partial statistics with the current state.
+        """
+        if self.n is None:
+            self.n, self._mean, self._m2, self.min, self.max = n, mean, m2, vmin, vmax
+            return self
+        if n.shape != self.n.shape:
+            raise ValueError("Statistics have shape {0}, not {1}!".format(self.n.shape, n.shape))
+        total = self.n + n
+        with np.errstate(invalid='ignore', divide='ignore'):
+            frac = np.where(total > 0, n/np.maximum(total, 1), 0.)
+        delta = mean - self._mean
+        self._mean = self._mean + delta*frac
+        self._m2 = self._m2 + m2 + delta**2*self.n*frac
+        self.n = total
+        self.min = np.fmin(self.min, vmin)
+        self.max = np.fmax(self.max, vmax)
+        return self
+
+    def update(self, chunk):
+        """Add values.
+
+        Parameters
+        ----------
+        chunk : array-like
+            The values.  NaN values are ignored.
+
+        Returns
+        -------
+        :class:`RunningStats`
+            The accumulator, to allow chaining.
+        """
+        a = np.asarray(chunk, dtype=np.float64)
+        a = a.reshape(-1) if self.axis is None else np.moveaxis(a, self.axis, 0)
+        valid = ~np.isnan(a)
+        n = valid.sum(axis=0).astype(np.float64)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = np.where(n > 0, np.where(valid, a, 0.).sum(axis=0)/np.maximum(n, 1), 0.)
+        m2 = np.where(valid, (a - mean)**2, 0.).sum(axis=0)
+        vmin = np.where(valid, a, np.inf).min(axis=0, initial=np.inf)
+        vmax = np.where(valid, a, -np.inf).max(axis=0, initial=-np.inf)
+        vmin = np.where(n > 0, vmin, np.nan)
+        vmax = np.where(n > 0, vmax, np.nan)
+        return self._combine(n, mean, m2, vmin, vmax)
+
+    def merge(self, other):
+        """Add the state of another accumulator.
+
+        Parameters
+        ----------
+        other : :class:`RunningStats`
+            Accumulator, for example from another process.
+
+        Returns
+        -------
+        :class:`RunningStats`
+            The accumulator, to allow chaining.
+        """
+        if other.n is None:
+            return self
+        return self._combine(other.n, other._mean, other._m2, other.min, other.max)
+
+    @property
+    def mean(self):
+        """Mean; NaN if there are no values.
+        """
+        if self.n is None:
+            return np.nan
+        return np.where(self.n > 0, self._mean, np.nan)[()]
+
+    def var(self, ddof=0):
+        """Variance.
+
+        Parameters
+        ----------
+        ddof : :class:`int`, optional
+            Delta degrees of freedom, as in :func:`numpy.var`.
+
+        Returns
+        -------
+        :class:`float` or :class:`numpy.ndarray`
+            The variance; NaN if there are not enough values.
+        """
+        if self.n is None:
+            return np.nan
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(self.n > ddof, self._m2/(self.n - ddof), np.nan)[()]
+
+    def std(self, ddof=0):
+        """Standard deviation, see :meth:`var`.
+        """
+        return np.sqrt(self.var(ddof))
+
+    def to_bytes(self):
+        """Serialize the state.
+
+        Returns
+        -------
+        :class:`bytes`
+            The count, mean, sum of squared deviations, minimum and maximum,
+            as one array in ``.npy`` format, or an empty array if no values
+            have been added yet.
+        """
+        if self.n is None:
+            return _to_bytes(np.zeros((0,), dtype=np.float64))
+        return _to_bytes(np.stack((self.n, self._mean, self._m2, self.min, self.max)))
+
+    @classmethod
+    def from_bytes(cls, data, axis=None):
+        """Deserialize a state written by :meth:`to_bytes`.
+
+        Parameters
+        ----------
+        data : :class:`bytes`
+            The state.
+        axis : :class:`int`, optional
+            Axis for further updates.
+
+        Returns
+        -------
+        :class:`RunningStats`
+            The accumulator.
+        """
+        a = _from_bytes(data)
+        stats = cls(axis=axis)
+        if a.ndim == 1 and a.size == 0:
+            return stats
+        stats.n, stats._mean, stats._m2, stats.min, stats.max = [v.copy() for v in a]
+        return stats
+
+
+class RunningHistogram(object):
+    """Mergeable histogram with fixed bins.
+
+    Parameters
+    ----------
+    bins : :class:`int` or :class:`numpy.ndarray`, optional
+        Number of equal bins, or increasing bin edges.
+    range : :func:`tuple`, optional
+        Lower and upper edges, required if `bins` is a number.
+
+    Notes
+    -----
+    As in :func:`numpy.histogram`, each bin includes its left edge, and
+    the last bin also includes its right edge.  Values outside the bins
+    are counted in :attr:`underflow` and :attr:`overflow`.
+    """
+
+    def __init__(self, bins=10, range=None):
+        if np.ndim(bins) == 0:
+            if range is None:
+                raise ValueError("A range is required with a number of bins!")
+            self.edges = np.linspace(range[0], range[1], int(bins) + 1)
+            self._uniform = True
+        else:
+            self.edges = np.asarray(bins, dtype=np.float64)
+            self._uniform = False
+        if np.any(np.diff(self.edges) <= 0):
+            raise ValueError("Bin edges must be increasing!")
+        self.counts = np.zeros((self.edges.size - 1,), dtype=np.float64)
+        self.underflow = 0.
+        self.overflow = 0.
+
+    def __repr__(self):
+        return "RunningHistogram(nbins={0:d}, range=({1:g}, {2:g}), total={3:g})".format(
+            self.counts.size, self.edges[0], self.edges[-1], self.total)
+
+    @property
+    def total(self):
+        """Total count or weight, including values outside the bins.
+        """
+        return self.counts.sum() + self.underflow + self.overflow
+
+    def update(self, values, weights=None):
+        """Add values.
+
+        Parameters
+        ----------
+        values : array-like
+            The values.  NaN values are ignored.
+        weights : array-like, optional
+            Weight of each value.
+
+        Returns
+        -------
+        :class:`RunningHistogram`
+            The histogram, to allow chaining.
+        """
+        x = np.asarray(values, dtype=np.float64).ravel()
+        w = np.ones(x.shape) if weights is None else np.asarray(weights, dtype=np.float64).ravel()
+        keep = ~np.isnan(x)
+        x = x[keep]
+        w = w[keep]
+        nbins = self.counts.size
+        lo, hi = self.edges[0], self.edges[-1]
+        if self._uniform:
+            i = np.clip(np.floor((x - lo)/(hi - lo)*nbins), 0, nbins - 1).astype(np.intp)
+            # Correct for rounding near the edges.
+            i -= (x < self.edges[i]) & (i > 0)
+            i += (x >= self.edges[i + 1]) & (i < nbins - 1)
+        else:
+            i = np.searchsorted(self.edges, x, side='right') - 1
+        i[x == hi] = nbins - 1
+        below = x < lo
+        above = x > hi
+        inside = ~(below | above)
+        self.counts += np.bincount(i[inside], weights=w[inside], minlength=nbins)
+        self.underflow += w[below].sum()
+        self.overflow += w[above].sum()
+        return self
+
+    def merge(self, other):
+        """Add the counts of another histogram with the same bins.
+
+        Parameters
+        ----------
+        other : :class:`RunningHistogram`
+            Histogram, for example from another process.
+
+        Returns
+        -------
+        :class:`RunningHistogram`
+            The histogram, to allow chaining.
+        """
+        if not np.array_equal(self.edges, other.edges):
+            raise ValueError("Only histograms with the same bins can be merged!")
+        self.counts += other.counts
+        self.underflow += other.underflow
+        self.overflow += other.overflow
+        return self
+
+    def to_bytes(self):
+        """Serialize the state.
+
+        Returns
+        -------
+        :class:`bytes`
+            The edges and a flag for equal bins, then the underflow,
+            counts and overflow, as one array of shape (2, nbins+2) in
+            ``.npy`` format.
+        """
+        return _to_bytes(np.stack((np.concatenate((self.edges, [float(self._uniform)])),
+                                   np.concatenate(([self.underflow], self.counts,
+                                                   [self.overflow])))))
+
+    @classmethod
+    def from_bytes(cls, data):
+        """Deserialize a state written by :meth:`to_bytes`.
+
+        Parameters
+        ----------
+        data : :class:`bytes`
+            The state.
+
+        Returns
+        -------
+        :class:`RunningHistogram`
+            The histogram.
+        """
+        a = _from_bytes(data)
+        hist = cls(a[0, :-1])
+        hist._uniform = bool(a[0, -1])
+        hist.underflow = a[1, 0]
+        hist.counts = a[1, 1:-1].copy()
+        hist.overflow = a[1, -1]
+        return hist
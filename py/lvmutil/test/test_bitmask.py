@@ -5,11 +5,15 @@
 from __future__ import (absolute_import, division,
                         print_function, unicode_literals)
 # The line above will help with 2to3 support.
+import os
 import sys
 import unittest
-from ..bitmask import BitMask, _MaskBit
+from shutil import rmtree
+from tempfile import mkdtemp
+from ..bitmask import BitMask, SparseMask, _MaskBit
 import yaml
 import numpy as np
+from astropy.io import fits
 
 _bitdefyaml = """\
 ccdmask:
@@ -70,6 +74,114 @@ class TestBitMask(unittest.TestCase):
         m = self.ccdmask
         self.assertEqual(m.mask('BAD|COSMIC'), m.BAD | m.COSMIC)
 
+    def test_compile(self):
+        """Test compiled mask expressions.
+        """
+        m = self.ccdmask
+        self.assertEqual(m.compile('BAD'), m.BAD)
+        self.assertEqual(m.compile('BAD|COSMIC'), m.BAD | m.COSMIC)
+        self.assertEqual(m.compile(' BAD | 4 '), m.BAD | m.COSMIC)
+        self.assertEqual(m.compile('(BAD|HOT)&(HOT|DEAD)'), m.HOT)
+        self.assertEqual(m.compile('BAD|HOT&DEAD'), m.BAD)
+        self.assertEqual(m.compile('~COSMIC'), m.BAD | m.HOT | m.DEAD | m.SATURATED)
+        self.assertEqual(m.compile('~(COSMIC|BAD)&~HOT'), m.DEAD | m.SATURATED)
+        self.assertEqual(m.compile('~~HOT'), m.HOT)
+        self.assertEqual(m.mask('~BAD'), 30)
+        self.assertIn('~BAD', m._compiled)
+        m._compiled['~BAD'] = 1
+        self.assertEqual(m.mask('~BAD'), 1)
+        for expr in ('BAD|', '(BAD', 'BAD)', 'BAD HOT', '', '|BAD', '()'):
+            with self.assertRaises(ValueError):
+                m.compile(expr)
+        for expr in ('BAD|BLATFOO', 'BAD+HOT', '99'):
+            with self.assertRaises(KeyError):
+                m.compile(expr)
+        # Bit names are not restricted to word characters.
+        _bitdefs = dict(odd=[['BAD-COL', 0, "bad column"], ['HOT.PIX', 1, "hot pixel"],
+                             ['2D', 2, "2D"], ['OK', 3, "ok"]])
+        m2 = BitMask('odd', _bitdefs)
+        self.assertEqual(m2.mask('BAD-COL'), 1)
+        self.assertEqual(m2.compile('BAD-COL|HOT.PIX'), 3)
+        self.assertEqual(m2.compile('~(BAD-COL)&~2D'), 10)
+        self.assertEqual(m2.compile('2'), 4)
+        mask = np.arange(8, dtype=np.uint8)
+        self.assertEqual(m2.any_set(mask, 'BAD-COL|2D').tolist(), ((mask & 5) != 0).tolist())
+        self.assertEqual(m2.all_set(mask, 'BAD-COL|HOT.PIX').tolist(), ((mask & 3) == 3).tolist())
+        self.assertEqual(m2.none_set(mask, 'HOT.PIX').tolist(), ((mask & 2) == 0).tolist())
+        with self.assertRaises(KeyError):
+            m2.compile('BAD-ROW')
+
+    def test_any_all_none(self):
+        """Test vectorized tests of compiled expressions.
+        """
+        m = self.ccdmask
+        mask = np.arange(32, dtype=np.int16).reshape(4, 8)
+        for expr in ('BAD|COSMIC', m.compile('BAD|COSMIC'), np.int64(17)):
+            v = 17
+            self.assertTrue(np.all(m.any_set(mask, expr) == ((mask & v) != 0)))
+            self.assertTrue(np.all(m.all_set(mask, expr) == ((mask & v) == v)))
+            self.assertTrue(np.all(m.none_set(mask, expr) == ((mask & v) == 0)))
+        self.assertEqual(m.any_set(mask, 'HOT').shape, mask.shape)
+        self.assertEqual(m.any_set(np.zeros((0,), dtype=np.uint8), 'HOT').shape, (0,))
+        big = np.full((3*2**16 + 5,), 6, dtype=np.uint32)
+        self.assertTrue(np.all(m.all_set(big[::2], 'HOT|DEAD')))
+        self.assertFalse(np.any(m.none_set(big, 'DEAD|COSMIC')))
+        # Bits beyond the size of the mask type are never set.
+        _bitdefs = dict(ccdmask=[['LOWEST', 0, "bit 0"], ['BIG', 40, "bit 40"]])
+        mask2 = BitMask('ccdmask', _bitdefs)
+        self.assertEqual(mask2.any_set(np.array([1, 2], dtype=np.uint8), 'LOWEST|BIG').tolist(),
+                         [True, False])
+        self.assertEqual(mask2.all_set(np.array([1, 2], dtype=np.uint8), 'LOWEST|BIG').tolist(),
+                         [False, False])
+        self.assertEqual(mask2.all_set(np.array([2**40 + 1, 2], dtype=np.int64), 'LOWEST|BIG').tolist(),
+                         [True, False])
+
+    def test_combine(self):
+        """Test bitwise combination of stacks of masks.
+        """
+        m = self.ccdmask
+        rng = np.random.RandomState(2718)
+        for dtype in (np.uint8, np.int32, np.uint64):
+            stack = rng.randint(0, 256, size=(7, 4, 5)).astype(dtype)
+            votes = np.zeros((4, 5, 8), dtype=int)
+            for b in range(8):
+                votes[..., b] = ((stack & dtype(2**b)) != 0).sum(axis=0)
+            for op, k in (('or', 1), ('and', 7), (1, 1), (3, 3), (4, 4), (6, 6), (7, 7)):
+                expected = np.zeros((4, 5), dtype=dtype)
+                for b in range(8):
+                    expected |= np.where(votes[..., b] >= k, dtype(2**b), dtype(0))
+                for chunksize in (None, 3):
+                    c = m.combine(stack, op=op, chunksize=chunksize)
+                    self.assertEqual(c.dtype, np.dtype(dtype))
+                    self.assertTrue(np.all(c == expected))
+                c = m.combine(np.moveaxis(stack, 0, 2), op=op, axis=2)
+                self.assertTrue(np.all(c == expected))
+                c = m.combine(list(stack), op=op)
+                self.assertTrue(np.all(c == expected))
+        self.assertEqual(m.combine(np.array([-1, 0, -1], dtype=np.int64), op=2), -1)
+        # Masks of different types.
+        a = np.array([2**63 + 1, 2, 0], dtype=np.uint64)
+        b = np.array([1, -1, 4], dtype=np.int64)
+        c = np.array([1, 0, -1], dtype=np.int8)
+        ub = b.view(np.uint64)
+        uc = c.view(np.uint8).astype(np.uint64)
+        result = m.combine([a, b, c])
+        self.assertEqual(result.dtype, np.dtype(np.uint64))
+        self.assertEqual(result.tolist(), (a | ub | uc).tolist())
+        self.assertEqual(m.combine([a, b, c], op='and').tolist(), (a & ub & uc).tolist())
+        self.assertEqual(m.combine([a, b, c], op=2).tolist(),
+                         ((a & ub) | (a & uc) | (ub & uc)).tolist())
+        result = m.combine([b, c])
+        self.assertEqual(result.dtype, np.dtype(np.int64))
+        self.assertEqual(result.view(np.uint64).tolist(), (ub | uc).tolist())
+        with self.assertRaises(ValueError):
+            m.combine([])
+        with self.assertRaises(ValueError):
+            m.combine([np.zeros(2, dtype=np.uint8), np.zeros(3, dtype=np.uint8)])
+        for op in ('xor', 0, 8):
+            with self.assertRaises(ValueError):
+                m.combine(stack, op=op)
+
     def test_access(self):
         """Miscellaneous stuff that should work.
         """
@@ -150,6 +262,246 @@ class TestBitMask(unittest.TestCase):
             if i < 63:
                 names = mask.names(np.array([2**i], dtype=np.int64))
 
+    def test_bitplanes(self):
+        """Test decoding arrays of masks into bit planes.
+        """
+        m = self.ccdmask
+        rng = np.random.RandomState(42)
+        for dtype in (np.uint8, np.int16, np.uint32, np.int64, np.uint64):
+            mask = rng.randint(0, 64, size=(7, 5)).astype(dtype)
+            planes = m.bitplanes(mask)
+            self.assertEqual(planes.shape, (5, 7, 5))
+            for k, name in enumerate(m.names()):
+                self.assertTrue(np.all(planes[k] == ((mask & m[name]) != 0)))
+        planes = m.bitplanes([1, 2, 4], names=['DEAD', 0])
+        self.assertEqual(planes.tolist(), [[False, False, True],
+                                           [True, False, False]])
+        _bitdefs = dict(ccdmask=[['LOWEST', 0, "bit 0"],
+                                 ['BIG', 40, "bit 40"],
+                                 ['HIGHEST', 63, "bit 63"]])
+        mask = BitMask('ccdmask', _bitdefs)
+        planes = mask.bitplanes(np.array([2**63, 1], dtype=np.uint64))
+        self.assertEqual(planes.tolist(), [[False, True], [False, False],
+                                           [True, False]])
+        planes = mask.bitplanes(np.array([-2**63, 1], dtype=np.int64))
+        self.assertEqual(planes.tolist(), [[False, True], [False, False],
+                                           [True, False]])
+        planes = mask.bitplanes(np.array([255, 1], dtype=np.uint8))
+        self.assertEqual(planes.tolist(), [[True, True], [False, False],
+                                           [False, False]])
+        with self.assertRaises(TypeError):
+            mask.bitplanes(np.array([1.0, 2.0]))
+
+    def test_names_array(self):
+        """Test decoding arrays of masks into names.
+        """
+        m = self.ccdmask
+        mask = np.array([[0, 3, 2**4 | 2**13], [3, 3, 0]], dtype=np.int32)
+        names = m.names_array(mask)
+        self.assertEqual(names.shape, mask.shape)
+        self.assertEqual(names.dtype, np.dtype(object))
+        for i in range(mask.shape[0]):
+            for j in range(mask.shape[1]):
+                self.assertEqual(names[i, j], m.names(mask[i, j]))
+        self.assertEqual(names[1, 2], [])
+        self.assertEqual(names[0, 2], ['COSMIC', 'UNKNOWN13'])
+
+    def test_bitstats(self):
+        """Test per-bit population statistics.
+        """
+        m = self.ccdmask
+        rng = np.random.RandomState(137)
+        mask = rng.randint(0, 32, size=(6, 50)).astype(np.int16)
+        mask[0, 0] |= 2**15
+        for chunksize in (None, 7):
+            stats = m.bitstats(mask, chunksize=chunksize)
+            self.assertEqual(stats.meta['NTOTAL'], mask.size)
+            self.assertEqual(list(stats['NAME']), m.names() + ['UNKNOWN15'])
+            self.assertEqual(list(stats['BITNUM']), [0, 1, 2, 3, 4, 15])
+            self.assertEqual(stats['COMMENT'][1], 'Hot pixel')
+            for row in stats:
+                n = np.count_nonzero(mask & np.int16(2**row['BITNUM']))
+                self.assertEqual(row['COUNT'], n)
+                self.assertEqual(row['FRACTION'], n/mask.size)
+        #
+        # Groups.
+        #
+        fiber = np.array([3, 1, 3, 2, 1, 2])
+        for chunksize, groups in ((None, fiber), (13, fiber),
+                                  (None, np.repeat(fiber, 50).reshape(mask.shape))):
+            stats = m.bitstats(mask, groups=groups, chunksize=chunksize)
+            self.assertEqual(stats.meta['GROUPS'].tolist(), [1, 2, 3])
+            self.assertEqual(stats.meta['NTOTAL'].tolist(), [100, 100, 100])
+            self.assertEqual(stats['COUNT'].shape, (6, 3))
+            for k, g in enumerate([1, 2, 3]):
+                for row in stats:
+                    n = np.count_nonzero(mask[fiber == g] & np.int16(2**row['BITNUM']))
+                    self.assertEqual(row['COUNT'][k], n)
+                    self.assertEqual(row['FRACTION'][k], n/100)
+        with self.assertRaises(ValueError):
+            m.bitstats(mask, groups=fiber[:3])
+        stats = m.bitstats(np.zeros((0,), dtype=np.uint8))
+        self.assertEqual(stats.meta['NTOTAL'], 0)
+        self.assertEqual(len(stats), 5)
+        # Strided views.
+        for view in (mask[:, 0], mask[::2], mask.T[3], mask.astype('>i2')[:, ::3]):
+            stats = m.bitstats(view)
+            for row in stats:
+                self.assertEqual(row['COUNT'], np.count_nonzero(view & np.int16(2**row['BITNUM'])))
+
+    def test_words(self):
+        """Test multi-word masks.
+        """
+        _bitdefs = dict(wide=[['LOW', 0, "bit 0"],
+                              ['MID', 63, "bit 63"],
+                              ['HIGH', 64, "bit 64"],
+                              ['HIGHER', 130, "bit 130"]])
+        m = BitMask('wide', _bitdefs)
+        self.assertEqual(m.nwords, 3)
+        self.assertEqual(self.ccdmask.nwords, 1)
+        self.assertEqual(BitMask('wide', dict(wide=[['MID', 63, "bit 63"]])).nwords, 1)
+        values = np.array([0, 1, 2**63, 2**64 + 1, 2**130 | 2**63, 2**129], dtype=object)
+        words = m.to_words(values)
+        self.assertEqual(words.shape, (6, 3))
+        self.assertEqual(words.dtype, np.uint64)
+        self.assertEqual(words[3].tolist(), [1, 1, 0])
+        self.assertEqual(words[4].tolist(), [2**63, 0, 4])
+        self.assertEqual(m.from_words(words).tolist(), values.tolist())
+        self.assertEqual(m.from_words(words[:3], dtype=np.uint64).tolist(), [0, 1, 2**63])
+        with self.assertRaises(ValueError):
+            m.from_words(words[:4], dtype=np.uint64)
+        with self.assertRaises(ValueError):
+            m.from_words(words[:3], dtype=np.int64)
+        with self.assertRaises(ValueError):
+            m.to_words(values, nwords=2)
+        with self.assertRaises(ValueError):
+            m.to_words(np.array([-1], dtype=object))
+        with self.assertRaises(TypeError):
+            m.from_words(words.astype(np.int64))
+        #
+        # Interoperate with single-word masks.
+        #
+        single = np.array([1, 2, 2**63], dtype=np.uint64)
+        self.assertEqual(m.from_words(m.to_words(single)).tolist(), [1, 2, 2**63])
+        combined = words[:3] | m.to_words(single)
+        self.assertEqual(m.from_words(combined).tolist(), [1, 3, 2**63])
+        #
+        # Set, test and decode.
+        #
+        m.set_bits(words, 'HIGH|LOW', wide=True)
+        self.assertEqual(m.from_words(words).tolist(),
+                         [v | 2**64 | 1 for v in values.tolist()])
+        self.assertTrue(np.all(m.all_set(words, 'HIGH|LOW', wide=True)))
+        self.assertEqual(m.any_set(words, 'HIGHER|MID', wide=True).tolist(),
+                         [False, False, True, False, True, False])
+        self.assertEqual(m.none_set(words, 'HIGHER', wide=True).tolist(),
+                         [True, True, True, True, False, True])
+        self.assertEqual(m.all_set(words, 'HIGHER|MID', wide=True).tolist(),
+                         [False, False, False, False, True, False])
+        self.assertFalse(np.any(m.all_set(words[:, :2], 'HIGHER', wide=True)))
+        planes = m.bitplanes(words, wide=True)
+        self.assertEqual(planes.shape, (4, 6))
+        self.assertEqual(planes[3].tolist(), [False, False, False, False, True, False])
+        self.assertTrue(np.all(planes[0]))
+        names = m.names_array(words.reshape(2, 3, 3), wide=True)
+        self.assertEqual(names.shape, (2, 3))
+        self.assertEqual(names[1, 1], ['LOW', 'MID', 'HIGH', 'HIGHER'])
+        self.assertEqual(names[1, 2], ['LOW', 'HIGH', 'UNKNOWN129'])
+        stack = np.stack([words, words, m.to_words(np.zeros(6, dtype=np.uint8))])
+        self.assertTrue(np.all(m.combine(stack, op=2) == words))
+        with self.assertRaises(ValueError):
+            m.set_bits(words[:, :2], 'HIGHER', wide=True)
+        single = np.zeros(3, dtype=np.int64)
+        self.assertIs(m.set_bits(single, 'MID|LOW'), single)
+        self.assertEqual(single.tolist(), [-2**63 + 1]*3)
+        with self.assertRaises(ValueError):
+            m.set_bits(single, 'HIGH')
+
+    def test_sparse(self):
+        """Test run-length encoded masks.
+        """
+        m = self.ccdmask
+        rng = np.random.RandomState(31415)
+        for dtype in (np.uint8, np.int16, np.uint32, np.int64):
+            d1 = np.zeros((40, 30), dtype=dtype)
+            d1[5, 3:20] = m.HOT
+            d1[7:9, :] = m.BAD | m.COSMIC
+            d1[20, 29] = m.DEAD
+            d1[21, 0] = m.DEAD
+            d1[30:, 10] = m.SATURATED
+            d2 = np.zeros_like(d1)
+            d2[rng.randint(0, 40, 50), rng.randint(0, 30, 50)] = rng.randint(1, 32, 50)
+            d2[7, 5:25] = m.COSMIC
+            s1 = SparseMask.from_dense(d1, bitmask=m)
+            s2 = SparseMask.from_dense(d2, bitmask=m)
+            self.assertEqual(s1.dtype, np.dtype(dtype))
+            self.assertEqual(s1.shape, d1.shape)
+            self.assertTrue(np.all(s1.to_dense() == d1))
+            self.assertTrue(np.all(s2.to_dense() == d2))
+            self.assertEqual(s1.nnz, np.count_nonzero(d1))
+            self.assertLess(s1.start.size, 20)
+            # Adjacent equal runs are merged.
+            self.assertEqual(s1.start[s1.value == (m.BAD | m.COSMIC)].tolist(), [210])
+            self.assertEqual(s1.length[s1.value == (m.BAD | m.COSMIC)].tolist(), [60])
+            self.assertEqual(s1 | s2, SparseMask.from_dense(d1 | d2))
+            self.assertEqual(s1 & s2, SparseMask.from_dense(d1 & d2))
+            self.assertNotEqual(s1, s2)
+            self.assertEqual(s1.count(), np.count_nonzero(d1))
+            self.assertEqual(s1.count('COSMIC|DEAD'), np.count_nonzero(d1 & dtype(20)))
+            self.assertEqual(s1.select('COSMIC'), SparseMask.from_dense(d1 & dtype(16)))
+            self.assertEqual(s2.indices('HOT').tolist(), np.flatnonzero(d2 & dtype(2)).tolist())
+            self.assertEqual(s2.indices().tolist(), np.flatnonzero(d2).tolist())
+            index = np.arange(d1.size)[::7]
+            self.assertTrue(np.all(s1.values_at(index) == d1.reshape(-1)[index]))
+        empty = SparseMask.from_dense(np.zeros((3, 4), dtype=np.uint16))
+        self.assertEqual(empty.nnz, 0)
+        self.assertEqual(empty.to_dense().shape, (3, 4))
+        self.assertEqual(empty.values_at([1, 2]).tolist(), [0, 0])
+        self.assertEqual(empty | empty, empty)
+        self.assertEqual(repr(s1), "SparseMask(shape=(40, 30), dtype=int64, nruns={0:d}, nnz={1:d})".format(s1.start.size, s1.nnz))
+        with self.assertRaises(ValueError):
+            empty | s1
+        with self.assertRaises(ValueError):
+            empty.count('BAD')
+        with self.assertRaises(TypeError):
+            SparseMask((2,), [0], [1], [1.5])
+        with self.assertRaises(ValueError):
+            SparseMask((2,), [0], [1, 2], [1])
+        # Masks of different signedness and size combine bitwise.
+        d1 = np.array([0, -1, 1, -128, 0], dtype=np.int8)
+        d2 = np.array([0, 256, 2, 0, 2**63 + 1], dtype=np.uint64)
+        s1 = SparseMask.from_dense(d1)
+        s2 = SparseMask.from_dense(d2)
+        u1 = d1.view(np.uint8).astype(np.uint64)
+        self.assertEqual(s1 | s2, SparseMask.from_dense(u1 | d2))
+        self.assertEqual(s2 & s1, SparseMask.from_dense(u1 & d2))
+        d3 = np.array([1, 0, 2**15 + 1, 0, 5], dtype=np.uint16).view(np.int16)
+        s3 = SparseMask.from_dense(d3)
+        self.assertEqual((s1 | s3).dtype, np.dtype(np.int16))
+        self.assertEqual(s1 | s3, SparseMask.from_dense(u1.astype(np.uint16).view(np.int16) | d3))
+        #
+        # FITS round trip.
+        #
+        tmpdir = mkdtemp()
+        try:
+            filename = os.path.join(tmpdir, 'mask.fits')
+            for dtype in (np.int8, np.uint8, np.int16, np.uint16, np.uint32, np.uint64):
+                d = np.zeros((50, 60), dtype=dtype)
+                d[3, 4:9] = np.array(2**(8*d.itemsize - 1) + 1, dtype=np.uint64).astype(dtype)
+                d[10:12, :] = 3
+                s = SparseMask.from_dense(d)
+                s.to_hdu().writeto(filename, overwrite=True)
+                with fits.open(filename) as hdulist:
+                    # Other FITS readers see the same values.
+                    self.assertTrue(np.all(hdulist['MASK'].data['VALUE'] == s.value))
+                    s2 = SparseMask.from_hdu(hdulist['MASK'], bitmask=m)
+                self.assertEqual(s2, s)
+                self.assertEqual(s2.dtype, np.dtype(dtype))
+                self.assertIs(s2.bitmask, m)
+                self.assertTrue(np.all(s2.to_dense() == d))
+        finally:
+            rmtree(tmpdir)
+
     def test_print(self):
         """Test string representations.
         """
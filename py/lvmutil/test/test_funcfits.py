@@ -8,7 +8,11 @@ from __future__ import (absolute_import, division,
 import unittest
 import numpy as np
 from warnings import catch_warnings, simplefilter
-from ..funcfits import func_fit, func_val, iter_fit, mk_fit_dict
+from ..funcfits import (BasisCache, FitSet, func_fit, func_fit2d,
+                        func_fit_batch, func_val, func_val2d, iter_fit,
+                        iter_fit2d, iter_fit_batch, iter_fit_pool,
+                        iter_fit_pool_benchmark, mk_fit_dict, robust_fit,
+                        _basis_cache)
 
 
 class TestFuncFits(unittest.TestCase):
@@ -102,6 +106,113 @@ class TestFuncFits(unittest.TestCase):
         self.assertEqual(dfit['xmin'], -1.0)
         self.assertEqual(dfit['xmax'], 1.0)
 
+    def test_func_fit_batch(self):
+        """Test fitting many rows at once.
+        """
+        x = np.linspace(3600, 9800, 200)
+        rng = np.random.RandomState(1)
+        y = (np.sin(x/1000)[np.newaxis, :]*rng.uniform(1, 2, (6, 1)) +
+             rng.normal(0, 0.01, (6, x.size)))
+        w1 = rng.uniform(0.5, 2, x.size)
+        w2 = rng.uniform(0.5, 2, y.shape)
+        w2[2, ::3] = 0
+        for func in ('polynomial', 'legendre', 'chebyshev'):
+            for w in (None, w1, w2):
+                bfit = func_fit_batch(x, y, func, 5, w=w, blat='foo')
+                self.assertEqual(bfit['coeff'].shape, (6, 6))
+                self.assertEqual(bfit['blat'], 'foo')
+                yfit = func_val(x, bfit)
+                self.assertEqual(yfit.shape, y.shape)
+                for k in range(y.shape[0]):
+                    wk = None if w is None else (w if w.ndim == 1 else w[k])
+                    dfit = func_fit(x, y[k], func, 5, w=wk)
+                    np.testing.assert_allclose(bfit['coeff'][k], dfit['coeff'],
+                                               rtol=1e-6, atol=1e-9)
+                    np.testing.assert_allclose(yfit[k], func_val(x, dfit),
+                                               rtol=1e-8, atol=1e-10)
+        bfit = func_fit_batch(x, y[0], 'legendre', 3, xmin=3000., xmax=10000.)
+        self.assertEqual(bfit['coeff'].shape, (1, 4))
+        self.assertEqual(bfit['xmin'], 3000.)
+        with self.assertRaises(ValueError):
+            func_fit_batch(x, y, 'fourier', 4)
+        # Fits to several columns with func_fit keep numpy's coefficient layout.
+        self.assertTrue(bfit['batch'])
+        for w in (None, w1):
+            cfit = func_fit(x, y.T, 'legendre', 5, w=w)
+            self.assertEqual(cfit['coeff'].shape, (6, 6))
+            self.assertNotIn('batch', cfit)
+            xv = 2.0*(x - x.min())/(x.max() - x.min()) - 1.0
+            expected = np.polynomial.legendre.legval(xv, cfit['coeff'])
+            self.assertEqual(func_val(x, cfit).shape, (6, x.size))
+            np.testing.assert_allclose(func_val(x, cfit), expected)
+            np.testing.assert_allclose(func_val(x, cfit),
+                                       func_val(x, func_fit_batch(x, y, 'legendre', 5, w=w)),
+                                       atol=1e-10)
+
+    def test_basis_cache(self):
+        """Test reuse of the basis on a fixed grid.
+        """
+        x = np.linspace(3600, 9800, 500)
+        rng = np.random.RandomState(2)
+        xv = 2.0*(x - x.min())/(x.max() - x.min()) - 1.0
+        cache = BasisCache(maxsize=2)
+        for k in range(3):
+            y = np.cos(x/1000.) + rng.normal(0, 0.01, x.size)
+            dfit = func_fit(x, y, 'legendre', 5, cache=cache)
+            np.testing.assert_allclose(dfit['coeff'],
+                                       np.polynomial.legendre.legfit(xv, y, 5),
+                                       rtol=1e-8, atol=1e-12)
+            np.testing.assert_allclose(func_val(x, dfit, cache=cache),
+                                       np.polynomial.legendre.legval(xv, dfit['coeff']))
+        self.assertEqual(len(cache), 1)
+        self.assertEqual(cache.misses, 1)
+        self.assertEqual(cache.hits, 5)
+        self.assertIn('hits=5', repr(cache))
+        V = cache.basis(x, 'legendre', 5, x.min(), x.max())
+        self.assertEqual(V.shape, (500, 6))
+        self.assertFalse(V.flags.writeable)
+        w = rng.uniform(0.5, 1.5, x.size)
+        dfit = func_fit(x, y, 'chebyshev', 3, w=w, cache=cache)
+        np.testing.assert_allclose(dfit['coeff'],
+                                   np.polynomial.chebyshev.chebfit(xv, y, 3, w=w))
+        dfit = func_fit(x, y, 'polynomial', 3, cache=cache)
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.misses, 3)
+        dfit = func_fit(x, y, 'polynomial', 3, cache=False)
+        self.assertEqual(cache.misses, 3)
+        cache.clear()
+        self.assertEqual(len(cache), 0)
+        # Values on a multidimensional grid.
+        x2 = x.reshape(20, 25)
+        self.assertEqual(func_val(x2, dfit).shape, (20, 25))
+        np.testing.assert_allclose(func_val(x2, dfit).ravel(), func_val(x, dfit))
+        # The module cache is only used on request, and without it the
+        # numpy fitting functions are used directly.
+        _basis_cache.clear()
+        dfit = func_fit(x, y, 'legendre', 5)
+        np.testing.assert_array_equal(dfit['coeff'], np.polynomial.legendre.legfit(xv, y, 5))
+        np.testing.assert_array_equal(func_val(x, dfit),
+                                      np.polynomial.legendre.legval(xv, dfit['coeff']))
+        func_val(x, dfit)
+        self.assertEqual(len(_basis_cache), 0)
+        func_val(x, dfit, cache=True)
+        self.assertEqual(len(_basis_cache), 1)
+        _basis_cache.clear()
+
+    def test_func_val_scalar(self):
+        """Test evaluation of fits at a scalar.
+        """
+        x = np.linspace(0, 1, 50)
+        for func, deg in (('polynomial', 2), ('legendre', 3), ('bspline', 6)):
+            dfit = func_fit(x, x**2, func, deg)
+            for cache in (False, True):
+                v = func_val(0.5, dfit, cache=cache)
+                self.assertEqual(np.ndim(v), 0)
+                self.assertAlmostEqual(float(v), 0.25, places=6)
+            bfit = func_fit_batch(x, np.vstack((x**2, x)), func, deg)
+            np.testing.assert_allclose(func_val(0.5, bfit), [0.25, 0.5], atol=1e-6)
+        _basis_cache.clear()
+
     def test_iterfit(self):
         """Test iter fit with Legendre.
         """
@@ -137,6 +248,336 @@ class TestFuncFits(unittest.TestCase):
         y2 = func_val(x2, dfit)
         np.testing.assert_allclose(y2[50], 0.99941444872371643)
 
+    def test_iterfit_masked_nan(self):
+        """Test iter fit with non-finite values in the initial mask.
+        """
+        x = np.linspace(0, np.pi, 100)
+        y = np.sin(x)
+        y[10] = np.nan
+        y[[30, 60]] = [2., -2.]
+        initialmask = np.zeros(x.size, dtype=int)
+        initialmask[10] = 1
+        dfit, mask = iter_fit(x, y, 'legendre', 4, initialmask=initialmask)
+        self.assertEqual(np.flatnonzero(mask).tolist(), [10, 30, 60])
+        self.assertTrue(np.isfinite(dfit['coeff']).all())
+        np.testing.assert_allclose(func_val(x, dfit), np.sin(x), atol=2e-3)
+
+    def test_iterfit_batch(self):
+        """Test iter fit on many rows at once.
+        """
+        x = np.linspace(0, np.pi, 100)
+        rng = np.random.RandomState(12345)
+        nrow = 8
+        y = np.sin(x)[np.newaxis, :] + rng.normal(0, 0.02, (nrow, x.size))
+        y[1, 50] = 3.
+        y[2, [10, 20, 30]] = [-2., 2., 1.]
+        y[3, ::7] += 0.5
+        sigma = np.full(y.shape, 0.02)
+        weights = rng.uniform(0.5, 1.5, y.shape)
+        weights[4, 5] = 0.
+        initialmask = np.zeros(y.shape, dtype=int)
+        initialmask[5, 40:45] = 1
+        cases = (dict(),
+                 dict(maxone=False),
+                 dict(sigma=sigma),
+                 dict(sigma=sigma, maxone=False),
+                 dict(weights=weights),
+                 dict(initialmask=initialmask, forceimask=True, maxone=False),
+                 dict(max_rej=2),
+                 dict(niter=3))
+        for case in cases:
+            for func in ('legendre', 'polynomial'):
+                with catch_warnings(record=True):
+                    simplefilter("always")
+                    bfit, bmask = iter_fit_batch(x, y, func, 4, **case)
+                self.assertEqual(bmask.shape, y.shape)
+                yb = func_val(x, bfit)
+                for k in range(nrow):
+                    kcase = dict()
+                    for key in case:
+                        kcase[key] = case[key][k] if isinstance(case[key], np.ndarray) else case[key]
+                    with catch_warnings(record=True):
+                        simplefilter("always")
+                        dfit, mask = iter_fit(x, y[k], func, 4, **kcase)
+                    self.assertEqual(bmask[k].tolist(), mask.tolist())
+                    np.testing.assert_allclose(yb[k], func_val(x, dfit), rtol=1e-8, atol=1e-10)
+        self.assertEqual(bmask[1, 50], 1)
+        with catch_warnings(record=True) as w:
+            simplefilter("always")
+            bfit, bmask = iter_fit_batch(x[:6], y[:, :6], 'legendre', 4)
+            self.assertIn("More parameters than data points - fit might be undesirable",
+                          [str(ww.message) for ww in w])
+
+    def test_fitset(self):
+        """Test the columnar fit container.
+        """
+        x = np.linspace(3600, 9800, 300)
+        rng = np.random.RandomState(3)
+        fits = []
+        for k, func in enumerate(('legendre', 'polynomial', 'chebyshev', 'legendre')):
+            y = np.cos(x/(800. + 100*k)) + rng.normal(0, 0.01, x.size)
+            fits.append(func_fit(x[k:], y[k:], func, 2 + k, fiber=k, name='f{0:d}'.format(k)))
+        fs = FitSet.from_dicts(fits)
+        self.assertEqual(len(fs), 4)
+        self.assertEqual(fs.coeff.shape, (4, 6))
+        self.assertEqual(fs.meta['fiber'].tolist(), [0, 1, 2, 3])
+        self.assertIn('nfit=4', repr(fs))
+        # Shared and per-fit grids.
+        values = fs.evaluate(x)
+        self.assertEqual(values.shape, (4, x.size))
+        for k, f in enumerate(fits):
+            np.testing.assert_allclose(values[k], func_val(x, f))
+        xx = x[np.newaxis, :] + 10.*np.arange(4)[:, np.newaxis]
+        values = fs.evaluate(xx)
+        for k, f in enumerate(fits):
+            np.testing.assert_allclose(values[k], func_val(xx[k], f))
+        with self.assertRaises(ValueError):
+            fs.evaluate(xx[:3])
+        # Access.
+        f1 = fs[1]
+        self.assertEqual(f1['func'], 'polynomial')
+        self.assertEqual(len(f1['coeff']), 4)
+        self.assertEqual(f1['name'], 'f1')
+        np.testing.assert_allclose(func_val(x, f1), func_val(x, fits[1]))
+        sub = fs[fs.func == 'legendre']
+        self.assertEqual(len(sub), 2)
+        self.assertEqual(sub.meta['name'].tolist(), ['f0', 'f3'])
+        self.assertEqual(len(fs.to_dicts()), 4)
+        # From a batch.
+        y = np.sin(x/1000.)[np.newaxis, :] * np.arange(1, 6)[:, np.newaxis]
+        bfit = func_fit_batch(x, y, 'legendre', 3, fiber=np.arange(5), camera='b')
+        bs = FitSet.from_batch(bfit)
+        self.assertEqual(bs.meta['camera'].tolist(), ['b']*5)
+        np.testing.assert_allclose(bs.evaluate(x), func_val(x, bfit))
+        # FITS round trip.
+        hdu = fs.to_hdu()
+        self.assertEqual(hdu.name, 'FITS')
+        fs2 = FitSet.from_hdu(hdu)
+        np.testing.assert_array_equal(fs2.coeff, fs.coeff)
+        self.assertEqual(fs2.func.tolist(), fs.func.tolist())
+        self.assertEqual(fs2.meta['name'].tolist(), fs.meta['name'].tolist())
+        np.testing.assert_allclose(fs2.evaluate(x), fs.evaluate(x))
+        # Errors.
+        with self.assertRaises(ValueError):
+            FitSet(np.zeros((2, 3)), 3, 'legendre', 0., 1.)
+        with self.assertRaises(ValueError):
+            FitSet(np.zeros((2, 3)), 2, 'fourier', 0., 1.)
+        with self.assertRaises(ValueError):
+            FitSet(np.zeros((2, 3)), 2, 'legendre', 0., 1., meta={'fiber': [1, 2, 3]})
+        with self.assertRaises(ValueError):
+            FitSet.from_dicts([dict(fits[0]), fits[1]] + [mk_fit_dict([1.], 0, 'legendre', 0., 1.)])
+
+    def test_iter_fit_pool(self):
+        """Test fitting with a process pool.
+        """
+        x = np.linspace(0, np.pi, 80)
+        rng = np.random.RandomState(4)
+        y = np.sin(x)[np.newaxis, :] + rng.normal(0, 0.02, (30, x.size))
+        y[::3, 40] = 3.
+        sigma = np.full(y.shape, 0.02)
+        with catch_warnings(record=True):
+            simplefilter("always")
+            bfit, bmask = iter_fit_batch(x, y, 'legendre', 4, sigma=sigma)
+        for nproc in (1, 2):
+            fs, mask = iter_fit_pool(x, y, 'legendre', 4, nproc=nproc,
+                                     chunksize=7, sigma=sigma)
+            self.assertEqual(len(fs), 30)
+            np.testing.assert_array_equal(mask, bmask)
+            np.testing.assert_allclose(fs.evaluate(x), func_val(x, bfit))
+        # One grid per fit.
+        xx = x[np.newaxis, :] + 0.01*np.arange(30)[:, np.newaxis]
+        fs, mask = iter_fit_pool(xx, y, 'legendre', 4, nproc=2, chunksize=8)
+        for k in (0, 3, 29):
+            with catch_warnings(record=True):
+                simplefilter("always")
+                dfit, dmask = iter_fit(xx[k], y[k], 'legendre', 4)
+            np.testing.assert_array_equal(mask[k], dmask)
+            np.testing.assert_allclose(fs.coeff[k], dfit['coeff'])
+        with self.assertRaises(ValueError):
+            iter_fit_pool(xx[:3], y, 'legendre', 4)
+        # Warnings from the workers are issued again here.
+        for nproc in (1, 2):
+            with catch_warnings(record=True) as w:
+                simplefilter("always")
+                iter_fit_pool(xx, y, 'legendre', 4, nproc=nproc, chunksize=8, niter=1)
+            messages = sorted(str(m.message) for m in w)
+            expected = []
+            for k in range(30):
+                with catch_warnings(record=True) as ws:
+                    simplefilter("always")
+                    iter_fit(xx[k], y[k], 'legendre', 4, niter=1)
+                expected += ["{0} (fit {1:d})".format(m.message, k) for m in ws]
+            self.assertGreater(len(expected), 0)
+            self.assertEqual(messages, sorted(expected))
+            with catch_warnings(record=True) as w:
+                simplefilter("always")
+                iter_fit_pool(x, y, 'legendre', 4, nproc=nproc, chunksize=8, niter=1)
+            messages = sorted(str(m.message) for m in w)
+            self.assertEqual(messages[0], "Reached maximum number of iterations (fits 0-7)")
+            self.assertEqual(len(messages), 4)
+        results = iter_fit_pool_benchmark(nfit=40, npix=50, nprocs=(1, 2), chunksize=10)
+        self.assertEqual([r[0] for r in results], [1, 2])
+
+    def test_bspline(self):
+        """Test B-spline fits.
+        """
+        x = np.linspace(3600, 9800, 1000)
+        rng = np.random.RandomState(5)
+        y = np.sin(x/80.) + rng.normal(0, 0.01, x.size)
+        w = rng.uniform(0.5, 1.5, x.size)
+        # Compare with a dense least-squares solution.
+        dfit = func_fit(x, y, 'bspline', 100, w=w)
+        self.assertEqual(dfit['coeff'].shape, (101,))
+        xv = 2.0*(x - x.min())/(x.max() - x.min()) - 1.0
+        t = 0.5*(xv + 1.0)*98
+        V = np.zeros((x.size, 101))
+        for c in range(101):
+            # Uniform cubic B-spline centered at knot c - 1.
+            d = np.abs(t - (c - 1))
+            V[:, c] = np.where(d < 1, (4 - 6*d**2 + 3*d**3)/6,
+                               np.where(d < 2, (2 - d)**3/6, 0.))
+        ref = np.linalg.lstsq(V*w[:, np.newaxis], y*w, rcond=None)[0]
+        np.testing.assert_allclose(dfit['coeff'], ref, rtol=1e-6, atol=1e-8)
+        np.testing.assert_allclose(func_val(x, dfit), np.dot(V, ref), atol=1e-8)
+        self.assertLess(np.std(func_val(x, dfit) - np.sin(x/80.)), 0.01)
+        self.assertEqual(func_val(x.reshape(10, 100), dfit).shape, (10, 100))
+        # Rejection.
+        y[[100, 500]] += [1., -1.]
+        dfit, mask = iter_fit(x, y, 'bspline', 100, sigma=np.full(x.size, 0.01), sig_rej=5.)
+        self.assertEqual(np.flatnonzero(mask).tolist(), [100, 500])
+        # Batches.
+        Y = np.vstack([y, 2*y, y[::-1]])
+        bfit = func_fit_batch(x, Y, 'bspline', 100)
+        np.testing.assert_allclose(bfit['coeff'][1], 2*bfit['coeff'][0])
+        np.testing.assert_allclose(func_val(x, bfit)[2],
+                                   func_val(x, func_fit(x, Y[2], 'bspline', 100)))
+        bfit, bmask = iter_fit_batch(x, Y, 'bspline', 100, sigma=0.01, sig_rej=5.)
+        self.assertEqual(bmask[0].tolist(), mask.tolist())
+        fs = FitSet.from_batch(bfit)
+        np.testing.assert_allclose(fs.evaluate(x), func_val(x, bfit))
+        # Gaps in the data leave coefficients unconstrained.
+        good = (x < 5000) | (x > 6000)
+        with catch_warnings(record=True) as w:
+            simplefilter("always")
+            dfit = func_fit(x[good], y[good], 'bspline', 80, xmin=x.min(), xmax=x.max())
+            self.assertIn('conditioned', str(w[-1].message))
+        self.assertTrue(np.isfinite(dfit['coeff']).all())
+        with self.assertRaises(ValueError):
+            func_fit(x, y, 'bspline', 2)
+
+    def test_robust_fit(self):
+        """Test robust fits by iteratively reweighted least squares.
+        """
+        x = np.linspace(0, np.pi, 200)
+        rng = np.random.RandomState(6)
+        truth = np.sin(x)
+        y = truth + rng.normal(0, 0.01, x.size)
+        bad = rng.choice(x.size, 20, replace=False)
+        y[bad] += rng.uniform(0.5, 2.0, bad.size)
+        plain = func_val(x, func_fit(x, y, 'legendre', 5))
+        for loss in ('huber', 'tukey'):
+            dfit, rw = robust_fit(x, y, 'legendre', 5, loss=loss)
+            self.assertEqual(rw.shape, x.shape)
+            resid = np.abs(func_val(x, dfit) - truth)
+            self.assertLess(resid.max(), np.abs(plain - truth).max())
+            self.assertLess(rw[bad].max(), 0.2)
+        self.assertEqual(rw[bad].max(), 0.)
+        self.assertLess(np.abs(func_val(x, dfit) - truth).max(), 0.01)
+        # Known errors, weights and batches.
+        Y = np.vstack([y, truth + rng.normal(0, 0.01, x.size), 3*y])
+        weights = np.ones(Y.shape)
+        weights[1, :10] = 0.
+        bfit, brw = robust_fit(x, Y, 'legendre', 5, loss='tukey',
+                               weights=weights, sigma=0.01, extra='batch')
+        self.assertEqual(bfit['coeff'].shape, (3, 6))
+        self.assertEqual(bfit['extra'], 'batch')
+        self.assertTrue((brw[1, :10] == 0).all())
+        for k in (0, 1):
+            sfit, srw = robust_fit(x, Y[k], 'legendre', 5, loss='tukey',
+                                   weights=weights[k], sigma=0.01)
+            np.testing.assert_allclose(bfit['coeff'][k], sfit['coeff'], atol=1e-6)
+        # B-splines.
+        dfit, rw = robust_fit(x, y, 'bspline', 12)
+        self.assertLess(np.abs(func_val(x, dfit) - truth).max(), 0.05)
+        with catch_warnings(record=True) as w:
+            simplefilter("always")
+            robust_fit(x, y, 'legendre', 5, niter=1)
+            self.assertEqual(str(w[-1].message), "Reached maximum number of iterations")
+        with self.assertRaises(ValueError):
+            robust_fit(x, y, 'legendre', 5, loss='cauchy')
+
+    def test_fit2d(self):
+        """Test 2D surface fits.
+        """
+        x = np.linspace(0., 4000., 60)
+        y = np.linspace(3600., 9800., 80)
+        rng = np.random.RandomState(7)
+        xx, yy = np.meshgrid(x, y, indexing='ij')
+        truth = 1e-4*xx + (yy/1e4)**3 + 1e-8*xx*yy
+        z = truth + rng.normal(0, 0.001, xx.shape)
+        xv = 2.0*xx/4000. - 1.0
+        yv = 2.0*(yy - 3600.)/6200. - 1.0
+        V = np.polynomial.legendre.legvander2d(xv.ravel(), yv.ravel(), [3, 4])
+        ref = np.linalg.lstsq(V, z.ravel(), rcond=None)[0].reshape(4, 5)
+        # Scattered and gridded fits agree with the full design matrix.
+        sfit = func_fit2d(xx.ravel(), yy.ravel(), z.ravel(), 'legendre', (3, 4))
+        gfit = func_fit2d(x, y, z, 'legendre', (3, 4), grid=True, camera='r1')
+        self.assertEqual(gfit['order'], (3, 4))
+        self.assertEqual(gfit['camera'], 'r1')
+        np.testing.assert_allclose(sfit['coeff'], ref, atol=1e-10)
+        np.testing.assert_allclose(gfit['coeff'], ref, atol=1e-10)
+        # Evaluation.
+        model = func_val2d(x, y, gfit, grid=True)
+        self.assertEqual(model.shape, z.shape)
+        np.testing.assert_allclose(model, np.polynomial.legendre.leggrid2d(xv[:, 0], yv[0], ref))
+        np.testing.assert_allclose(func_val2d(xx, yy, gfit), model)
+        self.assertLess(np.abs(model - truth).max(), 0.01)
+        # Weighted grids use the per-axis normal equations.
+        w = rng.uniform(0.5, 1.5, z.shape)
+        w[5, :] = 0.
+        gfit = func_fit2d(x, y, z, 'chebyshev', 3, w=w, grid=True)
+        sfit = func_fit2d(xx.ravel(), yy.ravel(), z.ravel(), 'chebyshev', 3, w=w.ravel())
+        np.testing.assert_allclose(gfit['coeff'], sfit['coeff'], atol=1e-10)
+        with self.assertRaises(ValueError):
+            func_fit2d(x, y, z.T, 'legendre', 3, grid=True)
+        # Rejection.
+        z[10, 20] += 1.
+        z[30, 70] -= 1.
+        for grid in (True, False):
+            if grid:
+                dfit, mask = iter_fit2d(x, y, z, 'legendre', (3, 4), grid=True)
+            else:
+                dfit, mask = iter_fit2d(xx.ravel(), yy.ravel(), z.ravel(), 'legendre', (3, 4))
+                mask = mask.reshape(z.shape)
+            self.assertEqual(mask[10, 20], 1)
+            self.assertEqual(mask[30, 70], 1)
+            np.testing.assert_allclose(func_val2d(x, y, dfit, grid=True), model, atol=1e-3)
+        dfit, mask2 = iter_fit2d(x, y, z, 'legendre', (3, 4), grid=True,
+                                 maxone=False, sigma=np.full(z.shape, 0.001), sig_rej=10.)
+        self.assertEqual(np.flatnonzero(mask2).tolist(), [10*80 + 20, 30*80 + 70])
+        # As in iter_fit, the final fit is unweighted, and the initial mask
+        # can be forced.
+        dfit, mask3 = iter_fit2d(x, y, z, 'legendre', (3, 4), grid=True, weights=w)
+        ufit = func_fit2d(x, y, z, 'legendre', (3, 4), w=(mask3 == 0).astype(float),
+                          grid=True)
+        np.testing.assert_allclose(dfit['coeff'], ufit['coeff'], atol=1e-10)
+        imask = np.zeros(z.shape, dtype=int)
+        imask[0, 0] = 1
+        dfit, mask4 = iter_fit2d(x, y, z, 'legendre', (3, 4), grid=True, maxone=False,
+                                 initialmask=imask, forceimask=True)
+        self.assertEqual(mask4[0, 0], 1)
+        with catch_warnings(record=True) as wl:
+            simplefilter('always')
+            iter_fit2d(x, y, z, 'legendre', (3, 4), grid=True, forceimask=True)
+        self.assertIn('Initial mask cannot be enforced', str(wl[0].message))
+        # Bases are only kept in the module cache on request.
+        _basis_cache.clear()
+        func_val2d(xx, yy, gfit)
+        self.assertEqual(len(_basis_cache), 0)
+        func_val2d(x, y, gfit, grid=True, cache=True)
+        self.assertEqual(len(_basis_cache), 2)
+        _basis_cache.clear()
+
 
 def test_suite():
     """Allows testing of only this module with the command::
@@ -5,6 +5,7 @@
 from __future__ import absolute_import, print_function
 import unittest
 from tempfile import NamedTemporaryFile
+from warnings import catch_warnings, simplefilter
 from pkg_resources import resource_filename
 import numpy as np
 from astropy.io import fits
@@ -106,6 +107,50 @@ class TestSKLearn(unittest.TestCase):
         s = model.sample(n_samples=2, random_state=rs)
         self.assertTrue(np.allclose(s, np.array([[3.51574031, -1.66767452],
                                                  [2.09077549, 2.06558071]])))
+        # Check the distribution of many samples, including a component
+        # with a singular covariance.
+        model = GMM(np.array([0.3, 0.7]),
+                    np.array([[1.0, 2.0], [-3.0, 0.5]]),
+                    np.array([[[2.0, 0.6], [0.6, 1.0]],
+                              [[1.0, 1.0], [1.0, 1.0]]]))
+        s = model.sample(n_samples=200000, random_state=RS(42))
+        # The second component lies on the line y = x + 3.5.
+        second = np.isclose(s[:, 1] - s[:, 0], 3.5)
+        self.assertAlmostEqual(second.mean(), 0.7, places=2)
+        self.assertTrue(np.allclose(s[~second].mean(axis=0), [1.0, 2.0], atol=0.02))
+        self.assertTrue(np.allclose(np.cov(s[~second].T), [[2.0, 0.6], [0.6, 1.0]], atol=0.03))
+        self.assertTrue(np.allclose(s[second].var(axis=0), [1.0, 1.0], atol=0.02))
+        # Samples are not ordered by component.
+        self.assertLess(abs(second[:100000].mean() - second[100000:].mean()), 0.01)
+        # Changes to the covariances are used by later calls.
+        model.covars = np.array([[[2.0, 0.6], [0.6, 1.0]],
+                                 [[4.0, 0.0], [0.0, 1.0]]])
+        s = model.sample(n_samples=200000, random_state=RS(42))
+        self.assertLess(np.isclose(s[:, 1] - s[:, 0], 3.5).mean(), 0.001)
+        covars = model.covars.copy()
+        covars[1, 0, 0] = 1.0
+        model.covars = covars
+        s2 = model.sample(n_samples=200000, random_state=RS(42))
+        self.assertLess(s2[:, 0].var(), s[:, 0].var())
+        # The factors are computed once per assignment.
+        factors = model._factors
+        model.sample(n_samples=10, random_state=RS(1))
+        self.assertIs(model._factors, factors)
+        # Covariances that are not positive semi-definite give a warning.
+        with catch_warnings(record=True) as w:
+            simplefilter('always')
+            model = GMM(np.array([1.0]), np.zeros((1, 2)),
+                        np.array([[[1.0, 2.0], [2.0, 1.0]]]))
+            model.sample(n_samples=10, random_state=RS(1))
+        self.assertEqual(len(w), 1)
+        self.assertIs(w[0].category, RuntimeWarning)
+        self.assertIn('not positive-semidefinite', str(w[0].message))
+        # Rounding errors in singular covariances do not.
+        with catch_warnings(record=True) as w:
+            simplefilter('always')
+            model.covars = np.array([[[1.0, 1.0 + 1e-12], [1.0 + 1e-12, 1.0]]])
+            model.sample(n_samples=10, random_state=RS(1))
+        self.assertEqual(len(w), 0)
 
 
 def test_suite():
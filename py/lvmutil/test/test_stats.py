@@ -7,7 +7,9 @@ from __future__ import (absolute_import, division,
 # The line above will help with 2to3 support.
 import unittest
 import numpy as np
-from ..stats import perc
+import pickle
+from ..stats import (perc, perc_batch, sigma_clipped_stats, weighted_percentile,
+                     binned_stats, QuantileSketch, RunningStats, RunningHistogram)
 
 
 class TestStats(unittest.TestCase):
@@ -31,6 +33,279 @@ class TestStats(unittest.TestCase):
         np.testing.assert_allclose(percv, np.array([0.24316108649289372,
                                                    0.96590623568871437]))
 
+    def test_weighted_percentile(self):
+        """Test weighted percentiles.
+        """
+        rng = np.random.RandomState(11)
+        x = rng.normal(size=1000)
+        per = [0., 2.5, 16., 50., 84., 97.5, 100.]
+        # Equal weights are the same as numpy.
+        np.testing.assert_allclose(weighted_percentile(x, per), np.percentile(x, per))
+        np.testing.assert_allclose(weighted_percentile(x, per, np.full(x.size, 3.)),
+                                   np.percentile(x, per))
+        np.testing.assert_allclose(perc(x, 95., weights=np.ones(x.size)), perc(x, 95.))
+        # Zero weights are ignored, and the weight before the values sets
+        # their positions, here 0, 0.6, 0.8, 1.
+        y = np.array([1., 2., 3., 4.])
+        self.assertAlmostEqual(weighted_percentile(y, 50., [1, 0, 0, 1]), 2.5)
+        self.assertAlmostEqual(weighted_percentile(y, 50., [3, 1, 1, 1]), 1. + 0.5/0.6)
+        self.assertAlmostEqual(weighted_percentile(y, 70., [3, 1, 1, 1]), 2.5)
+        self.assertEqual(weighted_percentile(y, 100., [3, 1, 1, 1]), 4.)
+        with self.assertRaises(ValueError):
+            weighted_percentile(y, 50., [1, -1, 1, 1])
+
+    def test_binned_stats(self):
+        """Test statistics in bins.
+        """
+        rng = np.random.RandomState(12)
+        x = rng.uniform(0., 1., 5000)
+        y = rng.normal(size=x.size) * (1 + x)
+        w = rng.uniform(0., 2., x.size)
+        per = (2.5, 16, 50, 84, 97.5)
+        stats = binned_stats(x, y, bins=7, range=(0.1, 0.9), per=per)
+        edges = np.linspace(0.1, 0.9, 8)
+        np.testing.assert_allclose(stats['edges'], edges)
+        x_i = np.digitize(x, edges) - 1
+        for b in range(7):
+            yb = y[x_i == b]
+            self.assertEqual(stats['count'][b], yb.size)
+            np.testing.assert_allclose(stats['mean'][b], yb.mean())
+            np.testing.assert_allclose(stats['percentiles'][b], np.percentile(yb, per))
+        stats = binned_stats(x, y, bins=[0., 0.5, 0.6, 2.0, 3.0], weights=w)
+        for b, (lo, hi) in enumerate([(0., 0.5), (0.5, 0.6)]):
+            k = (x >= lo) & (x < hi)
+            np.testing.assert_allclose(stats['weight'][b], w[k].sum())
+            np.testing.assert_allclose(stats['mean'][b], np.average(y[k], weights=w[k]))
+            np.testing.assert_allclose(stats['percentiles'][b],
+                                       weighted_percentile(y[k], per, w[k]))
+        self.assertEqual(stats['count'][3], 0)
+        self.assertTrue(np.isnan(stats['percentiles'][3]).all())
+        self.assertTrue(np.isnan(stats['mean'][3]))
+        # The last bin includes its right edge, as in numpy.histogram.
+        stats = binned_stats(x, y, bins=9)
+        self.assertEqual(stats['count'].sum(), x.size)
+        self.assertEqual(stats['count'].tolist(), np.histogram(x, bins=9)[0].tolist())
+        # No data.
+        stats = binned_stats([], [], bins=4, range=(0., 1.))
+        self.assertEqual(stats['count'].tolist(), [0, 0, 0, 0])
+        self.assertEqual(stats['weight'].dtype, np.float64)
+        self.assertTrue(np.isnan(stats['percentiles']).all())
+        with self.assertRaises(ValueError):
+            binned_stats([], [], bins=4)
+
+    def test_perc_batch(self):
+        """Test percentile bounds along an axis.
+        """
+        rng = np.random.RandomState(9)
+        x = rng.normal(size=(7, 50, 3))
+        # Same as perc, for each distribution.
+        b = perc_batch(x, axis=1)
+        self.assertEqual(b.shape, (2, 7, 3))
+        for i in range(7):
+            for j in range(3):
+                np.testing.assert_allclose(b[:, i, j], perc(x[i, :, j]))
+        y = np.sin(np.linspace(0, np.pi, 100))
+        np.testing.assert_allclose(perc_batch(y), perc(y))
+        # Several pairs, into a preallocated array.
+        per = [50., 68.2, 95.]
+        out = np.zeros((3, 2, 7, 50))
+        result = perc_batch(x, per, axis=2, out=out)
+        self.assertIs(result, out)
+        for k, p in enumerate(per):
+            np.testing.assert_allclose(out[k, :, 4, 10], perc(x[4, 10], p))
+        # Arrays that can not hold the result directly are filled by copying.
+        out2 = np.zeros((50, 7, 2, 3), dtype=np.float32).T
+        self.assertIs(perc_batch(x, per, axis=2, out=out2), out2)
+        np.testing.assert_allclose(out2, out, rtol=1e-6)
+        with self.assertRaises(ValueError):
+            perc_batch(x, per, axis=2, out=np.zeros((3, 2, 7)))
+        # NaN and masked values.
+        z = rng.normal(size=(40, 30))
+        nans = rng.uniform(size=z.shape) < 0.2
+        z[nans] = np.nan
+        z[3] = np.nan
+        b = perc_batch(z, [68.2, 95.])
+        for i in (0, 1, 20):
+            np.testing.assert_allclose(b[:, :, i],
+                                       [perc(z[i][~nans[i]]), perc(z[i][~nans[i]], 95.)])
+        self.assertTrue(np.isnan(b[:, :, 3]).all())
+        b = perc_batch(z, ignore_nan=False)
+        self.assertTrue(np.isnan(b[:, nans.any(axis=1)]).all())
+        zm = np.ma.masked_invalid(z)
+        b = perc_batch(zm, axis=0, ignore_nan=False)
+        for j in (0, 5):
+            np.testing.assert_allclose(b[:, j], perc(zm[:, j].compressed()))
+        with self.assertRaises(ValueError):
+            perc_batch(z, 120.)
+
+    def test_sigma_clipped_stats(self):
+        """Test vectorized sigma clipping.
+        """
+        rng = np.random.RandomState(10)
+        x = rng.normal(10., 1., size=(6, 500))
+        x[0, :20] = 100.
+        x[2, 5] = np.nan
+        x[3, :] = np.nan
+
+        def clip1(y, sl=3., su=3., maxiters=5):
+            # Reference implementation for one distribution.
+            good = np.isfinite(y)
+            for k in range(maxiters):
+                med = np.median(y[good])
+                std = np.std(y[good])
+                new = good & (y >= med - sl*std) & (y <= med + su*std)
+                if new.sum() == good.sum():
+                    break
+                good = new
+            return good
+
+        mean, median, std, mad, mask = sigma_clipped_stats(x, axis=1, return_mask=True)
+        self.assertEqual(mean.shape, (6,))
+        self.assertEqual(mask.shape, x.shape)
+        for i in (0, 1, 2, 5):
+            good = clip1(x[i])
+            np.testing.assert_array_equal(~mask[i], good)
+            np.testing.assert_allclose(mean[i], x[i][good].mean())
+            np.testing.assert_allclose(median[i], np.median(x[i][good]))
+            np.testing.assert_allclose(std[i], x[i][good].std())
+            np.testing.assert_allclose(mad[i], 1.4826*np.median(np.abs(x[i][good] - median[i])))
+        self.assertTrue(mask[0, :20].all())
+        self.assertTrue(np.isnan([mean[3], median[3], std[3], mad[3]]).all())
+        # Other axes, asymmetric limits, masks.
+        stats = sigma_clipped_stats(x.T, axis=0, sigma_lower=2., sigma_upper=4.)
+        good = clip1(x[1], 2., 4.)
+        np.testing.assert_allclose(stats[0][1], x[1][good].mean())
+        xm = np.ma.array(x, mask=np.zeros(x.shape, dtype=bool))
+        xm[1, :250] = np.ma.masked
+        mean2 = sigma_clipped_stats(xm, axis=1, cenfunc='mean')[0]
+        np.testing.assert_allclose(mean2[4], mean[4])
+        self.assertNotEqual(mean2[1], mean[1])
+        m, md, s, d = sigma_clipped_stats(x[0])
+        self.assertAlmostEqual(md, median[0])
+        self.assertIsInstance(m, float)
+        with self.assertRaises(ValueError):
+            sigma_clipped_stats(x, cenfunc='mode')
+
+    def test_quantile_sketch(self):
+        """Test the streaming quantile sketch.
+        """
+        rng = np.random.RandomState(8)
+        # Exact for small inputs.
+        y = rng.normal(size=150)
+        sketch = QuantileSketch(k=200, seed=1).update(y)
+        self.assertEqual(sketch.error_bound(), 0.)
+        self.assertEqual(sketch.quantile(0.), y.min())
+        self.assertEqual(sketch.quantile(1.), y.max())
+        self.assertEqual(sketch.quantile(0.5), np.sort(y)[74])
+        # Streaming in chunks, in several sketches that are then merged.
+        data = rng.standard_cauchy(200000)
+        data[::1000] = np.nan
+        sketches = [QuantileSketch(k=200, seed=k) for k in range(4)]
+        for k, chunk in enumerate(np.array_split(data, 40)):
+            sketches[k % 4].update(chunk)
+        sketch = sketches[0]
+        for other in sketches[1:]:
+            sketch.merge(pickle.loads(pickle.dumps(other)))
+        good = data[~np.isnan(data)]
+        self.assertEqual(sketch.n, good.size)
+        self.assertEqual(len(sketch), good.size)
+        self.assertLess(sketch.size, 3*200)
+        self.assertIn('n={0:d}'.format(good.size), repr(sketch))
+        per = np.array([2.5, 16., 50., 84., 97.5])
+        ranks = np.searchsorted(np.sort(good), sketch.percentile(per))/good.size
+        err = np.abs(ranks - per/100.)
+        self.assertTrue((err <= sketch.error_bound()).all())
+        self.assertTrue((err <= sketch.expected_error()).all())
+        self.assertLess(sketch.expected_error(), 0.02)
+        np.testing.assert_allclose(sketch.cdf(sketch.perc(95.)), [0.025, 0.975], atol=0.02)
+        self.assertEqual(sketch.quantile(1.), good.max())
+        # Empty sketches and errors.
+        self.assertTrue(np.isnan(QuantileSketch().quantile(0.5)))
+        with self.assertRaises(ValueError):
+            sketch.quantile(1.5)
+        with self.assertRaises(ValueError):
+            sketch.merge(QuantileSketch(k=100))
+        with self.assertRaises(ValueError):
+            QuantileSketch(k=4)
+
+    def test_running_stats(self):
+        """Test mergeable running statistics.
+        """
+        rng = np.random.RandomState(13)
+        data = rng.normal(1e6, 3., size=(1000, 4))
+        data[5, 1] = np.nan
+        chunks = np.array_split(data, 7)
+        # Accumulate in two groups, serialize one, and merge.
+        a = RunningStats(axis=0)
+        b = RunningStats(axis=0)
+        for k, chunk in enumerate(chunks):
+            (a if k % 2 else b).update(chunk)
+        c = RunningStats.from_bytes(b.to_bytes(), axis=0).merge(a)
+        np.testing.assert_array_equal(c.n, [1000, 999, 1000, 1000])
+        np.testing.assert_allclose(c.mean, np.nanmean(data, axis=0))
+        np.testing.assert_allclose(c.var(), np.nanvar(data, axis=0), rtol=1e-9)
+        np.testing.assert_allclose(c.std(ddof=1), np.nanstd(data, axis=0, ddof=1), rtol=1e-9)
+        np.testing.assert_array_equal(c.min, np.nanmin(data, axis=0))
+        np.testing.assert_array_equal(c.max, np.nanmax(data, axis=0))
+        self.assertIn('shape=(4,)', repr(c))
+        # Scalar statistics, and empty chunks.
+        s = RunningStats()
+        for chunk in chunks:
+            s.update(chunk[:, 0])
+        s.update([])
+        s.merge(RunningStats())
+        self.assertAlmostEqual(s.mean, data[:, 0].mean())
+        self.assertEqual(s.min, data[:, 0].min())
+        e = RunningStats().update([np.nan])
+        self.assertTrue(np.isnan(e.mean))
+        self.assertTrue(np.isnan(e.var()))
+        with self.assertRaises(ValueError):
+            c.update(np.zeros((5, 3)))
+        # An accumulator without values can be serialized and merged.
+        empty = RunningStats(axis=0)
+        self.assertTrue(np.isnan(empty.mean))
+        self.assertTrue(np.isnan(empty.std()))
+        e = RunningStats.from_bytes(empty.to_bytes(), axis=0)
+        self.assertIsNone(e.n)
+        self.assertTrue(np.isnan(e.mean))
+        e.merge(c)
+        np.testing.assert_allclose(e.mean, c.mean)
+        c2 = RunningStats.from_bytes(c.to_bytes(), axis=0).merge(
+            RunningStats.from_bytes(RunningStats().to_bytes()))
+        np.testing.assert_array_equal(c2.mean, c.mean)
+
+    def test_running_histogram(self):
+        """Test mergeable histograms.
+        """
+        rng = np.random.RandomState(14)
+        x = rng.normal(size=10000)
+        x[:10] = np.nan
+        x[10] = 4.
+        w = rng.uniform(size=x.size)
+        h1 = RunningHistogram(40, range=(-4., 4.))
+        h2 = RunningHistogram(40, range=(-4., 4.))
+        h1.update(x[:6000], weights=w[:6000])
+        h2.update(x[6000:], weights=w[6000:])
+        h = RunningHistogram.from_bytes(h1.to_bytes()).merge(h2)
+        good = ~np.isnan(x)
+        counts, edges = np.histogram(x[good], bins=40, range=(-4., 4.), weights=w[good])
+        np.testing.assert_allclose(h.counts, counts)
+        np.testing.assert_allclose(h.edges, edges)
+        inside = (x[good] >= -4.) & (x[good] <= 4.)
+        np.testing.assert_allclose(h.underflow + h.overflow, w[good][~inside].sum())
+        np.testing.assert_allclose(h.total, w[good].sum())
+        self.assertIn('nbins=40', repr(h))
+        # Irregular bins.
+        edges = [-3., -1., 0., 0.5, 3.]
+        h = RunningHistogram(edges).update(x)
+        np.testing.assert_array_equal(h.counts, np.histogram(x[good], bins=edges)[0])
+        with self.assertRaises(ValueError):
+            h.merge(h1)
+        with self.assertRaises(ValueError):
+            RunningHistogram(10)
+        with self.assertRaises(ValueError):
+            RunningHistogram([0., 2., 1.])
+
 
 def test_suite():
     """Allows testing of only this module with the command::